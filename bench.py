@@ -0,0 +1,539 @@
+import argparse
+import asyncio
+import collections
+import concurrent.futures
+import functools
+import re
+import statistics
+import subprocess
+import sys
+import time
+
+import display
+import fake_game
+import generate
+import hex_model
+import input_dispatch
+import main
+import pipeline
+import schedule
+
+
+def _boards(args):
+    for seed in range(args.seed, args.seed + args.boards):
+        yield generate.generate_board(radius=args.radius, seed=seed)
+
+
+def load_level(path):
+    """
+    Read a recorded level: the board as first captured, a blank line, then the board solved.
+
+    Both are in the format `main.save_debug_board` writes, so a level
+    can be recorded from the debug board saved at its start, and the
+    one saved from a screenshot of it finished. The `remaining` counter
+    isn't saved, but it's the number of blue hexes yet to be uncovered.
+    Returns `(board, solution)`, as `generate.generate_board` does.
+    """
+    with open(path) as f:
+        start, solved = f.read().strip().split('\n\n')
+    solution = main.parse_debug_board(solved)._board
+    board = main.parse_debug_board(start)
+    covered = [coord for coord, hex_ in board._board.items() if hex_.color == hex_model.Color.yellow]
+    if any(solution[coord].color == hex_model.Color.yellow for coord in covered):
+        raise ValueError("{}: the solved board has covered hexes".format(path))
+    board.remaining = sum(solution[coord].color == hex_model.Color.blue for coord in covered)
+    return board, solution
+
+
+def bench_regions(args):
+    """
+    Time full solves, and report how the region store grows over them.
+    """
+    times = []
+    peaks = []
+    tier_stats = {}
+    executor = None
+    if args.workers:
+        executor = concurrent.futures.ProcessPoolExecutor(args.workers)
+    for board, _ in _boards(args):
+        board.executor = executor
+        board.sparse = args.sparse
+        if args.tiers:
+            board.tiers = args.tiers
+        t = time.perf_counter()
+        deductions = list(board.solve())
+        times.append(time.perf_counter() - t)
+        for name, stats in board.tier_stats.items():
+            tier_stats.setdefault(name, collections.Counter()).update(stats)
+        history = board._regions.history
+        peaks.append(max(history, default=0))
+        print('{:>4} deductions  {:>3} rounds  regions per round: {}'.format(
+            len(deductions),
+            len(history),
+            ' '.join(map(str, history)),
+        ))
+    print('solve time: mean {:.4f}s  max {:.4f}s'.format(statistics.mean(times), max(times)))
+    print('peak regions: mean {:.1f}  max {}'.format(statistics.mean(peaks), max(peaks)))
+    for name, stats in tier_stats.items():
+        print('  {:<12} {:>5} runs  {:>5} with progress  {:>5} deductions  {:.3f}s'.format(
+            name, stats['runs'], stats['progress'], stats['deductions'], stats['seconds'],
+        ))
+    if executor is not None:
+        executor.shutdown()
+
+
+def bench_first(args):
+    """
+    Time to the first deduction of a turn, apart from the whole solve, with eager and lazy population.
+
+    Each board is solved once and its deductions uncovered, as the game
+    would; the timed solve is the next turn's, which is what a player
+    waits on between clicks.
+    """
+    for lazy in (False, True):
+        firsts = []
+        totals = []
+        for board, solution in _boards(args):
+            board.lazy = lazy
+            deductions = list(board.solve())
+            board.apply_clicked()
+            for coord, _ in deductions:
+                board[coord] = solution[coord].clone()
+
+            t = time.perf_counter()
+            first = None
+            for _ in board.solve():
+                if first is None:
+                    first = time.perf_counter() - t
+            totals.append(time.perf_counter() - t)
+            firsts.append(totals[-1] if first is None else first)
+        print('{:<6} first deduction: mean {:.4f}s  max {:.4f}s   whole solve: mean {:.4f}s'.format(
+            'lazy' if lazy else 'eager', statistics.mean(firsts), max(firsts), statistics.mean(totals),
+        ))
+
+
+def bench_clicks(args):
+    """
+    Compare mouse travel for clicks in solver order against path-ordered clicks.
+    """
+    unordered = []
+    ordered = []
+    rates = []
+    for board, _ in _boards(args):
+        fake_game.place_on_screen(board)
+        commands = list(board.solve())
+        if not commands:
+            continue
+        points = [
+            input_dispatch.screen_position(board, coord, (0, 0))
+            for coord, _ in commands
+        ]
+        unordered.append(input_dispatch.path_length(points, start=(0, 0)))
+        backend = input_dispatch.RecordingBackend(start=(0, 0))
+        t = time.perf_counter()
+        stats = input_dispatch.dispatch(board, commands, (0, 0), backend)
+        rates.append(stats.clicks / (time.perf_counter() - t))
+        ordered.append(stats.distance)
+    print('mouse travel: solver order {:.0f}px  path order {:.0f}px'.format(
+        statistics.mean(unordered), statistics.mean(ordered),
+    ))
+    print('dispatch rate (recording backend, including ordering): {:.0f} clicks/s'.format(
+        statistics.mean(rates),
+    ))
+
+
+def _run_sequential(board, game, settle):
+    """
+    The original screen loop: solve everything, click everything, wait, recapture.
+    """
+    while not board.is_solved:
+        commands = list(board.solve())
+        if not commands:
+            break
+        input_dispatch.dispatch(board, commands, (0, 0), game)
+        if board.is_solved:
+            break
+        time.sleep(settle)
+        for coord, hex_ in game.capture([coord for coord, _ in commands]).items():
+            board[coord] = hex_
+
+
+def _replay_turns(board, game, clicks_per_turn, info_first, read_all):
+    """
+    Play a level turn by turn, clicking at most `clicks_per_turn` hexes before each capture.
+
+    Returns the number of captures, and of hexes read back.
+    """
+    captures = 0
+    read = 0
+    deferred = []
+    while True:
+        commands = deferred + list(board.solve())
+        if not commands:
+            break
+        if info_first:
+            commands, deferred = schedule.plan_turn(board, commands, clicks_per_turn)
+        elif clicks_per_turn:
+            commands, deferred = commands[:clicks_per_turn], commands[clicks_per_turn:]
+        input_dispatch.dispatch(board, commands, (0, 0), game)
+        if board.is_solved:
+            continue
+        coords = [coord for coord, _ in commands] if read_all else schedule.worth_reading(board, commands)
+        if coords:
+            captures += 1
+            read += len(coords)
+            for coord, hex_ in game.capture(coords).items():
+                board[coord] = hex_
+    return captures, read
+
+
+def bench_turns(args):
+    """
+    Count the screen captures it takes to finish levels, replayed against a simulated game.
+
+    Compares clicking in solver order and reading back every click,
+    reading back only hexes whose clues could help, and also clicking
+    the most informative hexes first. Generated boards only approximate
+    the game's levels; for numbers that hold in the game, replay
+    recorded levels with `--levels` (see `load_level`).
+    """
+    strategies = [
+        ('solver order', False, True),
+        ('read useful', False, False),
+        ('info first', True, False),
+    ]
+    if args.levels:
+        levels = [functools.partial(load_level, path) for path in args.levels]
+        print('{} recorded levels'.format(len(levels)))
+    else:
+        levels = [
+            functools.partial(generate.generate_board, radius=args.radius, seed=seed)
+            for seed in range(args.seed, args.seed + args.boards)
+        ]
+        print('{} generated boards of radius {}'.format(len(levels), args.radius))
+    results = {name: [] for name, _, _ in strategies}
+    clicks_per_turn = args.clicks_per_turn or None
+    for level in levels:
+        for name, info_first, read_all in strategies:
+            board, solution = level()
+            game = fake_game.FakeGame(board, solution)
+            results[name].append(_replay_turns(board, game, clicks_per_turn, info_first, read_all))
+    for name, runs in results.items():
+        captures, read = zip(*runs)
+        print('{:<13} captures per level: mean {:.2f}  max {}   hexes read: mean {:.1f}'.format(
+            name, statistics.mean(captures), max(captures), statistics.mean(read),
+        ))
+
+
+def bench_pipeline(args):
+    """
+    Time whole levels against a simulated game, sequentially and pipelined.
+    """
+    def game_for(board, solution):
+        return fake_game.FakeGame(
+            board, solution, click_delay=args.click_delay, capture_delay=args.capture_delay,
+        )
+
+    sequential = []
+    pipelined = []
+    first_clicks = []
+    for board, solution in _boards(args):
+        t = time.perf_counter()
+        _run_sequential(board, game_for(board, solution), args.settle)
+        sequential.append(time.perf_counter() - t)
+
+        board, solution = generate.generate_board(radius=args.radius, seed=args.seed + len(pipelined))
+        game = game_for(board, solution)
+        stats = asyncio.run(pipeline.run(board, game, game, settle=args.settle))
+        pipelined.append(stats.seconds)
+        if stats.first_click is not None:
+            first_clicks.append(stats.first_click)
+        print('sequential {:.2f}s  pipelined {:.2f}s  ({} clicks, {} captures, {} solves)'.format(
+            sequential[-1], pipelined[-1], stats.clicks, stats.captures, stats.solves,
+        ))
+    print('mean: sequential {:.2f}s  pipelined {:.2f}s  first click {:.3f}s'.format(
+        statistics.mean(sequential), statistics.mean(pipelined), statistics.mean(first_clicks),
+    ))
+
+
+def bench_render(args):
+    """
+    Compare redrawing the whole board every turn against incremental redraws.
+    """
+    full_fns = {'small': display.display_board, 'large': display.display_full_board}
+    for layout, full_fn in full_fns.items():
+        full = [0.0, 0]
+        incremental = [0.0, 0]
+        turns = 0
+        for board, solution in _boards(args):
+            renderer = display.BoardRenderer(layout)
+            renderer.render(board)
+            # Uncover the board a handful of hexes per turn.
+            hidden = [coord for coord, hex_ in board._board.items() if hex_.color == hex_model.Color.yellow]
+            for i in range(0, len(hidden), args.per_turn):
+                for coord in hidden[i:i + args.per_turn]:
+                    board[coord] = solution[coord]
+                for totals, render in ((full, full_fn), (incremental, renderer.render)):
+                    t = time.perf_counter()
+                    output = render(board)
+                    totals[0] += time.perf_counter() - t
+                    totals[1] += len(output)
+                turns += 1
+        print('{:<6} full: {:.3f}ms {:.0f} bytes/turn  incremental: {:.3f}ms {:.0f} bytes/turn'.format(
+            layout,
+            full[0] / turns * 1000, full[1] / turns,
+            incremental[0] / turns * 1000, incremental[1] / turns,
+        ))
+
+
+def synthetic_screenshot(width=2880, height=1800, size=40, seed=0):
+    """
+    Draw a stand-in for a retina screenshot: hexagons in the game's colors, some with white text.
+    """
+    import random
+
+    import PIL.Image
+    import PIL.ImageDraw
+
+    rng = random.Random(seed)
+    colors = [color.value for color in hex_model.Color]
+    im = PIL.Image.new('RGB', (width, height), (255, 255, 255))
+    draw = PIL.ImageDraw.Draw(im)
+    step_x = size * 3 / 2
+    step_y = size * 3 ** 0.5
+    for column in range(int((width - size) / step_x)):
+        for row in range(int((height - size) / step_y)):
+            x = size + column * step_x
+            y = size + row * step_y + (column % 2) * step_y / 2
+            draw.regular_polygon((x, y, size * 0.9), 6, fill=rng.choice(colors))
+            if rng.random() < 0.3:
+                draw.text((x - 3, y - 5), str(rng.randint(0, 6)), fill=(255, 255, 255))
+    return im
+
+
+_LABEL_SCRIPT = """
+import resource, sys, time, tracemalloc
+import bench, image_parse
+im = bench.synthetic_screenshot({width}, {height})
+tracemalloc.start()
+t = time.perf_counter()
+result = image_parse.{function}(im.convert('RGB'), quiet=True)
+seconds = time.perf_counter() - t
+retained, traced_peak = tracemalloc.get_traced_memory()
+peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+print(peak * (1 if sys.platform == 'darwin' else 1024), traced_peak, retained, seconds)
+"""
+
+
+def bench_label(args):
+    """
+    Measure the memory used labeling a large screenshot, with and without the compact labeling.
+
+    Each function runs in a fresh interpreter. Peak RSS covers the
+    whole process, including drawing the screenshot; the traced peak
+    and retained sizes count only allocations made while labeling.
+    """
+    for function in ('label', 'label_compact'):
+        script = _LABEL_SCRIPT.format(width=args.width, height=args.height, function=function)
+        result = subprocess.run(
+            [sys.executable, '-c', script],
+            stdout=subprocess.PIPE,
+            universal_newlines=True,
+            check=True,
+        )
+        peak, traced_peak, retained, seconds = map(float, result.stdout.split())
+        print('{:<14} peak RSS {:6.1f}MB  labeling peak {:6.1f}MB  retained {:6.1f}MB  {:.2f}s'.format(
+            function, peak / 2 ** 20, traced_peak / 2 ** 20, retained / 2 ** 20, seconds,
+        ))
+
+
+def bench_ocr(args):
+    """
+    Time reading the text on a screenshot's hexes one at a time, and all at once from a contact sheet.
+    """
+    import image_parse
+
+    im = synthetic_screenshot(args.width, args.height)
+    samples, objs = image_parse.label_compact(im, quiet=True)
+    boxes = [box.text_box for box in objs if samples.has_text(box)]
+    crops = [im.crop(box) for box in boxes]
+
+    t = time.perf_counter()
+    # Skip the cache, which would make repeated glyphs free.
+    single = [
+        image_parse._read_text.__wrapped__(crop.size, crop.convert('L').tobytes())
+        for crop in crops
+    ]
+    single_seconds = time.perf_counter() - t
+    t = time.perf_counter()
+    batched = image_parse.get_texts_from_images(crops)
+    batched_seconds = time.perf_counter() - t
+
+    agree = sum(a.strip() == b for a, b in zip(single, batched))
+    print('{} texts: one at a time {:.2f}s, contact sheet {:.2f}s, {} read the same'.format(
+        len(crops), single_seconds, batched_seconds, agree,
+    ))
+
+
+def bench_tesseract(args):
+    """
+    Compare the per-call latency of the tesseract command with that of a loaded engine.
+
+    Each reads single glyphs, as for hexes read again on their own, and
+    contact sheets of `--per-sheet` glyphs, as for a capture.
+    """
+    import PIL.Image
+    import image_parse
+
+    im = synthetic_screenshot(args.width, args.height)
+    samples, objs = image_parse.label_compact(im, quiet=True)
+    crops = [im.crop(box.text_box) for box in objs if samples.has_text(box)][:args.calls]
+    glyphs = [image_parse._grayscale(crop) for crop in crops]
+    sheets = [
+        image_parse._grayscale(image_parse.contact_sheet(crops[i:i + args.per_sheet])[0])
+        for i in range(0, len(crops), args.per_sheet)
+    ]
+
+    def read_sheet(size, data):
+        import pytesseract
+
+        return pytesseract.image_to_data(
+            PIL.Image.frombytes('L', size, data),
+            config=image_parse.SHEET_CONFIG, output_type=pytesseract.Output.DICT,
+        )
+
+    readers = [('subprocess', image_parse._read_text_subprocess, read_sheet)]
+    if image_parse.engine_pool() is None:
+        print('tesserocr not installed - timing the tesseract command only')
+    else:
+        readers.append((
+            'engine', image_parse.engine_pool().read,
+            image_parse.engine_pool(image_parse.SHEET_PSM).read_words,
+        ))
+    for name, read_glyph, read_sheet in readers:
+        for kind, read, images in (('glyph', read_glyph, glyphs), ('sheet', read_sheet, sheets)):
+            seconds = []
+            for size, data in images:
+                t = time.perf_counter()
+                read(size, data)
+                seconds.append(time.perf_counter() - t)
+            seconds.sort()
+            print('{:<12} {:<6} {:4} calls  median {:7.2f}ms  p95 {:7.2f}ms'.format(
+                name, kind, len(seconds), statistics.median(seconds) * 1000,
+                seconds[min(len(seconds) - 1, int(len(seconds) * 0.95))] * 1000,
+            ))
+
+
+# Modules that should only be imported by the subcommands that need them.
+HEAVY_MODULES = (
+    'numpy', 'scipy', 'PIL', 'pytesseract', 'tesserocr',
+    'pyautogui', 'pyscreenshot', 'AppKit', 'Quartz',
+)
+
+
+def import_times(module):
+    """
+    Import `module` in a fresh interpreter, and return the cumulative import time of each package, in seconds.
+    """
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', 'import {}'.format(module)],
+        stderr=subprocess.PIPE,
+        universal_newlines=True,
+        check=True,
+    )
+    times = {}
+    for line in result.stderr.splitlines():
+        match = re.match(r'^import time:\s+(\d+) \|\s+(\d+) \|\s+(\S.*)$', line)
+        if match:
+            times[match.group(3).strip()] = int(match.group(2)) / 1e6
+    return times
+
+
+def bench_importtime(args):
+    """
+    Report how long the entry points take to import, and flag heavy dependencies.
+    """
+    for module in args.modules:
+        runs = [import_times(module) for _ in range(args.repeat)]
+        total = min(run[module] for run in runs)
+        heavy = sorted({
+            name.split('.')[0] for name in runs[0]
+            if name.split('.')[0] in HEAVY_MODULES
+        })
+        print('{:<12} {:>7.1f}ms  heavy imports: {}'.format(
+            module, total * 1000, ', '.join(heavy) or 'none',
+        ))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Solver benchmarks.')
+    parser.add_argument('--boards', type=int, default=10)
+    parser.add_argument('--radius', type=int, default=5)
+    parser.add_argument('--seed', type=int, default=0)
+    subparsers = parser.add_subparsers(dest='cmd')
+    subparsers.required = True
+
+    regions_parser = subparsers.add_parser('regions', help="region count over solver rounds")
+    regions_parser.add_argument(
+        '--workers', type=int, default=0, help="subdivide components in this many processes",
+    )
+    regions_parser.add_argument(
+        '--sparse', action='store_true', help="evaluate regions as a sparse matrix",
+    )
+    regions_parser.add_argument(
+        '--tiers', type=main.tiers, default=None, help="solver tiers to run, cheapest first",
+    )
+    regions_parser.set_defaults(func=bench_regions)
+
+    first_parser = subparsers.add_parser('first', help="time to a turn's first deduction")
+    first_parser.set_defaults(func=bench_first)
+
+    clicks_parser = subparsers.add_parser('clicks', help="mouse travel for dispatched clicks")
+    clicks_parser.set_defaults(func=bench_clicks)
+
+    turns_parser = subparsers.add_parser('turns', help="screen captures per level, by click order")
+    turns_parser.add_argument(
+        '--clicks-per-turn', type=int, default=8, help="0 to click every deduction each turn",
+    )
+    turns_parser.add_argument(
+        '--levels', nargs='+', metavar='FILE',
+        help="replay these recorded levels instead of generated boards",
+    )
+    turns_parser.set_defaults(func=bench_turns)
+
+    pipeline_parser = subparsers.add_parser('pipeline', help="whole levels against a fake game")
+    pipeline_parser.add_argument('--settle', type=float, default=0.2)
+    pipeline_parser.add_argument('--click-delay', type=float, default=0.01)
+    pipeline_parser.add_argument('--capture-delay', type=float, default=0.1)
+    pipeline_parser.set_defaults(func=bench_pipeline)
+
+    render_parser = subparsers.add_parser('render', help="cost of redrawing the board each turn")
+    render_parser.add_argument('--per-turn', type=int, default=5)
+    render_parser.set_defaults(func=bench_render)
+
+    label_parser = subparsers.add_parser('label', help="memory used labeling a screenshot")
+    label_parser.add_argument('--width', type=int, default=2880)
+    label_parser.add_argument('--height', type=int, default=1800)
+    label_parser.set_defaults(func=bench_label)
+
+    ocr_parser = subparsers.add_parser('ocr', help="time reading hex text, one at a time and batched")
+    ocr_parser.add_argument('--width', type=int, default=1440)
+    ocr_parser.add_argument('--height', type=int, default=900)
+    ocr_parser.set_defaults(func=bench_ocr)
+
+    tesseract_parser = subparsers.add_parser('tesseract', help="per-call OCR latency, by backend")
+    tesseract_parser.add_argument('--width', type=int, default=1440)
+    tesseract_parser.add_argument('--height', type=int, default=900)
+    tesseract_parser.add_argument('--calls', type=int, default=200, help="glyphs to read")
+    tesseract_parser.add_argument('--per-sheet', type=int, default=40, help="glyphs on each contact sheet")
+    tesseract_parser.set_defaults(func=bench_tesseract)
+
+    importtime_parser = subparsers.add_parser('importtime', help="import time of entry points")
+    importtime_parser.add_argument(
+        'modules', nargs='*', default=['hex_model', 'display', 'main', 'tests'],
+    )
+    importtime_parser.add_argument('--repeat', type=int, default=5)
+    importtime_parser.set_defaults(func=bench_importtime)
+
+    args = parser.parse_args()
+    args.func(args)
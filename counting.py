@@ -0,0 +1,333 @@
+"""
+Count the ways a board could be completed, and how likely each hex is to be blue.
+
+The yellow hexes are split into components that share no clue (other
+than the global `remaining` counter). Each component's completions are
+counted by a walk over its hexes in row order, merging the partial
+assignments that leave the clues straddling the walk's frontier in the
+same state. A component's
+count is kept as a polynomial - the number of completions using each
+number of blue hexes - so components can be combined through
+`remaining` by convolution.
+"""
+import collections
+import math
+
+from hex_model import Clue, Color
+
+
+class ContradictionError(ValueError):
+    pass
+
+
+class BudgetExhaustedError(Exception):
+    pass
+
+
+ModelCount = collections.namedtuple('ModelCount', 'total probabilities')
+
+
+class _Count:
+    """
+    A clue's count over some yellow hexes, net of the blue hexes already found.
+    """
+    def __init__(self, variables, value):
+        self.variables = variables
+        self.value = value
+
+    def state(self, assignment, i):
+        return sum(assignment[v] for v in self.variables if v < i)
+
+    def check(self, assignment, i):
+        blues = self.state(assignment, i + 1)
+        unassigned = sum(v > i for v in self.variables)
+        return blues <= self.value <= blues + unassigned
+
+
+class _Contiguity:
+    """
+    A clue requiring its blue hexes to be (or not be) a single group.
+
+    `positions` holds, in order, either a variable index or a fixed
+    boolean for hexes that are already uncovered or missing.
+    """
+    def __init__(self, positions, contiguous, cyclic):
+        self.positions = positions
+        self.contiguous = contiguous
+        self.cyclic = cyclic
+        self.variables = [p for p in positions if not isinstance(p, bool)]
+        # When the variables are assigned in order along a line, all
+        # that matters of the line so far is how many groups of blue
+        # hexes it has, and whether the last one is still open.
+        self._in_order = not cyclic and self.variables == sorted(self.variables)
+
+    def state(self, assignment, i):
+        if not self._in_order:
+            return tuple(assignment[v] for v in self.variables if v < i)
+        groups = 0
+        blue = False
+        for p in self.positions:
+            if not isinstance(p, bool):
+                if p >= i:
+                    break
+                p = bool(assignment[p])
+            groups += p and not blue
+            blue = p
+        return min(groups, 2), blue
+
+    def check(self, assignment, i):
+        if i < max(self.variables):
+            return True
+        blues = [p if isinstance(p, bool) else bool(assignment[p]) for p in self.positions]
+        return _is_contiguous(blues, self.cyclic) == self.contiguous
+
+
+def _is_contiguous(blues, cyclic):
+    groups = sum(
+        1 for i, blue in enumerate(blues)
+        if blue and not (blues[i - 1] if i or cyclic else False)
+    )
+    if cyclic and all(blues):
+        groups = 1
+    return groups <= 1
+
+
+def _add(a, b):
+    if len(a) < len(b):
+        a, b = b, a
+    result = list(a)
+    for k, count in enumerate(b):
+        result[k] += count
+    return result
+
+
+def _shift(poly):
+    return [0] + poly
+
+
+def _convolve(a, b):
+    result = [0] * (len(a) + len(b) - 1)
+    for i, x in enumerate(a):
+        if x:
+            for j, y in enumerate(b):
+                result[i + j] += x * y
+    return result
+
+
+def _clues(board):
+    """
+    Yield each clue on the board as (coords, value) and an optional contiguity requirement.
+
+    The contiguity requirement is (ordered coords, contiguous, cyclic),
+    where the ordered coords hold None for positions not on the board.
+    """
+    clues = [
+        Clue.around(board, coord) for coord, hex_ in board._board.items()
+        if hex_.value is not None and board[coord].color != Color.yellow
+    ]
+    clues.extend(Clue.along(board, coord) for coord, clue in board.lines.items() if clue.value is not None)
+    for clue in clues:
+        contiguity = None
+        if clue.contiguous is not None:
+            contiguity = clue.cells, clue.contiguous, clue.cyclic
+        yield clue.hexes, clue.value, contiguity
+
+
+class _Component:
+    def __init__(self, cells, constraints):
+        self.cells = cells
+        self.constraints = constraints
+        n = len(cells)
+        self._touching = [[] for _ in range(n)]
+        # Constraints straddling the frontier before each variable is assigned.
+        self._active = [[] for _ in range(n + 1)]
+        for constraint in constraints:
+            for v in constraint.variables:
+                self._touching[v].append(constraint)
+            first, last = min(constraint.variables), max(constraint.variables)
+            for i in range(first + 1, last + 1):
+                self._active[i].append(constraint)
+
+    def count(self, budget=None):
+        """
+        Return (poly, marginals): completions by number of blues, and the same per blue hex.
+
+        A forward pass finds the distinct frontier states before each
+        variable, with the ways to reach each one; a backward pass then
+        counts the ways to finish from each state. A variable's marginal
+        joins the two across the edges that make it blue. Raises
+        BudgetExhaustedError if `budget` runs out first.
+        """
+        n = len(self.cells)
+        # forward[i][s] is the poly of ways to reach state s before
+        # variable i, and edges[i][s] the (value, next state) pairs from it.
+        forward = [[[1]]]
+        edges = []
+        # An assignment reaching each state of the current layer.
+        prefixes = [[]]
+        for i in range(n):
+            states = {}
+            next_prefixes = []
+            next_forward = []
+            layer_edges = []
+            for prefix, ways in zip(prefixes, forward[i]):
+                if budget is not None and not budget.spend():
+                    raise BudgetExhaustedError(self.cells)
+                assignment = prefix + [0]
+                state_edges = []
+                for value in (0, 1):
+                    assignment[i] = value
+                    if not all(constraint.check(assignment, i) for constraint in self._touching[i]):
+                        continue
+                    key = tuple(constraint.state(assignment, i + 1) for constraint in self._active[i + 1])
+                    j = states.get(key)
+                    if j is None:
+                        j = states[key] = len(next_prefixes)
+                        next_prefixes.append(list(assignment))
+                        next_forward.append([])
+                    next_forward[j] = _add(next_forward[j], _shift(ways) if value else ways)
+                    state_edges.append((value, j))
+                layer_edges.append(state_edges)
+            prefixes = next_prefixes
+            forward.append(next_forward)
+            edges.append(layer_edges)
+
+        backward = [[1] for _ in forward[n]]
+        marginals = {}
+        for i in reversed(range(n)):
+            layer_backward = []
+            blue = []
+            for ways, state_edges in zip(forward[i], edges[i]):
+                poly = []
+                for value, j in state_edges:
+                    rest = _shift(backward[j]) if value else backward[j]
+                    poly = _add(poly, rest)
+                    if value:
+                        blue = _add(blue, _convolve(ways, rest))
+                layer_backward.append(poly)
+            if blue:
+                marginals[i] = blue
+            backward = layer_backward
+        return backward[0], marginals
+
+
+def _components(board):
+    """
+    Split the yellow hexes into independent components.
+
+    Returns the components, and the yellow hexes touched by no clue.
+    """
+    table = board.neighbor_table
+    yellow = [coord for coord in table.row_order if board[coord].color == Color.yellow]
+    yellow_set = set(yellow)
+
+    # Union-find over the yellow hexes, joining hexes that share a clue.
+    parent = {coord: coord for coord in yellow}
+
+    def find(coord):
+        while parent[coord] != coord:
+            parent[coord] = parent[parent[coord]]
+            coord = parent[coord]
+        return coord
+
+    clues = []
+    for coords, value, contiguity in _clues(board):
+        unknown = [coord for coord in coords if coord in yellow_set]
+        value -= sum(board[coord].color == Color.blue for coord in coords)
+        if not 0 <= value <= len(unknown):
+            raise ContradictionError(coords)
+        clues.append((unknown, value, contiguity))
+        for coord in unknown[1:]:
+            parent[find(coord)] = find(unknown[0])
+
+    groups = collections.OrderedDict()
+    constrained = set()
+    for unknown, _, _ in clues:
+        constrained.update(unknown)
+    for coord in yellow:
+        if coord in constrained:
+            groups.setdefault(find(coord), []).append(coord)
+    free = [coord for coord in yellow if coord not in constrained]
+
+    index = {}
+    for cells in groups.values():
+        index.update((coord, i) for i, coord in enumerate(cells))
+    constraints = collections.defaultdict(list)
+    for unknown, value, contiguity in clues:
+        if not unknown:
+            continue
+        root = find(unknown[0])
+        constraints[root].append(_Count([index[coord] for coord in unknown], value))
+        if contiguity:
+            ordered, contiguous, cyclic = contiguity
+            positions = [
+                index[coord] if coord in yellow_set
+                else coord is not None and board[coord].color == Color.blue
+                for coord in ordered
+            ]
+            constraints[root].append(_Contiguity(positions, contiguous, cyclic))
+
+    return [
+        _Component(cells, constraints[root]) for root, cells in groups.items()
+    ], free
+
+
+def count_models(board, budget=None):
+    """
+    Count the consistent completions of the board, and each yellow hex's chance of being blue.
+
+    Returns a ModelCount of the total number of completions and a dict
+    of probabilities by coordinate. Raises ContradictionError if the
+    board can't be completed, and BudgetExhaustedError if the optional
+    `budget` (a util.Budget, spent once per state) runs out first.
+    """
+    components, free = _components(board)
+    results = [component.count(budget) for component in components]
+    polys = [poly for poly, _ in results]
+    # Hexes touched by no clue can be anything, subject only to `remaining`.
+    polys.append([math.comb(len(free), k) for k in range(len(free) + 1)])
+    free_marginal = [0] + [math.comb(len(free) - 1, k) for k in range(len(free))] if free else []
+
+    if board.remaining is None:
+        def total_of(poly):
+            return sum(poly)
+    else:
+        def total_of(poly):
+            return poly[board.remaining] if board.remaining < len(poly) else 0
+
+    # others[i] is the convolution of every poly except the ith.
+    prefix = [[1]]
+    for poly in polys:
+        prefix.append(_convolve(prefix[-1], poly))
+    suffix = [[1]]
+    for poly in reversed(polys):
+        suffix.append(_convolve(suffix[-1], poly))
+    suffix.reverse()
+    others = [_convolve(prefix[i], suffix[i + 1]) for i in range(len(polys))]
+
+    total = total_of(prefix[-1])
+    if not total:
+        raise ContradictionError("No consistent completion.")
+
+    probabilities = {}
+    for component, (_, marginals), rest in zip(components, results, others):
+        for v, coord in enumerate(component.cells):
+            blue = total_of(_convolve(marginals.get(v, [0]), rest))
+            probabilities[coord] = blue / total
+    if free:
+        blue = total_of(_convolve(free_marginal, others[-1]))
+        for coord in free:
+            probabilities[coord] = blue / total
+
+    return ModelCount(total, probabilities)
+
+
+def forced(board, budget=None):
+    """
+    Yield (coord, color) for each yellow hex whose color is the same in every completion.
+    """
+    for coord, probability in count_models(board, budget).probabilities.items():
+        if probability == 1:
+            yield coord, Color.blue
+        elif probability == 0:
+            yield coord, Color.black
@@ -1,4 +1,5 @@
 import collections
+import functools
 import heapq
 
 import hex_model
@@ -8,6 +9,12 @@ af = '\x1b[38;5;{}m'.format
 ab = '\x1b[48;5;{}m'.format
 clear = '\x1b[0m'
 
+# Relative cursor movement, for redrawing part of a board already on screen.
+cursor_up = '\x1b[{}A'.format
+cursor_down = '\x1b[{}B'.format
+cursor_column = '\x1b[{}G'.format
+clear_line = '\x1b[2K'
+
 hexagon_colors = {
     hex_model.Color.blue: 38,
     hex_model.Color.yellow: 214,
@@ -15,17 +22,91 @@ hexagon_colors = {
 }
 
 
-def display_board(board):
+class _Canvas:
     """
-    Display the board of flat-top hexes.
+    Collect the pieces of a rendered board, tracking where each hex is drawn.
+
+    Hexes are drawn through `cell`, which records the line and column
+    of the drawing along with the function that drew it, so the hex
+    can be redrawn in place later.
     """
-    string_builder = collections.deque()
-    print_ = string_builder.append
-    leftmost = board.leftmost
-    last_row_num, _ = next(board.rows)
+    def __init__(self):
+        self._parts = collections.deque()
+        self.line = 0
+        self.column = 0
+        self.cells = collections.defaultdict(list)
+
+    def write(self, text):
+        self._parts.append(text)
+        *lines, last = text.split('\n')
+        if lines:
+            self.line += len(lines)
+            self.column = len(last)
+        else:
+            self.column += len(text)
+
+    def cell(self, coord, hex_, draw, width):
+        """
+        Draw a hex with `draw(coord, hex_)`, which produces `width` visible characters.
+        """
+        self.cells[coord].append((self.line, self.column, draw))
+        self._parts.append(draw(coord, hex_))
+        self.column += width
+
+    def getvalue(self):
+        return ''.join(self._parts)
+
+
+@functools.lru_cache(maxsize=None)
+def _small_cell(color, text, is_origin):
+    color = af(hexagon_colors[color])
+    if is_origin:
+        color += ab(237)
+    return '{}{:^3}{} '.format(color, text, clear)
+
+
+def _draw_small(coord, hex_):
+    return _small_cell(hex_.color, hex_.text, coord == (0, 0, 0))
+
+
+@functools.lru_cache(maxsize=None)
+def _large_cell(color, text, is_origin):
+    color = ab(hexagon_colors[color])
+    inner = '{:^3}'.format(text)
+    if is_origin:
+        inner = '{}{}{}'.format(ab(1), inner, color)
+    return '{} {} {}   '.format(color, inner, clear)
+
+
+def _draw_large(coord, hex_):
+    return _large_cell(hex_.color, hex_.text, coord == (0, 0, 0))
+
+
+@functools.lru_cache(maxsize=None)
+def _mid_cell(color):
+    return ' {}   {}'.format(ab(hexagon_colors[color]), clear)
+
+
+def _draw_mid(coord, hex_):
+    return _mid_cell(hex_.color)
+
+
+def _header(board):
     if board.remaining is not None:
-        print_("Remaining: {}\n".format(board.remaining))
-    for row_num, row in board.rows:
+        return "Remaining: {}\n".format(board.remaining)
+    return ''
+
+
+def _rows(board):
+    return [(row_num, list(row)) for row_num, row in board.rows]
+
+
+def _draw_board(canvas, board, rows):
+    print_ = canvas.write
+    leftmost = board.leftmost
+    last_row_num, _ = rows[0]
+    print_(_header(board))
+    for row_num, row in rows:
         print_('\n' * (row_num - last_row_num - 1))
         last_row_num = row_num
         bump = (row_num % 2) != (leftmost % 2)
@@ -39,53 +120,50 @@ def display_board(board):
             # row_num is even, leftmost is even, diff one more than you are
             last -= 1
         for (x, y, z), hex_ in row:
-            color = hexagon_colors[hex_.color]
-            color = af(color)
-            if x == y == z == 0:
-                color += ab(237)
             print_('    ' * ((x - last + 1) // 2 - 1))
-            print_('{}{:^3}{} '.format(color, hex_.text, clear))
+            canvas.cell((x, y, z), hex_, _draw_small, 4)
             last = x
         print_('\n')
-    return ''.join(string_builder)
 
 
-def _draw_mid_row(row_queue, leftmost):
-    string_builder = collections.deque()
-    print_ = string_builder.append
+def display_board(board):
+    """
+    Display the board of flat-top hexes.
+    """
+    canvas = _Canvas()
+    _draw_board(canvas, board, _rows(board))
+    return canvas.getvalue()
+
+
+def _draw_mid_row(canvas, row_queue, leftmost):
+    print_ = canvas.write
     last = leftmost - 1
     for (x, y, z), hex_ in heapq.merge(*row_queue, key=lambda x_y_z__hex: x_y_z__hex[0][0]):
-        color = hexagon_colors[hex_.color]
-        color = ab(color)
         print_('    ' * (x - last - 1))
-        print_(' {}   {}'.format(color, clear))
+        canvas.cell((x, y, z), hex_, _draw_mid, 4)
         last = x
     print_('\n')
-    return ''.join(string_builder)
 
 
-def display_full_board(board):
-    string_builder = collections.deque()
-    print_ = string_builder.append
+def _draw_full_board(canvas, board, rows):
+    print_ = canvas.write
     leftmost = board.leftmost
 
-    if board.remaining is not None:
-        print_("Remaining: {}\n".format(board.remaining))
+    print_(_header(board))
 
     row_queue = collections.deque([[], []], 2)
-    last_row_num, _ = next(board.rows)
+    last_row_num, _ = rows[0]
 
-    for row_num, row in board.rows:
+    for row_num, row in rows:
         row_diff = (row_num - last_row_num - 1)
         if row_diff > 0:
             row_queue.append([])
-            print_(_draw_mid_row(row_queue, leftmost))
+            _draw_mid_row(canvas, row_queue, leftmost)
             print_('\n\n' * ((row_diff - 1)) + '\n')
         last_row_num = row_num
-        row = list(row)
 
         row_queue.append(row)
-        print_(_draw_mid_row(row_queue, leftmost))
+        _draw_mid_row(canvas, row_queue, leftmost)
 
         bump = (row_num % 2) != (leftmost % 2)
         last = leftmost
@@ -100,15 +178,100 @@ def display_full_board(board):
             last -= 1
 
         for (x, y, z), hex_ in row:
-            color = hexagon_colors[hex_.color]
-            color = ab(color)
             print_('        ' * ((x - last + 1) // 2 - 1))
-            inner = '{:^3}'.format(hex_.text)
-            if x == y == z == 0:
-                inner = '{}{}{}'.format(ab(1), inner, color)
-            print_('{} {} {}   '.format(color, inner, clear))
+            canvas.cell((x, y, z), hex_, _draw_large, 8)
             last = x
         print_('\n')
     row_queue.append([])
-    print_(_draw_mid_row(row_queue, leftmost))
-    return ''.join(string_builder)
+    _draw_mid_row(canvas, row_queue, leftmost)
+
+
+def display_full_board(board):
+    canvas = _Canvas()
+    _draw_full_board(canvas, board, _rows(board))
+    return canvas.getvalue()
+
+
+class BoardRenderer:
+    """
+    Draw a board repeatedly, redrawing only the hexes that changed.
+
+    The first call to `render` returns the whole board. Later calls
+    assume that board is still on screen with the cursor just below
+    it, and return escape sequences that move the cursor to each hex
+    whose color or text changed, redraw it, and put the cursor back.
+    If the board's layout changed, the whole board is drawn again.
+    Hexes clicked by a solve are drawn in their new colors, whether or
+    not they've been applied yet.
+    """
+    LAYOUTS = {
+        'small': _draw_board,
+        'large': _draw_full_board,
+    }
+
+    def __init__(self, layout='small'):
+        self._draw = self.LAYOUTS[layout]
+        self._layout = None
+        self._header = None
+        self._rows = None
+        self._cells = None
+        self._state = None
+        self._height = None
+
+    def invalidate(self):
+        """
+        Draw the whole board next time, eg because something else was printed below it.
+        """
+        self._layout = None
+
+    def render(self, board):
+        layout = board.neighbor_table
+        header = _header(board)
+        # A header appearing or disappearing moves every line of the board.
+        if layout is not self._layout or bool(header) != bool(self._header):
+            return self._render_full(board, layout)
+
+        updates = collections.deque()
+        if header != self._header:
+            self._header = header
+            updates.extend([
+                cursor_up(self._height), '\r', clear_line,
+                header.rstrip('\n'),
+                cursor_down(self._height), '\r',
+            ])
+        for coord in self._cells:
+            hex_ = board[coord]
+            state = hex_.color, hex_.text
+            if state == self._state[coord]:
+                continue
+            self._state[coord] = state
+            for line, column, draw in self._cells[coord]:
+                up = self._height - line
+                updates.append(cursor_up(up))
+                updates.append(cursor_column(column + 1))
+                updates.append(draw(coord, hex_))
+                updates.append(cursor_down(up))
+                updates.append('\r')
+        return ''.join(updates)
+
+    def _render_full(self, board, layout):
+        if layout is not self._layout:
+            self._rows = [
+                (row_num, [coord for coord, _ in row])
+                for row_num, row in board.rows
+            ]
+        rows = [
+            (row_num, [(coord, board[coord]) for coord in row])
+            for row_num, row in self._rows
+        ]
+        canvas = _Canvas()
+        self._draw(canvas, board, rows)
+        self._layout = layout
+        self._header = _header(board)
+        self._cells = canvas.cells
+        self._height = canvas.line
+        self._state = {
+            coord: (board[coord].color, board[coord].text)
+            for coord in self._cells
+        }
+        return canvas.getvalue()
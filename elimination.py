@@ -0,0 +1,91 @@
+"""
+Deduce hexes from many regions at once, by linear elimination.
+
+Each region says how many of its yellow hexes are blue: one row of an
+integer system A x = b over 0/1 variables. Subdividing regions only
+ever combines two rows; Gaussian elimination combines any number. A row
+of the reduced system pins all of its variables when its total is the
+smallest or largest sum its coefficients allow: eg x1 - x2 = 1 only
+holds with x1 blue and x2 black.
+
+Elimination is kept to integers, dividing each row through by the gcd
+of its entries, so there's no rounding to worry about.
+"""
+import numpy
+
+from hex_model import Color
+
+# Systems with more hexes than this are left to subdivision.
+MAX_CELLS = 256
+
+# Elimination stops early if coefficients grow past this, well short of
+# overflowing; every row is still a valid equation when it does.
+_MAX_COEFFICIENT = 2 ** 31
+
+
+def system(regions):
+    """
+    Build the matrix of a dict of regions: a row per region, a column per hex, and the totals last.
+
+    Returns the hexes in column order, and the matrix.
+    """
+    cells = sorted(set().union(*regions))
+    index = {coord: i for i, coord in enumerate(cells)}
+    matrix = numpy.zeros((len(regions), len(cells) + 1), dtype=numpy.int64)
+    for row, (hexes, value) in enumerate(regions.items()):
+        matrix[row, [index[coord] for coord in hexes]] = 1
+        matrix[row, -1] = value
+    return cells, matrix
+
+
+def reduce(matrix):
+    """
+    Row-reduce an integer system, keeping it integral. Returns the rows that aren't all zero.
+    """
+    matrix = matrix.copy()
+    rows, columns = matrix.shape
+    pivot_row = 0
+    for column in range(columns - 1):
+        if pivot_row == rows:
+            break
+        candidates = numpy.flatnonzero(matrix[pivot_row:, column])
+        if not len(candidates):
+            continue
+        pivot = pivot_row + candidates[0]
+        matrix[[pivot_row, pivot]] = matrix[[pivot, pivot_row]]
+        pivot = matrix[pivot_row].copy()
+
+        # Cancel the column from every other row, scaling the row by
+        # the pivot rather than dividing.
+        factors = matrix[:, column].copy()
+        factors[pivot_row] = 0
+        others = factors != 0
+        if others.any():
+            combined = matrix[others] * pivot[column] - factors[others, None] * pivot
+            divisors = numpy.gcd.reduce(combined, axis=1)
+            divisors[divisors == 0] = 1
+            matrix[others] = combined // divisors[:, None]
+        pivot_row += 1
+        if numpy.abs(matrix).max() > _MAX_COEFFICIENT:
+            break
+    return matrix[numpy.any(matrix[:, :-1] != 0, axis=1)]
+
+
+def forced(regions):
+    """
+    Return a dict of the color forced on each hex by the regions taken together.
+    """
+    cells, matrix = system(regions)
+    rows = reduce(matrix)
+    coefficients, totals = rows[:, :-1], rows[:, -1]
+    lowest = numpy.where(coefficients < 0, coefficients, 0).sum(axis=1)
+    highest = numpy.where(coefficients > 0, coefficients, 0).sum(axis=1)
+
+    colors = {}
+    for row in numpy.flatnonzero((totals == lowest) | (totals == highest)):
+        # At the highest total, every positive coefficient's hex is
+        # blue; at the lowest, every negative one's.
+        blue = coefficients[row] > 0 if totals[row] == highest[row] else coefficients[row] < 0
+        for i in numpy.flatnonzero(coefficients[row]):
+            colors[cells[i]] = Color.blue if blue[i] else Color.black
+    return colors
@@ -0,0 +1,73 @@
+import collections
+import threading
+import time
+
+import input_dispatch
+from hex_model import Color
+
+ImageBox = collections.namedtuple('ImageBox', 'center')
+
+
+class MistakeError(Exception):
+    pass
+
+
+def place_on_screen(board, size=60):
+    """
+    Give each hex an image box where it would appear in a screenshot.
+    """
+    for (x, y, z), hex_ in board._board.items():
+        hex_.image_box = ImageBox((
+            int(size * 3 / 2 * x) + 1000,
+            int(size * 3 ** 0.5 * (y + x / 2)) + 1000,
+        ))
+
+
+class FakeGame:
+    """
+    Stand in for the game: an input backend and a screen in one.
+
+    Clicks are checked against the solution, and uncover the clicked
+    hex; captures report uncovered hexes from the solution. Both can be
+    slowed down to model the real game.
+    """
+    def __init__(self, board, solution, click_delay=0.0, capture_delay=0.0):
+        place_on_screen(board)
+        self._solution = solution
+        self._positions = {}
+        for coord, hex_ in board._board.items():
+            x, y = input_dispatch.screen_position(board, coord, (0, 0))
+            self._positions[x, y] = coord
+            solution[coord].image_box = hex_.image_box
+        self._uncovered = {
+            coord for coord, hex_ in board._board.items() if hex_.color != Color.yellow
+        }
+        self._lock = threading.Lock()
+        self._position = None
+        self.click_delay = click_delay
+        self.capture_delay = capture_delay
+        self.clicks = 0
+        self.captures = 0
+
+    def position(self):
+        return self._position
+
+    def click(self, x, y, button):
+        time.sleep(self.click_delay)
+        coord = self._positions[x, y]
+        expected = input_dispatch.BUTTONS[self._solution[coord].color]
+        if button != expected:
+            raise MistakeError(coord, button)
+        with self._lock:
+            self._uncovered.add(coord)
+            self.clicks += 1
+        self._position = x, y
+
+    def capture(self, coords):
+        time.sleep(self.capture_delay)
+        with self._lock:
+            self.captures += 1
+            return {
+                coord: self._solution[coord].clone()
+                for coord in coords if coord in self._uncovered
+            }
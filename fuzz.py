@@ -0,0 +1,350 @@
+"""
+Differential fuzzing for the solver backends.
+
+Random boards are generated along with their solutions, and every
+backend is run on each. Every deduction must match the solution, and
+backends that claim to find everything that can be deduced must agree
+with one another - and must find everything the other backends do.
+Failing boards are shrunk, and printed in the ASCII format that
+`tests._board_from_string` reads.
+
+    python fuzz.py --boards 1000 --workers 4
+"""
+import argparse
+import collections
+import concurrent.futures
+import itertools
+import random
+import time
+
+import counting
+import generate
+import hex_model
+import util
+from hex_model import Color, Hex, HexBoard, LineClue
+
+# Boards with more yellow hexes than this are skipped by the brute force backend.
+BRUTE_FORCE_LIMIT = 14
+# Boards the counting backend can't finish in this many seconds are skipped by it.
+COUNTING_SECONDS = 10
+
+
+Backend = collections.namedtuple('Backend', 'name solve complete')
+
+
+def _solve_regions(board):
+    return list(board.solve())
+
+
+def _solve_pairwise(board):
+    board.elimination = False
+    return list(board.solve())
+
+
+def _solve_sparse(board):
+    board.sparse = True
+    return list(board.solve())
+
+
+def _solve_lazy(board):
+    board.lazy = True
+    return list(board.solve())
+
+
+def _solve_budgeted(board):
+    """
+    Solve in many small slices, resuming each time.
+    """
+    deductions = []
+    while True:
+        deductions.extend(board.solve(util.Budget(steps=500)))
+        if not board.suspended:
+            return deductions
+
+
+def _solve_counting(board):
+    try:
+        return list(counting.forced(board, util.Budget(seconds=COUNTING_SECONDS)))
+    except counting.BudgetExhaustedError:
+        return None
+
+
+def _solve_brute_force(board):
+    """
+    Try every coloring of the yellow hexes, and keep the hexes colored the same in all that fit.
+    """
+    yellow = [coord for coord in board._board if board[coord].color == Color.yellow]
+    if len(yellow) > BRUTE_FORCE_LIMIT:
+        return None
+    clues = list(counting._clues(board))
+    seen = {coord: set() for coord in yellow}
+    for bits in itertools.product((False, True), repeat=len(yellow)):
+        if board.remaining is not None and sum(bits) != board.remaining:
+            continue
+        blue = dict(zip(yellow, bits))
+
+        def is_blue(coord):
+            if coord in blue:
+                return blue[coord]
+            return coord is not None and board[coord].color == Color.blue
+
+        if all(
+            sum(map(is_blue, coords)) == value and (
+                contiguity is None or
+                counting._is_contiguous(list(map(is_blue, contiguity[0])), contiguity[2]) == contiguity[1]
+            )
+            for coords, value, contiguity in clues
+        ):
+            for coord, bit in blue.items():
+                seen[coord].add(bit)
+    if yellow and not any(seen.values()):
+        raise counting.ContradictionError("No consistent completion.")
+    return [
+        (coord, Color.blue if bits == {True} else Color.black)
+        for coord, bits in seen.items() if len(bits) == 1
+    ]
+
+
+BACKENDS = [
+    Backend('regions', _solve_regions, complete=False),
+    Backend('pairwise', _solve_pairwise, complete=False),
+    Backend('sparse', _solve_sparse, complete=False),
+    Backend('lazy', _solve_lazy, complete=False),
+    Backend('budgeted', _solve_budgeted, complete=False),
+    Backend('counting', _solve_counting, complete=True),
+    Backend('brute-force', _solve_brute_force, complete=True),
+]
+
+
+def copy_board(board, without=()):
+    copy = HexBoard(remaining=board.remaining)
+    for coord, hex_ in board._board.items():
+        if coord not in without:
+            copy[coord] = hex_.clone()
+    for coord, clue in board.lines.items():
+        copy.add_line(coord, LineClue(clue.text, clue.direction))
+    return copy
+
+
+def random_board(seed, max_radius=4):
+    """
+    Generate a board with randomly chosen generator settings.
+    """
+    rng = random.Random(seed)
+    return generate.generate_board(
+        radius=rng.randint(1, max_radius),
+        holes=rng.uniform(0, 0.3),
+        density=rng.uniform(0.1, 0.6),
+        reveal=rng.uniform(0.1, 0.6),
+        blue_clues=rng.uniform(0, 0.5),
+        contiguity=rng.uniform(0, 0.6),
+        remaining=rng.random() < 0.7,
+        lines=rng.uniform(0, 0.4),
+        seed=seed,
+    )
+
+
+def check_board(board, solution, backends=BACKENDS):
+    """
+    Run every backend on a copy of the board, and return a list of any problems found.
+
+    Also returns the seconds each backend took, by name.
+    """
+    problems = []
+    results = {}
+    seconds = {}
+    for backend in backends:
+        t = time.perf_counter()
+        try:
+            deductions = backend.solve(copy_board(board))
+        except Exception as e:
+            problems.append('{}: raised {!r}'.format(backend.name, e))
+            continue
+        finally:
+            seconds[backend.name] = time.perf_counter() - t
+        if deductions is None:
+            continue
+        found = {}
+        for coord, color in deductions:
+            if board.get(coord) is None or board[coord].color != Color.yellow:
+                problems.append('{}: deduced {} at {}, which is not yellow'.format(
+                    backend.name, color.name, coord,
+                ))
+            elif solution[coord].color != color:
+                problems.append('{}: deduced {} at {}, which is {}'.format(
+                    backend.name, color.name, coord, solution[coord].color.name,
+                ))
+            elif found.get(coord, color) != color:
+                problems.append('{}: deduced both colors at {}'.format(backend.name, coord))
+            found[coord] = color
+        results[backend] = set(found.items())
+
+    complete = [backend for backend in results if backend.complete]
+    for reference in complete[:1]:
+        for backend, found in results.items():
+            if backend.complete and found != results[reference]:
+                problems.append('{} and {} disagree: {} vs {}'.format(
+                    reference.name, backend.name,
+                    sorted(results[reference] - found), sorted(found - results[reference]),
+                ))
+            elif not backend.complete and not found <= results[reference]:
+                problems.append('{} deduced what complete {} did not: {}'.format(
+                    backend.name, reference.name, sorted(found - results[reference]),
+                ))
+    return problems, seconds
+
+
+def _check_seed(seed, max_radius):
+    board, solution = random_board(seed, max_radius)
+    problems, seconds = check_board(board, solution)
+    return seed, problems, seconds
+
+
+def _shrink_candidates(board, solution):
+    """
+    Yield smaller versions of a board that are still consistent with its solution.
+    """
+    if board.remaining is not None:
+        smaller = copy_board(board)
+        smaller.remaining = None
+        yield smaller
+    for coord in list(board.lines):
+        smaller = copy_board(board)
+        del smaller.lines[coord]
+        yield smaller
+    counted = set()
+    for coord, hex_ in board._board.items():
+        if hex_.value is not None:
+            distance = 1 if hex_.color == Color.black else 2
+            counted.update(board.neighbor_table.neighbors(coord, distance))
+    for coord in board.lines:
+        counted.update(board.line_hexes(coord))
+
+    for coord, hex_ in board._board.items():
+        # Black hexes count toward no clue, and break contiguity just as
+        # a missing hex does, so they can be dropped outright. Blue
+        # hexes can be dropped once no clue counts them.
+        if hex_.value is None and (solution[coord].color == Color.black or coord not in counted):
+            smaller = copy_board(board, without={coord})
+            if smaller.remaining is not None and hex_.color == Color.yellow:
+                smaller.remaining -= solution[coord].color == Color.blue
+            yield smaller
+        elif hex_.value is not None:
+            smaller = copy_board(board)
+            smaller[coord] = Hex('-', hex_.color)
+            yield smaller
+        elif hex_.color == Color.yellow:
+            smaller = copy_board(board)
+            smaller[coord] = Hex('-', solution[coord].color)
+            if smaller.remaining is not None and solution[coord].color == Color.blue:
+                smaller.remaining -= 1
+            yield smaller
+
+
+def shrink(board, solution, backends=BACKENDS):
+    """
+    Find a minimal version of a board on which the backends still have problems.
+    """
+    shrunk = True
+    while shrunk:
+        shrunk = False
+        for smaller in _shrink_candidates(board, solution):
+            problems, _ = check_board(smaller, solution, backends)
+            if problems:
+                board = smaller
+                shrunk = True
+                break
+    return board
+
+
+def board_to_string(board):
+    """
+    Draw a board in the ASCII format read by `tests._board_from_string`.
+    """
+    cells = {}
+    for coord, hex_ in board._board.items():
+        text = hex_.text
+        if hex_.color == Color.yellow:
+            text = '-'
+        elif hex_.value is None:
+            text = 'o' if hex_.color == Color.blue else 'x'
+        elif hex_.color == Color.blue:
+            text += 'o'
+        cells[coord] = text
+    markers = {
+        direction: marker for marker, direction in (
+            ('|', hex_model.LINE_DIRECTIONS['down']),
+            ('\\', hex_model.LINE_DIRECTIONS['down_right']),
+            ('/', hex_model.LINE_DIRECTIONS['down_left']),
+        )
+    }
+    for coord, clue in board.lines.items():
+        cells[coord] = markers[clue.direction] + clue.text
+
+    left = min(x for x, y, z in cells)
+    top = min(y - z for x, y, z in cells)
+    lines = collections.defaultdict(dict)
+    for (x, y, z), text in cells.items():
+        column = (x - left) * 2 + 2
+        # Longer text is centered on the hex, and a line's marker
+        # goes in the space before its clue.
+        column -= len(text) > 1
+        if text[0] in '|\\/':
+            column -= len(text) > 2
+        lines[y - z - top][column] = text
+
+    rows = []
+    for row in range(max(lines) + 1):
+        line = ''
+        for column, text in sorted(lines[row].items()):
+            if line and column <= len(line):
+                raise ValueError("Clues too long to draw apart: {!r} {!r}".format(line, text))
+            line += ' ' * (column - len(line)) + text
+        rows.append(line)
+    return '\n'.join(rows)
+
+
+def main(args):
+    seeds = range(args.seed, args.seed + args.boards)
+    failures = []
+    seconds = collections.Counter()
+    t = time.perf_counter()
+    with concurrent.futures.ProcessPoolExecutor(args.workers) as executor:
+        results = executor.map(_check_seed, seeds, itertools.repeat(args.radius), chunksize=8)
+        for seed, problems, backend_seconds in results:
+            seconds.update(backend_seconds)
+            if problems:
+                failures.append(seed)
+                print('seed {}: {}'.format(seed, problems[0]))
+    elapsed = time.perf_counter() - t
+
+    print('{} boards in {:.1f}s: {:.1f} boards/s, {} failing'.format(
+        args.boards, elapsed, args.boards / elapsed, len(failures),
+    ))
+    for name, total in seconds.most_common():
+        print('  {:<12} {:.3f}s/board'.format(name, total / args.boards))
+
+    for seed in failures[:args.shrink]:
+        board, solution = random_board(seed, args.radius)
+        board = shrink(board, solution)
+        problems, _ = check_board(board, solution)
+        print()
+        print('seed {}, shrunk (remaining={}):'.format(seed, board.remaining))
+        try:
+            print(board_to_string(board))
+        except ValueError:
+            print(board._board)
+            print(board.lines)
+        for problem in problems:
+            print('  ' + problem)
+    return not failures
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Differential fuzzing of the solver backends.')
+    parser.add_argument('--boards', type=int, default=200)
+    parser.add_argument('--radius', type=int, default=4, help="largest board radius")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--workers', type=int, default=None, help="processes; defaults to one per core")
+    parser.add_argument('--shrink', type=int, default=3, help="failing boards to shrink and print")
+    raise SystemExit(not main(parser.parse_args()))
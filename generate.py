@@ -0,0 +1,98 @@
+import random
+
+import hex_model
+from hex_model import Color, Hex
+
+
+def _ring_is_contiguous(solution, center):
+    """
+    Find if the blue hexes around the given coordinate form a single group.
+    """
+    ring = [
+        solution.get(coord) == Color.blue
+        for coord in hex_model._ordered_neighbors(center)
+    ]
+    if all(ring):
+        return True
+    # Rotate so we start just after a non-blue hex, then count the groups.
+    start = ring.index(False)
+    ring = ring[start:] + ring[:start]
+    groups = sum(1 for i, blue in enumerate(ring) if blue and not ring[i - 1])
+    return groups <= 1
+
+
+def _line_is_contiguous(solution, ray):
+    """
+    Find if the blue hexes along a line form a single group.
+    """
+    line = [solution.get(coord) == Color.blue for coord in ray]
+    groups = sum(1 for i, blue in enumerate(line) if blue and not (i and line[i - 1]))
+    return groups <= 1
+
+
+def generate_board(radius=4, holes=0.1, density=0.35, reveal=0.3, blue_clues=0.3,
+                   contiguity=0.3, remaining=True, lines=0.0, seed=None):
+    """
+    Generate a random board, along with its solution.
+
+    The board is a hexagon of the given radius with a fraction `holes`
+    of its hexes missing. A fraction `density` of the hexes are blue.
+    Each black hex is uncovered with probability `reveal`, showing its
+    clue; a fraction `contiguity` of uncovered clues are marked with
+    whether their blue neighbors are contiguous. Each blue hex is
+    uncovered with probability `reveal * blue_clues`. A fraction `lines`
+    of the board's lines get a line clue, pointing down, down-left or
+    down-right.
+
+    Returns `(board, solution)`, where `solution` maps each coordinate
+    to the fully-uncovered Hex at that coordinate.
+    """
+    rng = random.Random(seed)
+    colors = {
+        coord: Color.blue if rng.random() < density else Color.black
+        for coord in hex_model.generate_hex_circle(radius)
+        if rng.random() >= holes
+    }
+
+    # Build a throwaway board to borrow its neighbor lookups.
+    shape = hex_model.HexBoard()
+    for coord in colors:
+        shape[coord] = Hex('-', Color.yellow)
+
+    solution = {}
+    for coord, color in colors.items():
+        distance = 1 if color == Color.black else 2
+        value = sum(colors[neighbor] == Color.blue for neighbor in shape._neighbors(coord, distance))
+        text = str(value)
+        if color == Color.black and value > 1 and rng.random() < contiguity:
+            text = ('{{{}}}' if _ring_is_contiguous(colors, coord) else '-{}-').format(value)
+        solution[coord] = Hex(text, color)
+
+    board = hex_model.HexBoard()
+    for coord, hex_ in solution.items():
+        chance = reveal if hex_.color == Color.black else reveal * blue_clues
+        board[coord] = hex_.clone() if rng.random() < chance else Hex('-', Color.yellow)
+    if lines:
+        table = board.neighbor_table
+        for name in ('down', 'down_left', 'down_right'):
+            direction = hex_model.LINE_DIRECTIONS[name]
+            axis = direction.index(0)
+            for (line_axis, _), line in sorted(table.lines.items()):
+                if line_axis != axis or rng.random() >= lines:
+                    continue
+                first = min(line, key=lambda coord: sum(a * b for a, b in zip(coord, direction)))
+                coord = tuple(a - b for a, b in zip(first, direction))
+                if coord in board.lines:
+                    continue
+                ray = table.ray(coord, direction)
+                value = sum(colors.get(hex_) == Color.blue for hex_ in ray)
+                text = str(value)
+                if value > 1 and rng.random() < contiguity:
+                    text = ('{{{}}}' if _line_is_contiguous(colors, ray) else '-{}-').format(value)
+                board.add_line(coord, hex_model.LineClue(text, direction))
+    if remaining:
+        board.remaining = sum(
+            hex_.color == Color.yellow and solution[coord].color == Color.blue
+            for coord, hex_ in board._board.items()
+        )
+    return board, solution
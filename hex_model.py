@@ -1,7 +1,11 @@
-import contextlib
+import array
+import collections
 import enum
 import itertools
+import math
+import time
 
+import regions
 import util
 
 
@@ -82,6 +86,20 @@ def generate_hex_circle(distance):
     )
 
 
+def format_clue(value, is_contiguous):
+    """
+    Format a clue as text; the inverse of `parse_clue`.
+    """
+    if value is None:
+        return '-'
+    fmt = {
+        None: '{}',
+        True: '{{{}}}',
+        False: '-{}-',
+    }[is_contiguous]
+    return fmt.format(value)
+
+
 class Hex:
     def __init__(self, text, color, image_box=None):
         self.value, self.is_contiguous = parse_clue(text)
@@ -90,14 +108,7 @@ class Hex:
 
     @property
     def text(self):
-        if self.value is None:
-            return '-'
-        fmt = {
-            None: '{}',
-            True: '{{{}}}',
-            False: '-{}-',
-        }[self.is_contiguous]
-        return fmt.format(self.value)
+        return format_clue(self.value, self.is_contiguous)
 
     def clone(self):
         return Hex(self.text, self.color, self.image_box)
@@ -106,6 +117,26 @@ class Hex:
         return '{}({!r}, Color.{})'.format(type(self).__name__, self.text, self.color.name)
 
 
+class LineClue:
+    """
+    A clue outside the board, counting the blue hexes in a line.
+
+    The line starts at the hex after the clue's position and continues
+    in `direction` (one of `LINE_DIRECTIONS`) to the edge of the board.
+    """
+    def __init__(self, text, direction, image_box=None):
+        self.value, self.is_contiguous = parse_clue(text)
+        self.direction = direction
+        self.image_box = image_box
+
+    @property
+    def text(self):
+        return format_clue(self.value, self.is_contiguous)
+
+    def __repr__(self):
+        return '{}({!r}, {!r})'.format(type(self).__name__, self.text, self.direction)
+
+
 def _ordered_neighbors(x_y_z):
     """
     Yield coordinates surrounding the given coordinate, in adjacent order.
@@ -119,288 +150,557 @@ def _ordered_neighbors(x_y_z):
         dx, dy, dz = -dy, -dz, -dx
 
 
-class AbstractContiguousConstraint:
-    def __init__(self, contiguous_hexes, value, cycle=False):
-        # List of lists of contiguous hexes, in order.
-        self._contiguous_hexes = contiguous_hexes
-        # Does the final element of the final list connect to the first element of the first list
-        self._cycle = cycle
-        self.value = value
+RING_OFFSETS = tuple(_ordered_neighbors((0, 0, 0)))
 
-        self._refactor_cycle()
+# The directions a line clue may point, named for how they appear on screen.
+LINE_DIRECTIONS = {
+    'down': (0, 1, -1),
+    'up': (0, -1, 1),
+    'down_right': (1, 0, -1),
+    'up_left': (-1, 0, 1),
+    'down_left': (-1, 1, 0),
+    'up_right': (1, -1, 0),
+}
 
-    def solve(self, board):
-        raise NotImplementedError
 
-    def is_done(self, board):
-        """
-        Find if all hexes this constraint acts upon are uncovered.
-        """
-        return all(
-            board[coord].color != Color.yellow
-            for section in self._contiguous_hexes
-            for coord in section
-        )
+class NeighborTable:
+    """
+    Neighborhood lookups for every hex on a board, computed once per board layout.
 
-    @classmethod
-    def ring(cls, board, center):
-        center_hex = board[center]
+    Hexes are numbered by their position in `coords`. For each hex we
+    keep the indices of the hexes within radius 1 and 2 of it, and its
+    ring: the six surrounding coordinates in adjacent order (see
+    `_ordered_neighbors`), which may include coordinates not on the board.
 
-        neighbors = list(_ordered_neighbors(center))
-        sections = list(cls._generate_sections(board, neighbors))
+    Hexes are also indexed by line: for each of the three axes, the
+    hexes sharing a value on that axis, so the hexes under a line clue
+    can be found without scanning the board.
+    """
+    RADII = (1, 2)
+
+    def __init__(self, coords):
+        self.coords = tuple(sorted(coords))
+        self.index = {coord: i for i, coord in enumerate(self.coords)}
+
+        # Shift the whole board by each offset at once, rather than
+        # shifting each hex by every offset.
+        shifted = {
+            delta: self._shift(delta)
+            for delta in generate_hex_circle(max(self.RADII))
+            if any(delta)  # don't include yourself
+        }
+        self._radius = {}
+        for distance in self.RADII:
+            columns = [
+                column for (dx, dy, dz), column in shifted.items()
+                if max(abs(dx), abs(dy), abs(dz)) <= distance
+            ]
+            self._radius[distance] = tuple(
+                tuple(i for i in row if i is not None)
+                for row in zip(*columns)
+            )
 
-        cycle = bool(
-            sections and
-            sections[0][0] == neighbors[0] and
-            sections[-1][-1] == neighbors[-1]
-        )
+        self.rings = tuple(zip(*(
+            [(x + dx, y + dy, z + dz) for x, y, z in self.coords]
+            for dx, dy, dz in RING_OFFSETS
+        )))
+
+        # Keyed by (axis, value on that axis); each line is ordered by
+        # the following axis.
+        self.lines = {}
+        for coord in self.coords:
+            for axis in range(3):
+                self.lines.setdefault((axis, coord[axis]), []).append(coord)
+        for (axis, _), line in self.lines.items():
+            line.sort(key=lambda coord: coord[(axis + 1) % 3])
+
+        # Top-to-bottom, left-to-right, as `HexBoard.rows` wants them.
+        self.row_order = tuple(sorted(self.coords, key=lambda x_y_z: (x_y_z[1] - x_y_z[2], x_y_z[0])))
+
+    def _shift(self, delta):
+        dx, dy, dz = delta
+        index = self.index
+        return [index.get((x + dx, y + dy, z + dz)) for x, y, z in self.coords]
+
+    def neighbors(self, coord, distance=1):
+        """
+        Coordinates on the board within the given distance of `coord`, excluding itself.
+        """
+        coords = self.coords
+        return [coords[i] for i in self._radius[distance][self.index[coord]]]
 
-        subcls = ContiguousConstraint if center_hex.is_contiguous else NonContiguousConstraint
-        return subcls(
-            contiguous_hexes=list(sections),
-            value=center_hex.value,
-            cycle=cycle,
-        )
+    def ring(self, coord):
+        return self.rings[self.index[coord]]
 
-    @staticmethod
-    def _generate_sections(board, hexes):
+    def ray(self, coord, direction):
         """
-        Given a list of coordinates, split into contiguous groups.
+        Coordinates from `coord` (exclusive) in `direction` to the last hex on the board.
+
+        Coordinates in gaps in the board are included, in order.
         """
-        def predicate(coord):
-            hex_ = board.get(coord)
-            return not hex_ or hex_.color == Color.black
-        return util.split_iterable(hexes, predicate)
+        axis = direction.index(0)
+        key = (axis + 1) % 3
+        step = direction[key]
+        distances = [
+            (other[key] - coord[key]) * step
+            for other in self.lines.get((axis, coord[axis]), ())
+        ]
+        far = max(distances, default=0)
+        x, y, z = coord
+        dx, dy, dz = direction
+        return [(x + dx * i, y + dy * i, z + dz * i) for i in range(1, far + 1)]
 
-    def _refresh_sections(self, board):
-        start = self._contiguous_hexes[0][0]
-        end = self._contiguous_hexes[-1][-1]
 
-        self._contiguous_hexes = sum(
-            (
-                list(self._generate_sections(board, hexes))
-                for hexes in self._contiguous_hexes
-            ), []
-        )
+def _is_single_group(blue, size, cyclic):
+    """
+    Find if the set bits of `blue`, a mask over `size` positions in a row, form a single group.
+
+    If `cyclic`, the last position is next to the first.
+    """
+    full = (1 << size) - 1
+    before = blue << 1
+    if cyclic:
+        before |= blue >> (size - 1)
+    # Each group starts at a set bit whose predecessor isn't set.
+    starts = blue & ~before & full
+    return (cyclic and blue == full) or starts.bit_count() <= 1
+
+
+# Entry of RING_TABLE for rings no coloring can satisfy.
+RING_CONTRADICTION = 1 << 12
+
+
+def ring_index(yellow, blue, value, contiguous):
+    """
+    Index into RING_TABLE of a ring clue, given masks of the ring's yellow and blue hexes.
+
+    Black hexes and hexes missing from the board look the same to a
+    ring clue, so neither needs a mask.
+    """
+    return (value * 2 + bool(contiguous)) << 12 | yellow << 6 | blue
+
+
+def _build_ring_table():
+    """
+    Find the hexes each ring clue forces, for every state its ring can be in.
+
+    Entries hold the mask of hexes forced blue, and above it the mask of
+    hexes forced black, or RING_CONTRADICTION.
+    """
+    size = len(RING_OFFSETS)
+    table = array.array('H', [RING_CONTRADICTION]) * ring_index(0, 0, size + 1, False)
+    for yellow in range(1 << size):
+        for blue in range(1 << size):
+            if blue & yellow:
+                continue
+            # Masks of the yellow hexes that can be blue, and that can
+            # be black, in some coloring satisfying each clue.
+            can_blue = collections.Counter()
+            can_black = collections.Counter()
+            chosen = yellow
+            while True:
+                coloring = blue | chosen
+                clue = coloring.bit_count(), _is_single_group(coloring, size, cyclic=True)
+                can_blue[clue] |= chosen
+                can_black[clue] |= yellow & ~chosen
+                if not chosen:
+                    break
+                chosen = (chosen - 1) & yellow
+            for value, contiguous in can_blue.keys() | can_black.keys():
+                forced_blue = yellow & ~can_black[value, contiguous]
+                forced_black = yellow & ~can_blue[value, contiguous]
+                table[ring_index(yellow, blue, value, contiguous)] = forced_blue | forced_black << 6
+    return table
+
+
+RING_TABLE = _build_ring_table()
+
+# Clues with more colorings of their yellow cells than this (long `-n-`
+# lines, mostly) aren't enumerated, since a solve could spend far longer
+# on one than its budget allows.
+MAX_COLORINGS = 2048
+
+
+class Clue:
+    """
+    A count of the blue hexes among an ordered list of cells, which may also have to form one group.
+
+    Every clue on the board is one of these: a plain count over a hex's
+    neighbors (`contiguous` None), a `{n}` or `-n-` count around a hex
+    (`cyclic`, since the ring closes on itself), or a count along a
+    line. `cells` holds None for positions missing from the board, which
+    break a group just as a black hex does.
+
+    Plain counts are solved as regions (see `region`). A clue with a
+    contiguity requirement is solved by trying every coloring of its
+    yellow cells, keeping those that also fit the count of each region
+    it overlaps. So the regions can rule out colorings the clue alone
+    allows, and the colorings left can pin down how many of a region's
+    hexes lie within the clue, which is passed back as new regions.
+    """
+    def __init__(self, cells, value, contiguous=None, cyclic=False):
+        self.cells = cells
+        self.value = value
+        self.contiguous = contiguous
+        self.cyclic = cyclic
+        # Counts of each color among our hexes, if a board is keeping them for us.
+        self.colors = None
+        # Masks of our yellow and blue cells, kept up to date while a
+        # board is watching our hexes (see `wake`).
+        self._yellow = self._blue = None
+        self._positions = None
 
-        # Only keep `_cycle` if the start and end are unchanged.
-        self._cycle = (
-            self._cycle and
-            start == self._contiguous_hexes[0][0] and
-            end == self._contiguous_hexes[-1][-1]
+    def __repr__(self):
+        return 'Clue({!r}, {!r}, contiguous={!r}, cyclic={!r})'.format(
+            self.cells, self.value, self.contiguous, self.cyclic,
         )
 
-        self._refactor_cycle()
+    @classmethod
+    def around(cls, board, center):
+        """
+        The clue on the hex at `center`.
+        """
+        hex_ = board[center]
+        if hex_.is_contiguous is not None:
+            cells = [coord if coord in board else None for coord in board.neighbor_table.ring(center)]
+            return cls(cells, hex_.value, hex_.is_contiguous, cyclic=True)
+        distance = 1 if hex_.color == Color.black else 2
+        return cls(board.neighbor_table.neighbors(center, distance), hex_.value)
 
-    def _refactor_cycle(self):
+    @classmethod
+    def along(cls, board, coord):
         """
-        Cycles are a pain to reason about - remove them when we get the chance.
+        The line clue at `coord`.
         """
-        if len(self._contiguous_hexes) != 1 and self._cycle:
-            end = self._contiguous_hexes.pop()
-            self._contiguous_hexes[0] = end + self._contiguous_hexes[0]
-            self._cycle = False
+        clue = board.lines[coord]
+        cells = [
+            coord if coord in board else None
+            for coord in board.neighbor_table.ray(coord, clue.direction)
+        ]
+        return cls(cells, clue.value, clue.is_contiguous)
 
+    @property
+    def hexes(self):
+        return [coord for coord in self.cells if coord is not None]
 
-class ContiguousConstraint(AbstractContiguousConstraint):
-    # Helper methods may assume _contiguous_hexes is accurate, but if
-    # they make changes they must clean up after themselves.
-    def solve(self, board):
-        functions = [
-            self._prune_sections,
-            self._solve_section,
-        ]
+    def region(self, board):
+        """
+        The yellow hexes this clue counts, and how many of them are blue.
+        """
+        return board._get_simplified_region(self.hexes, self.value)
 
-        self._refresh_sections(board)
-        for fn in functions:
-            yield from fn(board)
+    def is_done(self, board):
+        """
+        Find if all hexes this clue counts are uncovered.
+        """
+        if self.colors is not None:
+            return not self.colors[Color.yellow]
+        return all(
+            board[coord].color != Color.yellow
+            for coord in self.hexes
+        )
 
-    def _set_sections(self, sections, color):
+    def watch(self, board):
         """
-        Yield each coordinate in each of the given sections with a color solution.
+        Have `board` keep count of the colors of this clue's hexes, and tell us as they change.
         """
-        yield from ((coord, color) for section in sections for coord in section)
+        self.colors = board.watch(self, self.hexes)
+        self._positions = {coord: i for i, coord in enumerate(self.cells) if coord is not None}
+        self._yellow, self._blue = self._read_masks(board)
 
-    def _prune_sections(self, board):
+    def wake(self, coord, color):
+        """
+        Note that one of our hexes, watched on `board`, changed to `color`.
+        """
+        bit = 1 << self._positions[coord]
+        self._yellow &= ~bit
+        self._blue &= ~bit
+        if color == Color.yellow:
+            self._yellow |= bit
+        elif color == Color.blue:
+            self._blue |= bit
+
+    def _masks(self, board):
+        """
+        Masks, by position in `cells`, of the yellow and the blue hexes.
+        """
+        if self._positions is not None:
+            return self._yellow, self._blue
+        return self._read_masks(board)
+
+    def _read_masks(self, board):
+        yellow = blue = 0
+        for i, coord in enumerate(self.cells):
+            if coord is not None:
+                color = board[coord].color
+                if color == Color.yellow:
+                    yellow |= 1 << i
+                elif color == Color.blue:
+                    blue |= 1 << i
+        return yellow, blue
+
+    def _colorings(self, yellow, blue):
         """
-        Prune sections known to not contain blue hexes.
+        Yield each mask of yellow cells that, made blue, satisfies the clue.
         """
-        if len(self._contiguous_hexes) <= 1:
+        size = len(self.cells)
+        needed = self.value - blue.bit_count()
+        if not 0 <= needed <= yellow.bit_count():
             return
-
-        # If we know any blue hexes, prune sections that are not connected.
-        for i, section in enumerate(self._contiguous_hexes):
-            if any(board[coord].color == Color.blue for coord in section):
-                yield from self._set_sections(self._contiguous_hexes[:i], Color.black)
-                yield from self._set_sections(self._contiguous_hexes[i + 1:], Color.black)
-                self._contiguous_hexes = [section]
+        if self.contiguous:
+            # Every blue hex lies in one run of `value` cells.
+            if not self.value:
+                yield 0
                 return
+            full = (1 << size) - 1
+            runs = set()
+            for start in range(size if self.cyclic else size - self.value + 1):
+                run = ((1 << self.value) - 1) << start
+                runs.add((run | run >> size) & full)
+            for run in runs:
+                if not run & ~(yellow | blue) and not blue & ~run:
+                    yield run & yellow
+            return
 
-        # Prune sections that are too small to accommodate our value.
-        to_remove, self._contiguous_hexes = util.partition_if(
-            self._contiguous_hexes,
-            lambda section: len(section) < self.value
-        )
-        yield from self._set_sections(to_remove, Color.black)
+        positions = [i for i in range(size) if yellow >> i & 1]
+        for chosen in itertools.combinations(positions, needed):
+            coloring = sum(1 << i for i in chosen)
+            if self.contiguous is None or not _is_single_group(blue | coloring, size, self.cyclic):
+                yield coloring
 
-    def _solve_cyclic_section(self, board):
-        section, = self._contiguous_hexes
-        blues = [i for i, coord in enumerate(section) if board[coord].color == Color.blue]
-        if not blues:
-            return
-        # If we know some blues, we might know the contiguous section wont reach the far side
-        # 3: bbyyyy -> bbykky
-        possible = set()
-        for i, _ in enumerate(section):
-            section_range = {j % len(section) for j in range(i, i + self.value)}
-            if all(blue in section_range for blue in blues):
-                possible |= section_range
-        possible = {section[p] for p in possible}
-
-        # Need to be careful with order here - if there's something to remove,
-        # we're necessarily no longer cyclical (🙌), but we have to ensure
-        # we repair the correct seam; in the following example, we would not
-        # want to accidentally return [2, 1] after removing 0s:
-        # 1 2 0 0
-        # 0 1 2 0
-        # 0 0 1 2
-        # 2 0 0 1
-
-        # We use `itertools.groupby` to identify up to three groups
-        # (the contiguous sections in the examples above), from which
-        # we separate to_keep from to_remove while keeping them grouped.
-        to_keep = []
-        to_remove = []
-        for keep, subsection in itertools.groupby(section, lambda coord: coord in possible):
-            (to_keep if keep else to_remove).append(list(subsection))
-
-        if to_remove:
-            # The only case where we have more than one group to_keep
-            # is where it straddles the seam. We reverse any groups
-            # to ensure we repair the seam correctly.
-            self._contiguous_hexes = [sum(reversed(to_keep), [])]
-            self._cycle = False  # 🙌
-            yield from self._set_sections(to_remove, Color.black)
-
-    def _solve_noncyclic_section(self, board):
-        section, = self._contiguous_hexes
-        blues = [i for i, coord in enumerate(section) if board[coord].color == Color.blue]
-
-        # If we know some blues, we might know the contiguous section wont reach the edges.
-        # 3: yybbyy -> kybbyk
-        if blues:
-            max_left = max(0, blues[-1] - self.value + 1)
-            min_right = blues[0] + self.value
-            temp = list(
-                self._set_sections([section[:max_left], section[min_right:]], Color.black)
-            )
-            yield from temp
-            section[:] = section[max_left:min_right]
-
-        # If the area is small enough, we know the center is blue.
-        # 4: yyyyy -> ybbby
-        new_blues = [
-            coord for coord in section[-self.value:self.value]
-            if board[coord].color == Color.yellow
-        ]
-        yield from self._set_sections([new_blues], Color.blue)
+    def _coloring_count(self, yellow, blue):
+        """
+        The number of colorings `_colorings` tries.
+        """
+        if self.contiguous:
+            return len(self.cells)
+        return math.comb(yellow.bit_count(), self.value - blue.bit_count())
 
-        # # Join non-contiguous blues
-        # # 5: yybybyy ->
-        # # XXX: i can't actually come up with an example of this
-        # #      that isn't covered by the above rules!
-        # new_blues = [
-        #     coord for coord in section[blues[0]:blues[-1]]
-        #     if board[coord].color == Color.yellow
-        # ]
-        # yield from self._set_sections([new_blues], Color.blue)
+    def _is_split(self, yellow, blue):
+        """
+        Find if our blue hexes lie in stretches of cells that no yellow cells could join.
+        """
+        size = len(self.cells)
+        open_ = yellow | blue
+        stretch = 0
+        stretches = set()
+        for i in range(size):
+            if not open_ >> i & 1:
+                stretch += 1
+            elif blue >> i & 1:
+                stretches.add(stretch)
+        if self.cyclic and open_ & 1 and open_ >> (size - 1) & 1 and stretch in stretches:
+            # The last stretch carries on around the ring into the first.
+            stretches.discard(stretch)
+            stretches.add(0)
+        return len(stretches) > 1
+
+    def _bounds(self, board, store, yellow, blue):
+        """
+        Bound how many of our yellow cells can be blue within each region of `store` overlapping them.
 
-    def _solve_section(self, board):
+        Returns a list of (region hexes, mask of our cells among them,
+        fewest, most, the region's count less its blue hexes), for each
+        region that bounds our colorings more tightly than the clue
+        itself does.
         """
-        Once there's a single remaining section, analyze it for further solutions.
+        index = {coord: i for i, coord in enumerate(self.cells) if coord is not None and yellow >> i & 1}
+        needed = self.value - blue.bit_count()
+        bounds = []
+        for hexes, value in store.overlapping(index).items():
+            inside = 0
+            outside = 0
+            for coord in hexes:
+                i = index.get(coord)
+                if i is not None:
+                    inside |= 1 << i
+                    continue
+                color = board[coord].color
+                if color == Color.blue:
+                    value -= 1
+                elif color == Color.yellow:
+                    outside += 1
+            fewest = max(0, value - outside)
+            most = min(value, inside.bit_count())
+            if inside == yellow and fewest <= needed <= most:
+                # Every coloring has `needed` blue cells, so this tells us nothing.
+                continue
+            if not fewest and most == inside.bit_count():
+                continue
+            bounds.append((hexes, inside, fewest, most, value))
+        return bounds
+
+    def solve(self, board, store=None, budget=None):
         """
-        if len(self._contiguous_hexes) != 1:
-            return
+        Yield the hexes this clue forces, given the regions in `store` if any.
+
+        Returns new regions, as a dict: where every coloring left puts
+        the same number of blue hexes in the part of a region within our
+        cells, that part is a region, and so is the rest.
 
-        if self._cycle:
-            yield from self._solve_cyclic_section(board)
+        Each coloring tried is charged to `budget`, if given. A clue with
+        more than MAX_COLORINGS colorings isn't enumerated at all; its
+        count is left to its region.
+        """
+        if self.contiguous is None:
+            return {}
+        yellow, blue = self._masks(board)
+        # If there's no options this is either an unsolvable board or we messed up.
+        assert 0 <= self.value - blue.bit_count() <= yellow.bit_count(), self
+        if not yellow:
+            return {}
+        bounds = self._bounds(board, store, yellow, blue) if store is not None else []
+
+        counts = [set() for _ in bounds]
+        if not bounds and self.cyclic and len(self.cells) == len(RING_OFFSETS):
+            forced = RING_TABLE[ring_index(yellow, blue, self.value, self.contiguous)]
+            assert forced != RING_CONTRADICTION, self
+            forced_blue, forced_black = forced & 0b111111, forced >> 6
+        elif not self.contiguous and self._is_split(yellow, blue):
+            # Already not a single group, whatever else is uncovered;
+            # all that's left is the count, which our region covers.
+            return {}
+        elif self._coloring_count(yellow, blue) > MAX_COLORINGS:
+            return {}
         else:
-            yield from self._solve_noncyclic_section(board)
+            possible = False
+            forced_blue = yellow
+            forced_black = yellow
+            for coloring in self._colorings(yellow, blue):
+                inside = [(coloring & mask).bit_count() for _, mask, _, _, _ in bounds]
+                if not all(fewest <= count <= most for count, (_, _, fewest, most, _) in zip(inside, bounds)):
+                    continue
+                possible = True
+                forced_blue &= coloring
+                forced_black &= ~coloring
+                for seen, count in zip(counts, inside):
+                    seen.add(count)
+            assert possible, self
+            if budget is not None:
+                budget.spend(self._coloring_count(yellow, blue))
+
+        for i, coord in enumerate(self.cells):
+            if forced_blue >> i & 1:
+                yield coord, Color.blue
+            elif forced_black >> i & 1:
+                yield coord, Color.black
 
+        new_regions = {}
+        for (hexes, mask, _, _, value), seen in zip(bounds, counts):
+            if len(seen) == 1:
+                count, = seen
+                part = frozenset(coord for i, coord in enumerate(self.cells) if mask >> i & 1)
+                rest = frozenset(
+                    coord for coord in hexes - part if board[coord].color == Color.yellow
+                )
+                if rest:
+                    new_regions[part] = count
+                    new_regions[rest] = value - count
+        return new_regions
 
-class NonContiguousConstraint(AbstractContiguousConstraint):
-    def solve(self, board):
-        self._refresh_sections(board)
-        blue_sections = (
-            (i, section) for i, section in enumerate(self._contiguous_hexes)
-            if any(board[coord].color == Color.blue for coord in section)
-        )
-        blue_section_id = None
-        current_blues = 0
-        with contextlib.suppress(StopIteration):
-            blue_section_id, blue_section = next(blue_sections)
-            current_blues = sum(board[coord].color == Color.blue for coord in blue_section)
-            next(blue_sections)
-            # If we have two blue sections we've already necessarily got
-            # a non-contiguous setup - there's nothing else we can learn
-            # from this.
-            return
 
-        # Check all options for the remaining spots, looking for spots
-        # where there is only one option.
-        remaining_blues = self.value - current_blues
-        available_coords = [
-            (i, coord) for i, section in enumerate(self._contiguous_hexes)
-            for coord in section if board[coord].color != Color.blue
-        ]
-        spot_options = {
-            coord: set() for section in self._contiguous_hexes
-            for coord in section if board[coord].color != Color.blue
-        }
-        for id_coords in itertools.combinations(available_coords, remaining_blues):
-            section_ids, coords = zip(*id_coords)
-            section_ids = set(section_ids)
-            if blue_section_id is not None:
-                section_ids.add(blue_section_id)
-
-            # If we're only in one section we're in danger of being contiguous
-            if len(section_ids) == 1:
-                section_id, = section_ids
-
-                blue_groups = (
-                    blue for blue, _ in itertools.groupby(
-                        self._contiguous_hexes[section_id],
-                        key=lambda coord: board[coord].color == Color.blue or coord in coords
-                    )
-                    if blue
-                )
-                # Skip contiguous configurations
-                try:
-                    next(blue_groups)
-                    next(blue_groups)
-                except StopIteration:
-                    continue
+# Pairs of regions compared between checks on the solver's budget.
+_BUDGET_INTERVAL = 64
 
-            # This is a valid configuration - mark down which are blue
-            # and which are black.
-            for coord, options in spot_options.items():
-                options.add(Color.blue if coord in coords else Color.black)
+# Yielded by `HexBoard._solve` when its budget runs out.
+_PAUSE = object()
 
-        for coord, options in spot_options.items():
-            # If there's no options this is either an unsolvable board or we messed up.
-            assert options, coord
-            if len(options) == 1:
-                color, = options
-                yield coord, color
+# The solver's rule sets, cheapest first; see `HexBoard._solve`.
+TIERS = ('regions', 'constraints', 'populate', 'subdivide', 'spanning', 'elimination')
+
+
+def _subdivide(pairs, budget=None, start=0):
+    """
+    Derive new regions from each of the given pairs of regions that overlap.
+
+    Returns the new regions, a list of `(region, parts)` for each
+    region found to be the disjoint union of smaller regions, and the
+    position of the first pair not compared before `budget` ran out
+    (or None, if every pair was compared). Comparison begins at the
+    pair at position `start`, to resume an earlier call.
+    """
+    # examine overlapping regions
+    new_regions = {}
+    implied = []
+    stopped = None
+    pairs = itertools.islice(pairs, start, None)
+    for i, ((hexes1, value1), (hexes2, value2)) in enumerate(pairs, start):
+        if budget is not None and i > start and not (i - start) % _BUDGET_INTERVAL:
+            if not budget.spend(_BUDGET_INTERVAL):
+                stopped = i
+                break
+        overlap = frozenset(hexes1 & hexes2)
+        if not overlap:
+            continue
+
+        hexes1_exclusive = frozenset(hexes1 - overlap)
+        hexes2_exclusive = frozenset(hexes2 - overlap)
+        # find the upper and lower bounds for each that can fit in the overlap.
+        omax = min(len(overlap), value2, value1)
+        omin = max(
+            value2 - len(hexes2_exclusive),
+            value1 - len(hexes1_exclusive),
+            0,
+        )
+        if omin == omax:
+            new_regions[overlap] = omax
+            new_regions[hexes1_exclusive] = value1 - omax
+            new_regions[hexes2_exclusive] = value2 - omax
+            if hexes1_exclusive:
+                implied.append((hexes1, (overlap, hexes1_exclusive)))
+            if hexes2_exclusive:
+                implied.append((hexes2, (overlap, hexes2_exclusive)))
+    new_regions.pop(frozenset(), 0)
+    return new_regions, implied, stopped
+
+
+def _subdivide_component(component, budget=None, start=0):
+    return _subdivide(itertools.combinations(component.items(), 2), budget, start)
 
 
 class HexBoard:
-    def __init__(self, remaining=None):
+    def __init__(self, remaining=None, max_regions=regions.DEFAULT_MAX_REGIONS, executor=None,
+                 elimination=True, sparse=False, tiers=TIERS, lazy=False):
         self._board = {}
         self._clicked = {}
+        self.lines = {}
         self._regions = None
         self._contiguous_constraints = None
+        self._revealed = False
+        self._color_counts = collections.Counter()
+        self._watchers = {}
+        # Constraints to solve, queued as their hexes change.
+        self._queue = collections.deque()
+        self._queued = set()
+        self._settled = set()
+        self._partial = {}
+        self._spanning_partial = None, None
+        self._solver = None
+        self._budget = util.Budget()
         self.remaining = remaining
+        self.max_regions = max_regions
+        # Subdivide independent components in parallel, eg with a
+        # concurrent.futures.ProcessPoolExecutor.
+        self.executor = executor
+        # Once subdivision stalls, combine all the regions by linear
+        # elimination (see the `elimination` module).
+        self.elimination = elimination
+        # Evaluate regions as a sparse matrix (see the `region_matrix`
+        # module), for boards with thousands of clues.
+        self.sparse = sparse
+        self._region_matrix = None
+        self.tiers = tiers
+        # Add clues to the solve a few at a time, nearest the hexes
+        # changed since the last solve first, so the first deductions
+        # come sooner.
+        self.lazy = lazy
+        self._pending_clues = []
+        self._batch = 1
+        self._changed = set()
+        # For each tier, counts of its runs, the runs that made
+        # progress, its deductions, and the seconds it took.
+        self.tier_stats = {}
+        self._neighbor_table = None
 
     def get(self, key, default=None):
         try:
@@ -416,20 +716,84 @@ class HexBoard:
         return self._board[coord]
 
     def __setitem__(self, key, value):
-        coord = coordinate_by_key(key)
+        # A suspended solve can't account for the change; start afresh.
+        self._solver = None
+        self._set(coordinate_by_key(key), value)
+
+    def _set(self, coord, value):
+        old = self.get(coord)
+        if old is None:
+            self._neighbor_table = None
+            self._region_matrix = None
+        if old is not None:
+            self._changed.add(coord)
         self._board[coord] = value
         self._clicked.pop(coord, None)
+        self._recolor(coord, old and old.color, value.color)
+
+    def _recolor(self, coord, old, new):
+        """
+        Keep color counts up to date as the hex at `coord` changes from `old` to `new`.
+        """
+        if old == new:
+            return
+        watchers = self._watchers.get(coord, ())
+        for constraint in watchers:
+            constraint.wake(coord, new)
+            self._schedule(constraint)
+        if self._region_matrix is not None:
+            self._region_matrix.recolor(coord, new)
+        counters = [self._color_counts]
+        counters.extend(constraint.colors for constraint in watchers)
+        for counter in counters:
+            if old is not None:
+                counter[old] -= 1
+            counter[new] += 1
+
+    def _schedule(self, constraint):
+        if constraint not in self._queued:
+            self._queued.add(constraint)
+            self._queue.append(constraint)
+
+    def watch(self, constraint, coords):
+        """
+        Count the colors of the given hexes, kept up to date as they change.
+        """
+        for coord in coords:
+            self._watchers.setdefault(coord, []).append(constraint)
+        return collections.Counter(self[coord].color for coord in coords)
+
+    @property
+    def color_counts(self):
+        """
+        Number of hexes of each color, counting solutions not yet applied.
+        """
+        return {color: self._color_counts[color] for color in Color}
 
     def __contains__(self, key):
         coord = coordinate_by_key(key)
         return coord in self._board
 
+    def add_line(self, key, clue):
+        """
+        Add a line clue, positioned at the given coordinate off the board.
+        """
+        coord = coordinate_by_key(key)
+        if coord in self._board:
+            raise ValueError("Line clues must be placed off the board.")
+        self.lines[coord] = clue
+
+    def line_hexes(self, key):
+        """
+        Coordinates of the hexes covered by the line clue at the given coordinate.
+        """
+        coord = coordinate_by_key(key)
+        ray = self.neighbor_table.ray(coord, self.lines[coord].direction)
+        return [hex_ for hex_ in ray if hex_ in self._board]
+
     @property
     def is_solved(self):
-        return all(
-            self[coord].color != Color.yellow
-            for coord in self._board
-        )
+        return not self._color_counts[Color.yellow]
 
     @property
     def rows(self):
@@ -446,19 +810,26 @@ class HexBoard:
         row number represents the row's vertical positioning relative to
         the other rows: sequential rows will have sequential row
         numbers. Each row is composed of its hex coordinate and the Hex
-        object at that coordinate.
+        object at that coordinate, including solutions not yet applied.
         """
-        def sort_key(x_y_z__value):
-            (x, y, z), value = x_y_z__value
-            return y - z, x
-
         def group_key(x_y_z__value):
             (x, y, z), value = x_y_z__value
             return y - z
 
-        data = sorted(self._board.items(), key=sort_key)
+        data = ((coord, self[coord]) for coord in self.neighbor_table.row_order)
         return itertools.groupby(data, group_key)
 
+    @property
+    def neighbor_table(self):
+        """
+        Neighbor lookups for the current board layout.
+
+        Built on first use, and rebuilt only if hexes are added.
+        """
+        if self._neighbor_table is None or len(self._neighbor_table.coords) != len(self._board):
+            self._neighbor_table = NeighborTable(self._board)
+        return self._neighbor_table
+
     @property
     def leftmost(self):
         """
@@ -472,13 +843,7 @@ class HexBoard:
         """
         Unordered set of neighbors to the given coordinate within the given distance.
         """
-        return {
-            neighbor for neighbor in (
-                tuple(map(sum, zip(coord, delta)))
-                for delta in generate_hex_circle(distance)
-                if any(delta)  # don't yield yourself
-            ) if neighbor in self._board
-        }
+        return set(self.neighbor_table.neighbors(coord, distance))
 
     def _get_simplified_region(self, hexes, value):
         filtered_hexes = set()
@@ -497,62 +862,277 @@ class HexBoard:
         """
         Process information into generic regions with values.
         """
-        self._regions = {}
+        self._regions = regions.RegionStore(self.max_regions)
+        self._region_matrix = None
+        unknown = set(self.tiers) - set(TIERS)
+        if unknown:
+            raise ValueError("Unknown solver tiers: {}".format(', '.join(sorted(unknown))))
+        if self.lazy and 'populate' not in self.tiers:
+            raise ValueError("Lazy population needs the 'populate' tier")
+        self.tier_stats = {name: collections.Counter() for name in self.tiers}
         self._contiguous_constraints = set()
+        self._watchers = {}
+        self._queue = collections.deque()
+        self._queued = set()
+        self._settled = set()
+        self._partial = {}
+        self._spanning_partial = None, None
+        self._revealed = False
+
+        clues = [coord for coord, hex_ in self._board.items() if hex_.value is not None]
+        clues.extend(coord for coord, clue in self.lines.items() if clue.value is not None)
         if self.remaining is not None:
-            self._regions[frozenset(
-                coord for coord, hex_ in self._board.items()
-                if hex_.color == Color.yellow
-            )] = self.remaining
-        for coord, hex_ in self._board.items():
-            if hex_.value is None:
+            # The `remaining` counter covers every yellow hex, so
+            # checking it is slow; lazily, it comes last.
+            clues.append(None)
+        if self.lazy:
+            # Nearest last, to pop first.
+            self._pending_clues = self._focus_order(clues)[::-1]
+            self._batch = 1
+        else:
+            self._pending_clues = []
+            for coord in clues:
+                self._add_any_clue(coord)
+        self._changed = set()
+
+    def _focus_order(self, clues):
+        """
+        Sort clues by their distance from the hexes changed since the last solve.
+
+        The `remaining` counter, as None, sorts last.
+        """
+        distances = {coord: 0 for coord in self._changed if coord in self._board}
+        frontier = list(distances)
+        table = self.neighbor_table
+        while frontier:
+            reached = []
+            for coord in frontier:
+                for neighbor in table.neighbors(coord):
+                    if neighbor not in distances:
+                        distances[neighbor] = distances[coord] + 1
+                        reached.append(neighbor)
+            frontier = reached
+
+        far = len(self._board)
+
+        def distance(coord):
+            if coord is None:
+                return far + 1
+            if coord in self.lines:
+                return min(map(distances.get, self.line_hexes(coord), itertools.repeat(far)), default=far)
+            return distances.get(coord, far)
+        return sorted(clues, key=distance)
+
+    def _add_any_clue(self, coord):
+        if coord is None:
+            self._regions.add(frozenset(
+                coord for coord in self._board
+                if self[coord].color == Color.yellow
+            ), self.remaining, pinned=True, spanning=True)
+        elif coord in self.lines:
+            self._add_line_clue(coord, self.lines[coord])
+        else:
+            self._add_clue(coord, self[coord])
+
+    def _add_line_clue(self, coord, clue):
+        self._add_clue_region(Clue.along(self, coord))
+
+    def _add_clue(self, coord, hex_):
+        if hex_.value is None:
+            return
+        self._add_clue_region(Clue.around(self, coord))
+
+    def _add_clue_region(self, clue):
+        """
+        Add a clue's count to the regions, and if it needs more than counting, the clue itself.
+        """
+        if clue.contiguous is not None and not clue.is_done(self):
+            clue.watch(self)
+            self._contiguous_constraints.add(clue)
+            self._schedule(clue)
+        hexes, value = clue.region(self)
+        if self._regions.add(hexes, value, pinned=True):
+            self._schedule_overlapping([hexes])
+
+    def _schedule_overlapping(self, added):
+        """
+        Queue the constraints on hexes in any of the `added` regions, which may narrow them further.
+        """
+        for hexes in added:
+            if len(hexes) > regions.MAX_OVERLAPPING:
                 continue
-            if hex_.is_contiguous is not None:
-                self._contiguous_constraints.add(AbstractContiguousConstraint.ring(self, coord))
-            distance = 1 if hex_.color == Color.black else 2
-            hexes, value = self._get_simplified_region(self._neighbors(coord, distance), hex_.value)
-            self._regions[hexes] = value
+            for coord in hexes:
+                for constraint in self._watchers.get(coord, ()):
+                    self._schedule(constraint)
 
     def _identify_solved_regions(self):
+        if self.sparse:
+            return self._identify_solved_regions_sparse()
         solutions = set()
+        for hexes, value in list(self._regions.items()):
+            new_hexes, new_value = self._get_simplified_region(hexes, value)
+            if len(new_hexes) == new_value:
+                solutions.update((hex_, Color.blue) for hex_ in new_hexes)
+                self._regions.discard(hexes)
+            elif new_value == 0:
+                solutions.update((hex_, Color.black) for hex_ in new_hexes)
+                self._regions.discard(hexes)
+            elif new_hexes != hexes:
+                self._regions.rekey(hexes, new_hexes, new_value)
+        return solutions
+
+    def _identify_solved_regions_sparse(self):
+        if self._region_matrix is None:
+            import region_matrix
+
+            self._region_matrix = region_matrix.RegionMatrix(self)
+        blue, black, simplified = self._region_matrix.evaluate(self._regions)
+        solutions = set()
+        for found, color in ((blue, Color.blue), (black, Color.black)):
+            for hexes, _ in found:
+                solutions.update((coord, color) for coord in hexes if self[coord].color == Color.yellow)
+                self._regions.discard(hexes)
+        for hexes, value in simplified:
+            new_hexes = frozenset(coord for coord in hexes if self[coord].color == Color.yellow)
+            self._regions.rekey(hexes, new_hexes, value)
+        return solutions
+
+    def _subdivide_overlapping_regions(self, components):
+        """
+        Derive new regions from the overlapping regions in each component.
+
+        A component holding the same regions as when it was last
+        subdivided is skipped, since everything it could tell us is
+        already known. The rest are subdivided in `executor`, if set;
+        there, the budget is only checked between rounds.
+
+        A component whose subdivision is cut short by the budget picks
+        up where it stopped next time, if its regions are unchanged.
+        """
+        keys = []
+        pending = []
+        settled = set()
+        for component in components:
+            key = tuple(component.items())
+            settled.add(key)
+            if key not in self._settled and len(component) > 1:
+                keys.append(key)
+                pending.append(component)
+        if self.executor is not None and len(pending) > 1:
+            results = list(self.executor.map(_subdivide_component, pending))
+        else:
+            results = [
+                self._resume_subdivide(itertools.combinations(component.items(), 2), self._partial.get(key))
+                for key, component in zip(keys, pending)
+            ]
+        partial = {}
+        for key, (_, _, stopped) in zip(keys, results):
+            if stopped is not None:
+                settled.discard(key)
+                partial[key] = stopped
+        self._settled = settled
+        self._partial = partial
+        return self._new_regions(results)
+
+    def _subdivide_spanning_regions(self, components, spanning):
+        """
+        Derive new regions from the overlap of each spanning region with each component's regions.
+
+        Spanning regions aren't compared with each other: they mostly
+        descend from `remaining`, and comparing them pairwise floods the
+        store without turning up anything the components don't. As with
+        the components, a pass cut short picks up where it stopped, and
+        one over the same regions as the last full pass is skipped.
+        """
+        others = [item for component in components for item in component.items()]
+        pairs = itertools.product(spanning.items(), others)
+        key = tuple(spanning.items()), tuple(others)
+        last_key, partial = self._spanning_partial
+        if key != last_key:
+            partial = None
+        elif partial is None:
+            return {}, []
+        result = self._resume_subdivide(pairs, partial)
+        self._spanning_partial = key, result[2]
+        return self._new_regions([result])
+
+    def _resume_subdivide(self, pairs, partial=None):
+        """
+        Subdivide `pairs` within the budget, resuming from `partial` if given.
+
+        Returns what `_subdivide` does, except that a pass cut short
+        returns no regions, and in place of where it stopped, the
+        partial state to resume it from. What it found is held back
+        until it finishes, since adding it to the store would change
+        the pairs being compared, and so where to resume.
+        """
+        start, new_regions, implied = partial or (0, {}, [])
+        more_regions, more_implied, stopped = _subdivide(pairs, self._budget, start)
+        new_regions = {**new_regions, **more_regions}
+        implied = implied + more_implied
+        if stopped is not None:
+            return {}, [], (stopped, new_regions, implied)
+        return new_regions, implied, None
+
+    def _eliminate(self):
+        """
+        Derive the hexes forced by all the regions taken together, as single-hex regions.
+
+        The whole board is one system if it's small enough; otherwise
+        each component is solved alone.
+        """
+        import elimination
+
+        components, spanning = self._regions.components()
+        everything = dict(spanning)
+        for component in components:
+            everything.update(component)
+        systems = [everything]
+        if len(set().union(*everything)) > elimination.MAX_CELLS:
+            systems = components
+
         new_regions = {}
-        for hexes, value in self._regions.items():
-            hexes, value = self._get_simplified_region(hexes, value)
-            if len(hexes) == value:
-                solutions.update((hex_, Color.blue) for hex_ in hexes)
-            elif value == 0:
-                solutions.update((hex_, Color.black) for hex_ in hexes)
-            else:
-                new_regions[hexes] = value
-        return solutions, new_regions
-
-    def _subdivide_overlapping_regions(self):
-        # examine overlapping regions
-        new_regions = {}
-        # compare each region to each other
-        for (hexes1, value1), (hexes2, value2) in itertools.combinations(self._regions.items(), 2):
-            overlap = frozenset(hexes1 & hexes2)
-            if not overlap:
+        for system in systems:
+            if self._budget.exhausted or len(set().union(*system)) > elimination.MAX_CELLS:
                 continue
-
-            hexes1_exclusive = frozenset(hexes1 - overlap)
-            hexes2_exclusive = frozenset(hexes2 - overlap)
-            # find the upper and lower bounds for each that can fit in the overlap.
-            omax = min(len(overlap), value2, value1)
-            omin = max(
-                value2 - len(hexes2_exclusive),
-                value1 - len(hexes1_exclusive),
-                0,
+            self._budget.spend(len(system))
+            simplified = dict(self._get_simplified_region(hexes, value) for hexes, value in system.items())
+            simplified.pop(frozenset(), None)
+            for coord, color in elimination.forced(simplified).items():
+                new_regions[frozenset([coord])] = int(color == Color.blue)
+        return self._new_regions([(new_regions, [], None)])
+
+    def _new_regions(self, results):
+        new_regions = {}
+        implied = []
+        for regions_, implied_, _ in results:
+            new_regions.update(
+                (hexes, value) for hexes, value in regions_.items()
+                if not self._regions.is_known(hexes)
             )
-            if omin == omax:
-                if overlap not in self._regions:
-                    new_regions[overlap] = omax
-                if hexes1_exclusive not in self._regions:
-                    new_regions[hexes1_exclusive] = value1 - omax
-                if hexes2_exclusive not in self._regions:
-                    new_regions[hexes2_exclusive] = value2 - omax
-        new_regions.pop(frozenset(), 0)
-        return new_regions
+            implied.extend(implied_)
+        return new_regions, implied
+
+    def _update_regions(self, subdivision):
+        new_regions, implied = subdivision
+        added = self._regions.update(new_regions)
+        for hexes, parts in implied:
+            self._regions.retire_implied(hexes, parts)
+        self._schedule_overlapping(added)
+        return bool(added)
+
+    def reveal(self, key, hex_):
+        """
+        Replace a hex with its uncovered version, as read back from the game.
+
+        If a solve is in progress, the hex's clue is added to it, and
+        will be taken into account from the solver's next round.
+        """
+        coord = coordinate_by_key(key)
+        self._set(coord, hex_)
+        if self._regions is not None and hex_.value is not None:
+            self._add_clue(coord, hex_)
+            self._revealed = True
 
     def _click(self, coord, color):
         hex_ = self[coord].clone()
@@ -562,39 +1142,163 @@ class HexBoard:
             self.remaining -= 1
         hex_.color = color
         self._clicked[coord] = hex_
+        self._recolor(coord, Color.yellow, color)
+
+    @property
+    def suspended(self):
+        """
+        True if a solve stopped before finishing, and calling `solve` again will resume it.
+        """
+        return self._solver is not None
 
-    def solve(self):
+    def solve(self, budget=None):
         """
         Yield new information that can be inferred from the board state.
+
+        Given a `util.Budget`, solving stops once the budget runs out,
+        having yielded everything proven so far. The next call picks up
+        where this one left off, unless the board was changed in the
+        meantime (other than by `reveal`).
         """
-        for coord, color in self._solve():
+        self._budget = budget or util.Budget()
+        if self._solver is None:
+            self._solver = self._solve()
+        for deduction in self._solver:
+            if deduction is _PAUSE:
+                return
+            coord, color = deduction
             self._click(coord, color)
             yield coord, color
+        self._solver = None
+
+    def _tier_regions(self):
+        solutions = self._identify_solved_regions()
+        yield from solutions
+        return bool(solutions)
+
+    def _tier_constraints(self):
+        # Only constraints whose hexes or overlapping regions changed
+        # since they were last solved can tell us anything new. Their
+        # deductions and regions wake other constraints in turn, until
+        # none have more to say.
+        progress = False
+        while self._queue and not self._budget.exhausted:
+            constraint = self._queue.popleft()
+            self._queued.remove(constraint)
+            if constraint not in self._contiguous_constraints:
+                continue
+            self._budget.spend()
+            solver = constraint.solve(self, self._regions, self._budget)
+            solutions = []
+            try:
+                while True:
+                    solutions.append(next(solver))
+            except StopIteration as stop:
+                new_regions = stop.value
+            added = self._regions.update(new_regions)
+            self._schedule_overlapping(added)
+            progress = progress or bool(solutions) or bool(added)
+            yield from solutions
+            if constraint.is_done(self):
+                self._contiguous_constraints.remove(constraint)
+        return progress
+
+    def _tier_populate(self):
+        # Each batch is twice the last, so the cheaper tiers run after
+        # the first few clues without rerunning once per clue.
+        yield from ()
+        if not self._pending_clues:
+            return False
+        for _ in range(min(self._batch, len(self._pending_clues))):
+            self._add_any_clue(self._pending_clues.pop())
+        self._batch *= 2
+        return True
+
+    def _tier_subdivide(self):
+        yield from ()  # Adds regions, rather than making deductions.
+        components, _ = self._regions.components()
+        return self._update_regions(self._subdivide_overlapping_regions(components))
+
+    def _tier_spanning(self):
+        # Spanning regions, like the `remaining` counter, join every
+        # component into one problem; only bring them in once each
+        # component is stuck on its own.
+        yield from ()
+        components, spanning = self._regions.components()
+        if not spanning:
+            return False
+        return self._update_regions(self._subdivide_spanning_regions(components, spanning))
+
+    def _tier_elimination(self):
+        yield from ()
+        if not self.elimination:
+            return False
+        return self._update_regions(self._eliminate())
+
+    def _run_tier(self, name):
+        """
+        Run one tier, yielding its deductions, and return whether it made progress.
+
+        Time spent by our caller between deductions isn't counted as the tier's.
+        """
+        stats = self.tier_stats[name]
+        tier = getattr(self, '_tier_' + name)()
+        start = time.perf_counter()
+        try:
+            while True:
+                deduction = next(tier)
+                stats['seconds'] += time.perf_counter() - start
+                stats['deductions'] += 1
+                yield deduction
+                start = time.perf_counter()
+        except StopIteration as stop:
+            progress = stop.value
+        stats['seconds'] += time.perf_counter() - start
+        stats['runs'] += 1
+        stats['progress'] += progress
+        return progress
 
     def _solve(self):
+        """
+        Run the cheapest tier until it stalls, then the next; after any progress, start over.
+        """
         self._populate_regions()
 
-        progress = True
-        while progress:
-            progress = False
-            # Identify newly-solved regions
-            solutions = True
-            while solutions:
-                solutions, self._regions = self._identify_solved_regions()
-                yield from solutions
-
-            new_regions = self._subdivide_overlapping_regions()
-            progress = progress or bool(new_regions)
-            self._regions.update(new_regions)
-
-            for constraint in set(self._contiguous_constraints):
-                solutions = list(constraint.solve(self))
-                progress = progress or bool(solutions)
-                yield from solutions
-                if constraint.is_done(self):
-                    self._contiguous_constraints.remove(constraint)
-
-    def apply_clicked(self):
-        for coord, hex_ in self._clicked.items():
-            self._board[coord].color = hex_.color
-        self._clicked = {}
+        tier = 0
+        # Whether any tier made progress since retired regions were last pruned.
+        changed = False
+        while tier < len(self.tiers):
+            progress = yield from self._run_tier(self.tiers[tier])
+            if self._revealed:
+                self._revealed = False
+                progress = True
+            changed = changed or progress
+            if tier and (progress or tier == len(self.tiers) - 1):
+                self._regions.record_round()
+                # Hexes only change color in rounds that make progress.
+                if changed:
+                    self._regions.prune_retired(lambda coord: self[coord].color == Color.yellow)
+                    changed = False
+
+            paused = self._budget.exhausted
+            if paused:
+                yield _PAUSE
+            if progress:
+                tier = 0
+            elif not paused:
+                tier += 1
+            # Otherwise the tier may have been cut short; when resumed, run it again.
+
+    def apply_clicked(self, coords=None):
+        """
+        Commit the colors of clicked hexes to the board, or of those at `coords` only.
+
+        Hexes read back from the game replace their clicked versions;
+        this is for those that won't be read back.
+        """
+        if coords is None:
+            coords = list(self._clicked)
+        for coord in coords:
+            hex_ = self._clicked.pop(coord, None)
+            if hex_ is not None:
+                self._board[coord].color = hex_.color
@@ -1,7 +1,9 @@
 import collections
+import contextlib
+import functools
+import queue
 
 import numpy
-import pytesseract
 import scipy.ndimage
 
 import util
@@ -50,7 +52,92 @@ def label(im):
     mask = (array[:, :, 0] < 150) | (array[:, :, 1] < 150) | (array[:, :, 2] < 150)
     label_array, numobjects = scipy.ndimage.label(mask)
     objects = map(Box.from_slice, scipy.ndimage.find_objects(label_array))
-    return array, label_array, objects
+    return ArraySamples(array, label_array), objects
+
+
+class ArraySamples:
+    """
+    What `read_hexes` needs to know about each box, read from the full image arrays.
+    """
+    def __init__(self, array, label_array):
+        self.array = array
+        self.label_array = label_array
+
+    def mean_color(self, box):
+        # A view of the box; reshaping it would copy.
+        return tuple(self.array[box.slice].mean(axis=(0, 1)))
+
+    def has_text(self, box):
+        # Text is drawn in white, which isn't labeled.
+        return not self.label_array[box.text_box.slice].all()
+
+
+class CompactSamples:
+    """
+    What `read_hexes` needs to know about each box, computed up front.
+
+    Only a mean color and a flag are kept per box, so the image arrays
+    can be freed as soon as labeling is done.
+    """
+    def __init__(self, samples):
+        self._samples = samples
+
+    def mean_color(self, box):
+        return self._samples[box][0]
+
+    def has_text(self, box):
+        return self._samples[box][1]
+
+
+# Tried in turn for the label array; labeling fails if there are too
+# many objects for the type. A screenshot's glyphs and noise rarely fit
+# in a uint8, and a failed attempt costs a whole labeling pass.
+_LABEL_DTYPES = (numpy.uint16, numpy.int32)
+
+
+def _mask(array):
+    """
+    Find the pixels that aren't white, without a full-size temporary for each channel.
+    """
+    mask = array[:, :, 0] < 150
+    for channel in range(1, array.shape[2]):
+        numpy.logical_or(mask, array[:, :, channel] < 150, out=mask)
+    return mask
+
+
+@util.timeit("Labeling (compact).")
+def label_compact(im, boxes=None):
+    """
+    Label the image like `label`, keeping as little of it in memory as possible.
+
+    Each labeled object is sampled for `read_hexes`, or if `boxes` is
+    given, just those boxes, eg to read back hexes found earlier.
+
+    The label array uses the smallest integer type that fits the
+    number of objects, the mask is freed as soon as it's labeled, and
+    each box is sampled through views rather than copies. Nothing but
+    the samples outlives the call. Returns CompactSamples and the boxes.
+    """
+    array = numpy.asarray(im)
+    mask = _mask(array)
+    for dtype in _LABEL_DTYPES:
+        try:
+            label_array, numobjects = scipy.ndimage.label(mask, output=dtype)
+            break
+        except RuntimeError:
+            continue
+    else:
+        # Too many objects for any of them; let scipy pick.
+        label_array, numobjects = scipy.ndimage.label(mask)
+    del mask
+
+    objects = [Box.from_slice(slice_) for slice_ in scipy.ndimage.find_objects(label_array)]
+    full = ArraySamples(array, label_array)
+    samples = CompactSamples({
+        box: (full.mean_color(box), full.has_text(box))
+        for box in (objects if boxes is None else boxes)
+    })
+    return samples, objects
 
 
 def debug_labels(label_array):
@@ -59,14 +146,254 @@ def debug_labels(label_array):
     plt.show()
 
 
+# Hex text is read as a single word, in the characters clues are written with.
+OCR_PSM = 8
+OCR_WHITELIST = '0123456789-?{}'
+OCR_CONFIG = '-psm {} -c tessedit_char_whitelist={}'.format(OCR_PSM, OCR_WHITELIST)
+# Contact sheets are read as sparse text: words anywhere on the page.
+SHEET_PSM = 11
+SHEET_CONFIG = '-psm {} -c tessedit_char_whitelist={}'.format(SHEET_PSM, OCR_WHITELIST)
+
+
 def get_text_from_image(im):
     """
-    Given an image, return the text from it.
+    Given an image, or a numpy array of one, return the text from it.
 
     See https://github.com/tesseract-ocr/tesseract/wiki/Command-Line-Usage
     for options + explanations.
     """
-    # TODO: read from a numpy array instead of a PIL image.
+    size, data = _grayscale(im)
+    return _read_text(size, data)
+
+
+def _grayscale(im):
+    """
+    Return the size of an image and its bytes in grayscale, the same for a PIL image and its array.
+    """
+    if isinstance(im, numpy.ndarray):
+        array = im
+        if array.ndim == 3:
+            # PIL's own conversion, so either form reads (and caches) alike.
+            r, g, b = (array[..., i].astype(numpy.uint32) for i in range(3))
+            array = (r * 19595 + g * 38470 + b * 7471 + 0x8000) >> 16
+        array = numpy.ascontiguousarray(array, dtype=numpy.uint8)
+        return (array.shape[1], array.shape[0]), array.tobytes()
     im = im.convert('L')  # convert to grayscale for better readability
-    config = '-psm 8 -c tessedit_char_whitelist=0123456789-?{}'
-    return pytesseract.image_to_string(im, config=config)
+    return im.size, im.tobytes()
+
+
+# Each call runs tesseract, and the same few glyphs come up again and
+# again, so results are remembered by the exact pixels read.
+@functools.lru_cache(maxsize=4096)
+def _read_text(size, data):
+    engines = engine_pool()
+    if engines is not None:
+        return engines.read(size, data)
+    return _read_text_subprocess(size, data)
+
+
+def _read_text_subprocess(size, data):
+    """
+    Read text with the tesseract command, through temporary files.
+    """
+    import PIL.Image
+    import pytesseract
+
+    return pytesseract.image_to_string(PIL.Image.frombytes('L', size, data), config=OCR_CONFIG)
+
+
+class EnginePool:
+    """
+    Tesseract engines kept loaded in this process, one for each thread reading at once.
+
+    Starting the tesseract command for every glyph costs far more than
+    reading it. An engine here is set up once, with the same options as
+    the command, and reads images straight from memory. tesserocr
+    releases the GIL while it reads, so threads (as in `server.py`)
+    read in parallel, each with an engine of its own. There's a pool
+    for each page segmentation mode: single glyphs, and contact sheets.
+    """
+    def __init__(self, psm=OCR_PSM, whitelist=OCR_WHITELIST):
+        self.psm = psm
+        self.whitelist = whitelist
+        self._idle = queue.LifoQueue()
+        self.engines = 0
+
+    def _engine(self):
+        import tesserocr
+
+        engine = tesserocr.PyTessBaseAPI(psm=self.psm)
+        engine.SetVariable('tessedit_char_whitelist', self.whitelist)
+        self.engines += 1
+        return engine
+
+    @contextlib.contextmanager
+    def _checkout(self, size, data):
+        """
+        Lend out an idle engine, or a new one if none are, given a grayscale image to read.
+        """
+        try:
+            engine = self._idle.get_nowait()
+        except queue.Empty:
+            engine = self._engine()
+        try:
+            width, height = size
+            engine.SetImageBytes(data, width, height, 1, width)
+            yield engine
+        finally:
+            self._idle.put(engine)
+
+    def read(self, size, data):
+        """
+        Read the text in a grayscale image, given its size and bytes.
+        """
+        with self._checkout(size, data) as engine:
+            return engine.GetUTF8Text()
+
+    def read_words(self, size, data):
+        """
+        Read each word in a grayscale image, with its bounding box.
+
+        Returns a dict of lists, like `pytesseract.image_to_data`'s.
+        """
+        import tesserocr
+
+        level = tesserocr.RIL.WORD
+        words = {'text': [], 'left': [], 'top': [], 'width': [], 'height': []}
+        with self._checkout(size, data) as engine:
+            engine.Recognize()
+            for word in tesserocr.iterate_level(engine.GetIterator(), level):
+                box = word.BoundingBox(level)
+                if box is None:
+                    continue
+                left, top, right, bottom = box
+                words['text'].append(word.GetUTF8Text(level) or '')
+                words['left'].append(left)
+                words['top'].append(top)
+                words['width'].append(right - left)
+                words['height'].append(bottom - top)
+        return words
+
+    def close(self):
+        while not self._idle.empty():
+            self._idle.get_nowait().End()
+
+
+@functools.lru_cache(maxsize=None)
+def engine_pool(psm=OCR_PSM):
+    """
+    The shared EnginePool for a page segmentation mode, or None if tesserocr isn't installed.
+
+    Without tesserocr, the tesseract command is run instead.
+    """
+    try:
+        import tesserocr  # noqa: F401
+    except ImportError:
+        return None
+    return EnginePool(psm)
+
+
+# Text on a contact sheet is scaled to this height (and at most this
+# width), so tesseract sees every glyph at the same scale. The white
+# margin around each keeps neighbors from running together into one word.
+SHEET_GLYPH_HEIGHT = 32
+SHEET_GLYPH_WIDTH = 64
+SHEET_MARGIN = 16
+SHEET_CELL = (SHEET_GLYPH_WIDTH + 2 * SHEET_MARGIN, SHEET_GLYPH_HEIGHT + 2 * SHEET_MARGIN)
+SHEET_COLUMNS = 16
+
+
+def _normalize(im):
+    """
+    Turn a crop of a hex's text into black text on white, at the contact sheet's glyph height.
+
+    Text is white on a blue or black hex; stretching each crop's
+    contrast on its own puts every background at the same level.
+    """
+    import PIL.Image
+    import PIL.ImageOps
+
+    im = PIL.ImageOps.invert(PIL.ImageOps.autocontrast(im.convert('L')))
+    im = im.point(lambda value: 255 if value >= 128 else 0)
+    width = max(1, round(im.width * SHEET_GLYPH_HEIGHT / max(1, im.height)))
+    width = min(width, SHEET_GLYPH_WIDTH)
+    return im.resize((width, SHEET_GLYPH_HEIGHT), PIL.Image.NEAREST)
+
+
+def _sheet_columns(count):
+    return max(1, min(SHEET_COLUMNS, count))
+
+
+def contact_sheet(images):
+    """
+    Tile images of text into one image, for tesseract to read in one pass.
+
+    Returns the sheet, and the Box of the cell holding each image.
+    """
+    import PIL.Image
+
+    cell_width, cell_height = SHEET_CELL
+    columns = _sheet_columns(len(images))
+    rows = -(-len(images) // columns)
+    sheet = PIL.Image.new('L', (columns * cell_width, rows * cell_height), 255)
+    cells = []
+    for i, im in enumerate(images):
+        row, column = divmod(i, columns)
+        cell = Box(
+            left=column * cell_width,
+            top=row * cell_height,
+            right=(column + 1) * cell_width,
+            bottom=(row + 1) * cell_height,
+        )
+        glyph = _normalize(im)
+        sheet.paste(glyph, (
+            cell.left + (cell_width - glyph.width) // 2,
+            cell.top + (cell_height - glyph.height) // 2,
+        ))
+        cells.append(cell)
+    return sheet, cells
+
+
+def _assign_tokens(data, cells):
+    """
+    Join the words tesseract found on a contact sheet into the text of each cell.
+
+    `data` is tesseract's word data, as from `pytesseract.image_to_data`.
+    Words straddling two cells belong to neither, so the cells read as
+    empty, and fail validation.
+    """
+    words = [[] for _ in cells]
+    columns = _sheet_columns(len(cells))
+    cell_width, cell_height = SHEET_CELL
+    for text, left, top, width, height in zip(
+        data['text'], data['left'], data['top'], data['width'], data['height'],
+    ):
+        text = text.strip()
+        if not text:
+            continue
+        column, row = left // cell_width, top // cell_height
+        i = row * columns + column
+        if column >= columns or i >= len(cells):
+            continue
+        cell = cells[i]
+        if left + width <= cell.right and top + height <= cell.bottom:
+            words[i].append((left, text))
+    return [''.join(text for _, text in sorted(cell_words)) for cell_words in words]
+
+
+def get_texts_from_images(images):
+    """
+    Read the text from many images with one run of tesseract, over a contact sheet of them all.
+
+    Returns the text read from each image, '' if none. Anything misread
+    should be read again on its own, with `get_text_from_image`.
+    """
+    sheet, cells = contact_sheet(images)
+    engines = engine_pool(SHEET_PSM)
+    if engines is not None:
+        data = engines.read_words(sheet.size, sheet.tobytes())
+    else:
+        import pytesseract
+
+        data = pytesseract.image_to_data(sheet, config=SHEET_CONFIG, output_type=pytesseract.Output.DICT)
+    return _assign_tokens(data, cells)
@@ -0,0 +1,150 @@
+import collections
+import math
+import time
+
+import hex_model
+
+BUTTONS = {
+    hex_model.Color.blue: 'left',
+    hex_model.Color.black: 'right',
+}
+
+
+Click = collections.namedtuple('Click', 'x y button')
+
+
+class DispatchStats(collections.namedtuple('DispatchStats', 'clicks seconds distance')):
+    @property
+    def clicks_per_second(self):
+        if not self.seconds:
+            return math.inf if self.clicks else 0.0
+        return self.clicks / self.seconds
+
+
+class PyAutoGuiBackend:
+    """
+    Deliver clicks to the running game.
+
+    pyautogui sleeps for `pyautogui.PAUSE` after every action by
+    default; we skip that, since the game keeps up fine without it.
+    """
+    def __init__(self):
+        import pyautogui
+        self._pyautogui = pyautogui
+
+    def position(self):
+        return tuple(self._pyautogui.position())
+
+    def click(self, x, y, button):
+        self._pyautogui.click(x, y, button=button, _pause=False)
+
+
+class RecordingBackend:
+    """
+    Record clicks instead of delivering them, for tests and benchmarks.
+    """
+    def __init__(self, start=None):
+        self.start = start
+        self.clicks = []
+
+    def position(self):
+        if self.clicks:
+            x, y, _ = self.clicks[-1]
+            return x, y
+        return self.start
+
+    def click(self, x, y, button):
+        self.clicks.append(Click(x, y, button))
+
+
+def path_length(points, start=None):
+    if start is not None:
+        points = [start] + list(points)
+    return sum(math.dist(a, b) for a, b in zip(points, points[1:]))
+
+
+def order_path(points, start=None, passes=3):
+    """
+    Return the indices of `points` in an order that makes a short path through them.
+
+    The path is built greedily from the point nearest `start` (or from
+    the first point), then improved with a few passes of 2-opt.
+    """
+    remaining = set(range(len(points)))
+    if not remaining:
+        return []
+
+    if start is None:
+        current = 0
+    else:
+        current = min(remaining, key=lambda i: math.dist(start, points[i]))
+    remaining.remove(current)
+    order = [current]
+    while remaining:
+        here = points[current]
+        current = min(remaining, key=lambda i: math.dist(here, points[i]))
+        remaining.remove(current)
+        order.append(current)
+
+    # 2-opt: reverse any stretch of the path that makes it shorter.
+    # The path is open, so the ends may move freely.
+    def point(position):
+        if position < 0:
+            return start
+        return points[order[position]]
+
+    first = 0 if start is not None else 1
+    for _ in range(passes):
+        improved = False
+        for i in range(first, len(order) - 1):
+            for j in range(i + 1, len(order)):
+                before = point(i - 1)
+                if before is None:
+                    continue
+                a, b = point(i), point(j)
+                after = point(j + 1) if j + 1 < len(order) else None
+                old = math.dist(before, a) + (math.dist(b, after) if after else 0)
+                new = math.dist(before, b) + (math.dist(a, after) if after else 0)
+                if new < old - 1e-9:
+                    order[i:j + 1] = reversed(order[i:j + 1])
+                    improved = True
+        if not improved:
+            break
+    return order
+
+
+def screen_position(board, coord, topleft):
+    """
+    Find where on screen to click for the hex at the given coordinate.
+    """
+    dx, dy = topleft
+    x, y = board[coord].image_box.center
+    # TODO - dpi???
+    return x // 2 + dx, y // 2 + dy
+
+
+def dispatch(board, commands, topleft, backend):
+    """
+    Click each hex in `commands` with the button for its color, along a short path.
+    """
+    return dispatch_clicks([
+        Click(*screen_position(board, coord, topleft), BUTTONS[color])
+        for coord, color in commands
+    ], backend)
+
+
+def dispatch_clicks(clicks, backend):
+    start = backend.position()
+    order = order_path([(x, y) for x, y, _ in clicks], start=start)
+    ordered = [clicks[i] for i in order]
+
+    t = time.perf_counter()
+    for click in ordered:
+        backend.click(*click)
+    seconds = time.perf_counter() - t
+
+    return DispatchStats(
+        clicks=len(ordered),
+        seconds=seconds,
+        distance=path_length([(x, y) for x, y, _ in ordered], start=start),
+    )
@@ -1,19 +1,22 @@
 import argparse
+import ast
+import collections
 import math
 import re
+import sys
+import threading
 import time
 
-import numpy
-import pyautogui
-import PIL.Image
-
 import display
 import hex_model
-import image_parse
-import screen
-import tests
+import input_dispatch
+import schedule
 import util
 
+# The imaging, OCR and GUI stacks are slow to import, and are only
+# needed by the subcommands that read the screen; they are imported
+# where they're used.
+
 HEXAGON_RATIO = (3 ** 0.5) / 2  # width * HEXAGON_RATIO = height
 
 
@@ -44,19 +47,52 @@ def _interpret_text(text):
     raise ValueError("Could not parse {!r}".format(text))
 
 
-def get_image_text(im, box):
+def get_image_text(im, box, angle=0, interactive=True):
     """
     Read text from the given subsection of the image.
+
+    The subsection is rotated `angle` degrees counter-clockwise first,
+    to straighten text that was drawn at an angle. If `interactive`,
+    text that OCR can't make out is asked for at the terminal, rather
+    than raising ValueError.
     """
+    import image_parse
+
     hex_img = im.crop(box)
+    if angle:
+        hex_img = hex_img.rotate(angle, expand=True, fillcolor=(255, 255, 255))
     try:
         return _interpret_text(image_parse.get_text_from_image(hex_img))
     except ValueError as e:
+        if not interactive:
+            raise
         # If can't determine the value, mechanical turk it for now.
         hex_img.show()
         return input("\n{}: ".format(e))
 
 
+def get_image_texts(im, boxes, interactive=True):
+    """
+    Read text from each of the given subsections of the image, with one run of OCR for them all.
+
+    The subsections are read together from a contact sheet (see
+    `image_parse.get_texts_from_images`). Any that don't read as a clue
+    there are read again on their own, by `get_image_text`, which
+    `interactive` is passed to.
+    """
+    import image_parse
+
+    if len(boxes) < 2:
+        return [get_image_text(im, box, interactive=interactive) for box in boxes]
+    texts = []
+    for box, text in zip(boxes, image_parse.get_texts_from_images([im.crop(box) for box in boxes])):
+        try:
+            texts.append(_interpret_text(text))
+        except ValueError:
+            texts.append(get_image_text(im, box, interactive=interactive))
+    return texts
+
+
 def is_hexagon(box):
     """
     Identify if the given contiguous set of coordinates is a hexagon.
@@ -90,9 +126,96 @@ def is_remaining_box(box, im_size):
     return True
 
 
+def is_label_glyph(box, unit):
+    """
+    Identify if the given bounding box is sized like part of a line clue's text.
+    """
+    # Eliminate noise.
+    if box.width * box.height < 50:
+        return False
+    # Glyphs fit comfortably inside a single hex.
+    return box.width < unit and box.height < unit
+
+
+# How far to rotate a line clue's text to read it, by the direction it points.
+LINE_TEXT_ANGLES = {
+    hex_model.LINE_DIRECTIONS['down']: 0,
+    hex_model.LINE_DIRECTIONS['up']: 0,
+    hex_model.LINE_DIRECTIONS['down_right']: 60,
+    hex_model.LINE_DIRECTIONS['up_left']: 60,
+    hex_model.LINE_DIRECTIONS['down_left']: -60,
+    hex_model.LINE_DIRECTIONS['up_right']: -60,
+}
+
+
+def _line_direction(board, coord):
+    """
+    Guess which way a line clue at the given coordinate points.
+
+    Line clues sit just off the board, next to the first hex of their
+    line. If several neighboring hexes qualify, pick the direction
+    whose line covers the most hexes.
+    """
+    table = board.neighbor_table
+    candidates = [
+        direction for direction in hex_model.LINE_DIRECTIONS.values()
+        if tuple(a + b for a, b in zip(coord, direction)) in board
+    ]
+    if not candidates:
+        return None
+    return max(
+        candidates,
+        key=lambda direction: sum(hex_ in board for hex_ in table.ray(coord, direction)),
+    )
+
+
+def parse_line_labels(im, board, boxes, origin, unit, interactive=True):
+    """
+    Read line clues from the boxes left over once the hexagons are parsed.
+
+    A clue's text can be several separate glyphs, so glyphs are grouped
+    by the grid position they sit on before being read.
+    """
+    import image_parse
+
+    glyphs = collections.defaultdict(list)
+    for box in boxes:
+        if not is_label_glyph(box, unit):
+            continue
+        center = box.center
+        coord = hex_model.coordinate(*pixel_to_hex(center[0] - origin[0], center[1] - origin[1], unit))
+        if coord in board:
+            continue
+        glyphs[coord].append(box)
+
+    for coord, group in glyphs.items():
+        direction = _line_direction(board, coord)
+        if direction is None:
+            continue
+        box = image_parse.Box(
+            left=min(box.left for box in group),
+            top=min(box.top for box in group),
+            right=max(box.right for box in group),
+            bottom=max(box.bottom for box in group),
+        )
+        text = get_image_text(im, box, angle=LINE_TEXT_ANGLES[direction], interactive=interactive)
+        board.add_line(coord, hex_model.LineClue(text, direction, image_box=box))
+
+
 @util.timeit("Parsin' labeled hexagons\n")
-def parse_labeled_hexagons(im, im_data, label_array, objs):
+def parse_labeled_hexagons(im, samples, objs, interactive=True):
+    """
+    Build a board from the labeled objects in a screenshot.
+
+    If `interactive`, what's read is reported, and text OCR can't make
+    out is asked for at the terminal; otherwise, it raises ValueError.
+    """
+    import image_parse
+
     origin = None
+    unit = None
+    hexagons = {}
+    leftovers = []
     board = hex_model.HexBoard()
     for box in objs:
         if is_remaining_box(box, im.size):
@@ -102,8 +225,9 @@ def parse_labeled_hexagons(im, im_data, label_array, objs):
                 right=box.right,
                 bottom=box.bottom,
             )
-            board.remaining = int(get_image_text(im, read_box))
-            print(board.remaining)
+            board.remaining = int(get_image_text(im, read_box, interactive=interactive))
+            if interactive:
+                print(board.remaining)
         elif is_hexagon(box):
             center = box.center
 
@@ -116,29 +240,43 @@ def parse_labeled_hexagons(im, im_data, label_array, objs):
             else:
                 coord = pixel_to_hex(center[0] - origin[0], center[1] - origin[1], unit)
 
-            assert coord not in board, coord
-            board[coord] = read_hex(im, im_data, label_array, box)
-    return board
+            assert coord not in hexagons, coord
+            hexagons[coord] = box
+        else:
+            leftovers.append(box)
+
+    for coord, hex_ in zip(hexagons, read_hexes(im, samples, hexagons.values(), interactive)):
+        board[coord] = hex_
 
+    # Line clues are positioned relative to the hexes, so they have to wait.
+    if origin:
+        parse_line_labels(im, board, leftovers, origin, unit, interactive)
+    return board
 
-def read_hex(im, im_data, label_array, box):
-    # Average the colors of all the pixels in the hex.
-    # TODO - figure out how to apply a mask
-    #        to only check pixels IN the hex.
-    flattened_img = im_data[box.slice].reshape(-1, im_data.shape[-1])
-    avg_color = tuple(numpy.mean(flattened_img, axis=0))
-    color = hex_model.Color.closest(avg_color)
-    text = '-'
 
-    # Check for if there is text on the hex.
-    if not label_array[box.text_box.slice].all():
-        text = get_image_text(im, box.text_box)
+def read_hexes(im, samples, boxes, interactive=True):
+    """
+    Read the hex in each of the given boxes, with one run of OCR for all their text.
 
-    return hex_model.Hex(
-        text=text,
-        color=color,
-        image_box=box,
-    )
+    `interactive` is passed on to `get_image_texts`.
+    """
+    boxes = list(boxes)
+    # Check for if there is text on each hex.
+    with_text = [box for box in boxes if samples.has_text(box)]
+    text_boxes = [box.text_box for box in with_text]
+    texts = dict(zip(with_text, get_image_texts(im, text_boxes, interactive)))
+
+    return [
+        hex_model.Hex(
+            # Average the colors of all the pixels in the hex.
+            # TODO - figure out how to apply a mask
+            #        to only check pixels IN the hex.
+            text=texts.get(box, '-'),
+            color=hex_model.Color.closest(samples.mean_color(box)),
+            image_box=box,
+        )
+        for box in boxes
+    ]
 
 
 def pixel_to_hex(x, y, size):
@@ -153,45 +291,98 @@ def save_debug_board(board):
     try:
         with open('debug_board.txt', 'w') as f:
             f.write(repr(board._board))
+            if board.lines:
+                f.write('\n{!r}'.format(board.lines))
     except IOError as e:
         print("Error saving file -", str(e))
 
 
+def _debug_value(node):
+    """
+    Evaluate a node of a saved debug board: literals, and the Hex, LineClue and Color in them.
+    """
+    if isinstance(node, ast.Dict):
+        return {_debug_value(key): _debug_value(value) for key, value in zip(node.keys, node.values)}
+    if isinstance(node, ast.Tuple):
+        return tuple(map(_debug_value, node.elts))
+    if isinstance(node, ast.Constant):
+        return node.value
+    if isinstance(node, ast.UnaryOp) and isinstance(node.op, ast.USub):
+        return -_debug_value(node.operand)
+    if (isinstance(node, ast.Attribute) and isinstance(node.value, ast.Name) and
+            node.value.id == 'Color' and node.attr in hex_model.Color.__members__):
+        return hex_model.Color[node.attr]
+    if (isinstance(node, ast.Call) and isinstance(node.func, ast.Name) and
+            node.func.id in ('Hex', 'LineClue') and not node.keywords):
+        return getattr(hex_model, node.func.id)(*map(_debug_value, node.args))
+    raise ValueError("Unexpected in debug board: {}".format(ast.dump(node)))
+
+
+# Some Python versions (3.11.7, at least) can fail to build ASTs in
+# several threads at once, as the server's workers do.
+_PARSE_LOCK = threading.Lock()
+
+
+def _parse_literal(text):
+    with _PARSE_LOCK:
+        return ast.parse(text, mode='eval').body
+
+
+def parse_debug_board(text, remaining=None):
+    """
+    Read a board in the format written by `save_debug_board`.
+
+    The format is the board's reprs, but it's read without `eval`, so
+    boards from elsewhere can be read safely.
+    """
+    board = hex_model.HexBoard(remaining=remaining)
+    hexes, *lines = text.strip().split('\n')
+    for coord, hex_ in _debug_value(_parse_literal(hexes)).items():
+        board[coord] = hex_
+    if lines:
+        for coord, clue in _debug_value(_parse_literal(lines[0])).items():
+            board.add_line(coord, clue)
+    return board
+
+
 def get_debug_board():
-    board = hex_model.HexBoard()
     with open('debug_board.txt', 'r') as f:
-        board._board = eval(f.read(), vars(hex_model))
-    return board
+        return parse_debug_board(f.read())
 
 
 def read_board(im):
+    import image_parse
+
     im = im.convert('RGB')
-    im_data, label_array, objs = image_parse.label(im)
-    board = parse_labeled_hexagons(im, im_data, label_array, objs)
+    samples, objs = image_parse.label_compact(im)
+    board = parse_labeled_hexagons(im, samples, objs)
     save_debug_board(board)
     return board
 
 
-def apply_commands(board, commands, topleft):
+def apply_commands(board, commands, topleft, backend=None):
     """
     Run commands against the running game app.
     """
-    buttons = {
-        hex_model.Color.blue: 'left',
-        hex_model.Color.black: 'right',
-    }
+    import image_parse
+    import screen
+
+    if backend is None:
+        backend = input_dispatch.PyAutoGuiBackend()
 
-    dx, dy = topleft
-    for coord, color in commands:
-        x, y = board[coord].image_box.center
-        # TODO - dpi???
-        pyautogui.click(x // 2 + dx, y // 2 + dy, button=buttons[color])
+    t = time.perf_counter()
+    stats = input_dispatch.dispatch(board, commands, topleft, backend)
+    print('Clicked {} hexes - {:.1f} clicks/s'.format(stats.clicks, stats.clicks_per_second))
 
     # If we just solved the board, the "game solved" overlay has showed up,
     # and we should not attempt to parse the board again.
     # TODO: that having been said, we might want to look for the overlay
     #       to verify that we didn't mess up?
-    if board.is_solved:
+    # Nor is there any point reading back hexes whose clues would count
+    # nothing still hidden; we know their colors, so commit those.
+    coords = [] if board.is_solved else schedule.worth_reading(board, commands)
+    board.apply_clicked(set(coord for coord, _ in commands) - set(coords))
+    if not coords:
         return
 
     # Hexcells has a fun yellow confetti explosion when you click a cell.
@@ -203,52 +394,213 @@ def apply_commands(board, commands, topleft):
     im = im.convert('RGB')
     # TODO: we know which part of the screen we need to parse.
     #       It's probably faster to just label that part.
-    im_data, label_array, objs = image_parse.label(im)
+    boxes = [board[coord].image_box for coord in coords]
+    samples, _ = image_parse.label_compact(im, boxes=boxes)
+
+    for coord, hex_ in zip(coords, read_hexes(im, samples, boxes)):
+        board[coord] = hex_
+    print('Turn took {:.1f}s'.format(time.perf_counter() - t))
+
+
+class GameScreen:
+    """
+    Read hexes back from the running game, for `pipeline.run`.
+    """
+    def __init__(self, board):
+        self.board = board
+
+    def capture(self, coords):
+        import image_parse
+        import screen
+
+        im, _ = screen.grab_game_screen()
+        im = im.convert('RGB')
+        # TODO: we know which part of the screen we need to parse.
+        #       It's probably faster to just label that part.
+        # Skip the timing output, which would land in the middle of the
+        # board as it's redrawn.
+        boxes = [self.board[coord].image_box for coord in coords]
+        samples, _ = image_parse.label_compact(im, boxes=boxes, quiet=True)
+        return dict(zip(coords, read_hexes(im, samples, boxes)))
+
+
+def print_guesses(board, seconds, count=5):
+    """
+    When the solver is stuck, list the hexes least likely to be a mistake to click.
+
+    Counting completions can take exponential time on a big, open board,
+    so this gives up after `seconds`, and isn't tried at all with none.
+    """
+    import counting
+
+    if not seconds:
+        return
+    try:
+        probabilities = counting.count_models(board, util.Budget(seconds=seconds)).probabilities
+    except counting.BudgetExhaustedError:
+        print("Stuck! Too many ways to finish to rank guesses in {:g}s.".format(seconds))
+        return
+    safest = sorted(probabilities.items(), key=lambda item: min(item[1], 1 - item[1]))
+    print("Stuck! Safest guesses:")
+    for coord, probability in safest[:count]:
+        print('  {}: {:.0%} blue'.format(coord, probability))
+
+
+def tiers(text):
+    """
+    Parse a comma-separated list of solver tiers, for argparse.
+    """
+    names = tuple(text.split(','))
+    unknown = set(names) - set(hex_model.TIERS)
+    if unknown:
+        raise argparse.ArgumentTypeError("unknown tiers: {} (choose from {})".format(
+            ', '.join(sorted(unknown)), ', '.join(hex_model.TIERS),
+        ))
+    return names
+
+
+def check_solver_args(parser, args):
+    """
+    Reject solver options that would be silently ignored.
+    """
+    if args.lazy and args.tiers is not None and 'populate' not in args.tiers:
+        parser.error("--lazy needs the populate tier in --tiers")
+
 
-    for coord, _ in commands:
-        board[coord] = read_hex(im, im_data, label_array, board[coord].image_box)
+def solver(args):
+    """
+    Return a function that solves a board, through the solve cache if one was asked for.
+    """
+    solve = hex_model.HexBoard.solve
+    if args.cache:
+        import solve_cache
+
+        solve = solve_cache.SolveCache(args.cache, max_bytes=args.cache_size * 2 ** 20).solve
+    if args.tiers is None and not args.lazy:
+        return solve
+
+    def solve_with_options(board, budget=None):
+        if args.tiers is not None:
+            board.tiers = args.tiers
+        board.lazy = args.lazy
+        return solve(board, budget)
+    return solve_with_options
 
 
 def run_debug(args, display_fn):
     board = get_debug_board()
     print(display_fn(board))
     print('\n')
-    solutions = list(board.solve())
+    solutions = list(solver(args)(board))
     board.apply_clicked()
     print(display_fn(board))
+    if not board.is_solved:
+        print_guesses(board, args.guess_seconds)
 
 
 def run_screenshot(args, display_fn):
+    import PIL.Image
+
     board = read_board(PIL.Image.open(args.file))
     print(display_fn(board))
     print('\n')
-    solutions = list(board.solve())
+    solutions = list(solver(args)(board))
     board.apply_clicked()
     print(display_fn(board))
+    if not board.is_solved:
+        print_guesses(board, args.guess_seconds)
 
 
 def run_screen(args, display_fn):
+    import asyncio
+
+    import pipeline
+    import screen
+
     time.sleep(3)
     im, topleft = screen.grab_game_screen()
     board = read_board(im)
 
-    print(display_fn(board))
-    solutions = True
-    while solutions and not board.is_solved:
-        solutions = list(board.solve())
-        apply_commands(board, solutions, topleft)
-        print()
+    if args.sequential:
         print(display_fn(board))
-        print()
+        backend = input_dispatch.PyAutoGuiBackend()
+        solve = solver(args)
+        solutions = True
+        deferred = []
+        while solutions and (deferred or not board.is_solved):
+            solutions = deferred + list(solve(board))
+            solutions, deferred = schedule.plan_turn(board, solutions, args.clicks_per_turn)
+            apply_commands(board, solutions, topleft, backend)
+            print()
+            print(display_fn(board))
+            print()
+        if not board.is_solved:
+            print_guesses(board, args.guess_seconds)
+        return
+
+    # Redraw hexes in place as they change, with progress on the line below.
+    renderer = None
+    if args.display != 'none':
+        renderer = display.BoardRenderer(args.display)
+        sys.stdout.write(renderer.render(board))
+
+    def on_batch(board):
+        if renderer:
+            sys.stdout.write(renderer.render(board))
+        counts = board.color_counts
+        sys.stdout.write('\r{}Uncovered {}/{}'.format(
+            display.clear_line,
+            len(board._board) - counts[hex_model.Color.yellow],
+            len(board._board),
+        ))
+        sys.stdout.flush()
+
+    stats = asyncio.run(pipeline.run(
+        board,
+        input_dispatch.PyAutoGuiBackend(),
+        GameScreen(board),
+        topleft=topleft,
+        on_batch=on_batch,
+        info_first=args.info_first,
+        solve=solver(args),
+    ))
+    # Show the final state, in case the last change came after the last batch.
+    on_batch(board)
+    print()
+    print('Clicked {} hexes in {:.1f}s ({:.1f} clicks/s) over {} screen captures'.format(
+        stats.clicks, stats.seconds, stats.clicks_per_second, stats.captures,
+    ))
+    if not board.is_solved:
+        print_guesses(board, args.guess_seconds)
 
 
 def run_tests(args, display_fn):
+    import tests
+
     tests.run_tests(display_fn)
 
 
 if __name__ == '__main__':
     parser = argparse.ArgumentParser(description='')
     parser.add_argument('--display', default='small', choices=['none', 'small', 'large'])
+    parser.add_argument(
+        '--cache', metavar='DIR',
+        help="remember deductions for board states in this directory, and reuse them "
+             "(not for screen without --sequential)",
+    )
+    parser.add_argument('--cache-size', type=int, default=16, help="cache size in MB")
+    parser.add_argument(
+        '--tiers', type=tiers, default=None,
+        help="solver rule sets to run, cheapest first (default: {})".format(','.join(hex_model.TIERS)),
+    )
+    parser.add_argument(
+        '--lazy', action='store_true',
+        help="build regions a clue at a time, nearest the last changes first, for a quicker first deduction",
+    )
+    parser.add_argument(
+        '--guess-seconds', type=float, default=2, metavar='S',
+        help="when the solver is stuck, spend up to S seconds ranking guesses (0 to skip)",
+    )
     subparsers = parser.add_subparsers(dest='cmd')
     subparsers.required = True
 
@@ -256,6 +608,18 @@ if __name__ == '__main__':
     debug_parser.set_defaults(func=run_debug)
 
     screen_parser = subparsers.add_parser('screen', help="")
+    screen_parser.add_argument(
+        '--sequential', action='store_true',
+        help="solve, click and recapture in turn instead of overlapping them",
+    )
+    screen_parser.add_argument(
+        '--clicks-per-turn', type=int, default=None, metavar='N',
+        help="with --sequential, click at most N hexes a turn, those whose clues could tell us most first",
+    )
+    screen_parser.add_argument(
+        '--info-first', action='store_true',
+        help="click the hexes whose clues could tell us most first, ranking each solve's deductions once it's done",
+    )
     screen_parser.set_defaults(func=run_screen)
 
     screenshot_parser = subparsers.add_parser('screenshot', help="")
@@ -266,6 +630,11 @@ if __name__ == '__main__':
     tests_parser.set_defaults(func=run_tests)
 
     args = parser.parse_args()
+    check_solver_args(parser, args)
+    # Clues are revealed to the pipeline's board mid-solve, so its
+    # deductions can't be cached against any one board state.
+    if args.cache and args.cmd == 'screen' and not args.sequential:
+        parser.error("--cache only works with screen --sequential")
     display_fn = {
         'none': lambda board: '',
         'small': display.display_board,
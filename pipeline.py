@@ -0,0 +1,146 @@
+import asyncio
+import collections
+import time
+
+import input_dispatch
+import schedule
+
+
+class PipelineStats(collections.namedtuple(
+    'PipelineStats', 'clicks batches captures solves seconds first_click'
+)):
+    @property
+    def clicks_per_second(self):
+        return self.clicks / self.seconds if self.seconds else 0.0
+
+
+async def run(board, game_input, screen, topleft=(0, 0), settle=2.0, batch_size=8,
+              on_batch=None, info_first=False, solve=None):
+    """
+    Solve the board against the running game, overlapping solving, clicking and recapture.
+
+    Deductions are clicked in batches as soon as the solver yields
+    them. Once a batch has had `settle` seconds for the game's
+    animations to clear, its hexes are read back from `screen` while
+    later batches are clicked. Uncovered clues are fed back into the
+    solver as they arrive; once the solver runs dry, it is restarted as
+    soon as a recapture uncovers a new clue. Only hexes whose clues
+    could count something still hidden are read back.
+
+    With `info_first`, each solve's deductions are clicked most
+    informative first (see the `schedule` module), so the clues most
+    likely to help come back soonest; the first click then waits for
+    the whole solve.
+
+    `solve` is called with the board to start each solve, as
+    `HexBoard.solve` is by default; pass `main.solver`'s to apply its
+    settings. It mustn't go through a solve cache, since clues are
+    revealed to the board mid-solve.
+
+    `on_batch`, if given, is called with the board once each batch is
+    clicked, and again once its recapture is read back.
+
+    `game_input` is an input_dispatch backend, and `screen` has a
+    `capture(coords)` method returning the uncovered hex at each of the
+    given coordinates. Both are blocking, so they are run in threads.
+    """
+    loop = asyncio.get_running_loop()
+    pending = asyncio.Queue()
+    recaptures = set()
+    counts = collections.Counter()
+    start = time.perf_counter()
+    first_click = None
+
+    if solve is None:
+        solve = type(board).solve
+
+    async def solve_once():
+        counts['solves'] += 1
+        deductions = solve(board)
+        if info_first:
+            deductions = schedule.prioritize(board, list(deductions))
+        for i, (coord, color) in enumerate(deductions):
+            click = input_dispatch.Click(
+                *input_dispatch.screen_position(board, coord, topleft),
+                input_dispatch.BUTTONS[color],
+            )
+            pending.put_nowait(((coord, color), click))
+            if i % batch_size == batch_size - 1:
+                # Let the clicker get started on what we have so far.
+                await asyncio.sleep(0)
+
+    async def recapture(coords):
+        await asyncio.sleep(settle)
+        hexes = await loop.run_in_executor(None, screen.capture, coords)
+        counts['captures'] += 1
+        for coord, hex_ in hexes.items():
+            board.reveal(coord, hex_)
+            counts['clues'] += hex_.value is not None
+        if on_batch:
+            on_batch(board)
+
+    async def click():
+        nonlocal first_click
+        while True:
+            batch = [await pending.get()]
+            while not pending.empty() and len(batch) < batch_size:
+                batch.append(pending.get_nowait())
+            deductions, clicks = zip(*batch)
+            if first_click is None:
+                first_click = time.perf_counter() - start
+            await loop.run_in_executor(
+                None, input_dispatch.dispatch_clicks, list(clicks), game_input,
+            )
+            counts['clicks'] += len(clicks)
+            counts['batches'] += 1
+            # Once the board is solved, the game shows its "solved"
+            # overlay, and there's nothing left to read.
+            readable = [] if board.is_solved else schedule.worth_reading(board, deductions)
+            # Hexes that won't be read back keep the colors we clicked.
+            board.apply_clicked(set(coord for coord, _ in deductions) - set(readable))
+            if on_batch:
+                on_batch(board)
+            if readable:
+                task = asyncio.ensure_future(recapture(readable))
+                recaptures.add(task)
+                task.add_done_callback(recaptures.discard)
+            for _ in batch:
+                pending.task_done()
+
+    clicker = asyncio.ensure_future(click())
+    try:
+        while True:
+            clues = counts['clues']
+            await solve_once()
+            await _join(pending, clicker)
+            # Restart the solver as soon as any recapture uncovers a
+            # clue, rather than waiting for every recapture to land.
+            while recaptures and counts['clues'] == clues:
+                done, _ = await asyncio.wait(recaptures, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    task.result()
+            if board.is_solved or counts['clues'] == clues:
+                break
+    finally:
+        clicker.cancel()
+
+    return PipelineStats(
+        clicks=counts['clicks'],
+        batches=counts['batches'],
+        captures=counts['captures'],
+        solves=counts['solves'],
+        seconds=time.perf_counter() - start,
+        first_click=first_click,
+    )
+
+
+async def _join(queue, worker):
+    """
+    Wait for the queue to drain, surfacing the worker's exception if it fails.
+    """
+    joined = asyncio.ensure_future(queue.join())
+    await asyncio.wait([joined, worker], return_when=asyncio.FIRST_COMPLETED)
+    if worker.done():
+        joined.cancel()
+        worker.result()
+    await joined
@@ -0,0 +1,102 @@
+"""
+Evaluate every region at once, as a sparse incidence matrix against the board's colors.
+
+With thousands of clues, checking each region hex by hex dominates a
+solve. Here each region is a row of a `scipy.sparse` matrix with a
+column per hex, and the board's colors are 0/1 vectors, so counting
+every region's blue and yellow hexes is two sparse products. Rows
+follow the region store as regions come and go, and the color vectors
+follow the board as hexes change, so neither is rebuilt each round.
+"""
+import itertools
+
+import numpy
+import scipy.sparse
+
+from hex_model import Color
+
+# Dead rows are dropped once they outnumber the live ones.
+_MIN_COMPACT = 64
+
+
+class RegionMatrix:
+    """
+    The regions of a RegionStore, as rows of an incidence matrix over a board's hexes.
+    """
+    def __init__(self, board):
+        table = board.neighbor_table
+        self._index = table.index
+        colors = [board[coord].color for coord in table.coords]
+        self._blue = numpy.array([color == Color.blue for color in colors], dtype=numpy.int32)
+        self._yellow = numpy.array([color == Color.yellow for color in colors], dtype=numpy.int32)
+        self._rows = {}
+        self._hexes = []
+        self._values = numpy.zeros(0, dtype=numpy.int64)
+        self._sizes = numpy.zeros(0, dtype=numpy.int64)
+        self._alive = numpy.zeros(0, dtype=bool)
+        self._matrix = scipy.sparse.csr_matrix((0, len(table.coords)), dtype=numpy.int32)
+
+    def recolor(self, coord, color):
+        i = self._index[coord]
+        self._blue[i] = color == Color.blue
+        self._yellow[i] = color == Color.yellow
+
+    def _sync(self, store):
+        """
+        Bring the rows in line with the regions in `store`.
+        """
+        for hexes in self._rows.keys() - set(store):
+            self._alive[self._rows.pop(hexes)] = False
+
+        added = [hexes for hexes in store if hexes not in self._rows]
+        if added:
+            sizes = numpy.fromiter(map(len, added), dtype=numpy.int64, count=len(added))
+            indices = numpy.fromiter(
+                map(self._index.__getitem__, itertools.chain.from_iterable(added)),
+                dtype=numpy.int32, count=int(sizes.sum()),
+            )
+            indptr = numpy.concatenate([[0], numpy.cumsum(sizes)])
+            rows = scipy.sparse.csr_matrix(
+                (numpy.ones(len(indices), dtype=numpy.int32), indices, indptr),
+                shape=(len(added), self._matrix.shape[1]),
+            )
+            self._rows.update((hexes, i) for i, hexes in enumerate(added, len(self._hexes)))
+            self._hexes.extend(added)
+            self._matrix = scipy.sparse.vstack([self._matrix, rows], format='csr')
+            self._values = numpy.concatenate([self._values, [store[hexes] for hexes in added]])
+            self._sizes = numpy.concatenate([self._sizes, sizes])
+            self._alive = numpy.concatenate([self._alive, numpy.ones(len(added), dtype=bool)])
+
+        dead = len(self._hexes) - len(self._rows)
+        if dead > max(len(self._rows), _MIN_COMPACT):
+            keep = numpy.flatnonzero(self._alive)
+            self._matrix = self._matrix[keep]
+            self._values = self._values[keep]
+            self._sizes = self._sizes[keep]
+            self._alive = self._alive[keep]
+            self._hexes = [self._hexes[i] for i in keep]
+            self._rows = {hexes: i for i, hexes in enumerate(self._hexes)}
+
+    def evaluate(self, store):
+        """
+        Find the regions in `store` that are solved, or can be simplified.
+
+        Returns three lists of (hexes, value net of the blue hexes
+        found): regions whose yellow hexes must all be blue, regions
+        whose yellow hexes must all be black, and other regions with
+        hexes no longer yellow.
+        """
+        self._sync(store)
+        live = numpy.flatnonzero(self._alive)
+        residual = (self._values - self._matrix @ self._blue)[live]
+        yellow = (self._matrix @ self._yellow)[live]
+        assert (residual >= 0).all(), [self._hexes[i] for i in live[residual < 0]]
+        assert (residual <= yellow).all(), [self._hexes[i] for i in live[residual > yellow]]
+
+        blue = residual == yellow
+        black = ~blue & (residual == 0)
+        simplified = ~blue & ~black & (yellow != self._sizes[live])
+        return [
+            [(self._hexes[live[i]], int(residual[i])) for i in numpy.flatnonzero(mask)]
+            for mask in (blue, black, simplified)
+        ]
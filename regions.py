@@ -0,0 +1,271 @@
+import collections
+import itertools
+
+DEFAULT_MAX_REGIONS = 500
+
+# Regions with more hexes than this aren't found by `overlapping`: big
+# regions rarely narrow anything, and indexing them costs more than
+# their help is worth.
+MAX_OVERLAPPING = 18
+
+
+class RegionStore:
+    """
+    The set of regions known to the solver.
+
+    A region is a frozenset of yellow hex coordinates paired with the
+    number of blue hexes among them. Regions come from two places:
+    clues on the board (which are "pinned" and never evicted), and
+    regions derived by the solver from the overlap of other regions.
+
+    Derived regions accumulate quickly, and every pass over the store
+    is quadratic, so the store works to keep itself small:
+    - Equivalent facts are merged: a set of hexes maps to one value.
+    - Derived regions that are implied by other regions in the store
+      (eg, a region that was split into an overlap and an exclusive
+      part, both of which are known) are dropped.
+    - If the store grows past `max_regions`, the largest derived
+      regions are evicted first, since small regions are the ones that
+      pin down individual hexes.
+
+    Regions that were dropped as implied are remembered, and will not be
+    added back: otherwise the solver could rediscover the same fact
+    every round and never stall. They're forgotten once any of their
+    hexes is settled, since the solver only derives regions of yellow
+    hexes. Evicted regions aren't remembered, so they can be derived
+    again. Among regions of the same size the newest is evicted first,
+    so a region derived again only stays if a larger one makes way for it.
+
+    Clue regions that share no hexes split the store into independent
+    components (see `components`). Regions that cover the whole board,
+    like the `remaining` counter, would join everything into one, so
+    they are added as "spanning" regions and kept apart.
+    """
+
+    def __init__(self, max_regions=DEFAULT_MAX_REGIONS):
+        self.max_regions = max_regions
+        self._regions = {}
+        self._pinned = set()
+        self._age = {}
+        self._retired = set()
+        self._spanning = set()
+        # The regions holding each hex, other than spanning and big regions.
+        self._containing = collections.defaultdict(set)
+        self._tick = itertools.count()
+        # The result of `components`, until the store next changes.
+        self._components = None
+        # Number of regions in the store at the end of each solver round.
+        self.history = []
+
+    def __len__(self):
+        return len(self._regions)
+
+    def __iter__(self):
+        return iter(self._regions)
+
+    def __contains__(self, hexes):
+        return hexes in self._regions
+
+    def __getitem__(self, hexes):
+        return self._regions[hexes]
+
+    def items(self):
+        return self._regions.items()
+
+    def overlapping(self, coords):
+        """
+        Return a dict of the regions holding any of `coords`, other than spanning and big regions.
+        """
+        found = {}
+        for coord in coords:
+            for hexes in self._containing.get(coord, ()):
+                found[hexes] = self._regions[hexes]
+        return found
+
+    def _index(self, hexes):
+        if len(hexes) > MAX_OVERLAPPING:
+            return
+        for coord in hexes:
+            self._containing[coord].add(hexes)
+
+    def _unindex(self, hexes):
+        if len(hexes) > MAX_OVERLAPPING:
+            return
+        for coord in hexes:
+            containing = self._containing.get(coord)
+            if containing is not None:
+                containing.discard(hexes)
+                if not containing:
+                    del self._containing[coord]
+
+    def is_known(self, hexes):
+        """
+        Find if the region is in the store, or was once and was removed.
+        """
+        return hexes in self._regions or hexes in self._retired
+
+    def add(self, hexes, value, pinned=False, spanning=False):
+        """
+        Add a region to the store.
+
+        Returns True if the region is new information.
+        """
+        hexes = frozenset(hexes)
+        if not hexes:
+            assert value == 0, value
+            return False
+        if hexes in self._regions:
+            assert self._regions[hexes] == value, (hexes, self._regions[hexes], value)
+            if pinned and hexes not in self._pinned:
+                self._pinned.add(hexes)
+                self._components = None
+            if spanning and hexes not in self._spanning:
+                self._components = None
+                self._spanning.add(hexes)
+                self._unindex(hexes)
+            return False
+        if hexes in self._retired and not pinned:
+            return False
+        self._retired.discard(hexes)
+        self._regions[hexes] = value
+        self._age[hexes] = next(self._tick)
+        self._components = None
+        if pinned:
+            self._pinned.add(hexes)
+        if spanning:
+            self._spanning.add(hexes)
+        else:
+            self._index(hexes)
+        return True
+
+    def update(self, regions):
+        """
+        Add derived regions, and return those that are new and weren't evicted to make room.
+        """
+        added = [hexes for hexes, value in regions.items() if self.add(hexes, value)]
+        self._evict()
+        return [hexes for hexes in added if hexes in self._regions]
+
+    def discard(self, hexes):
+        if self._regions.pop(hexes, None) is not None:
+            self._components = None
+            if hexes not in self._spanning:
+                self._unindex(hexes)
+        self._age.pop(hexes, None)
+        self._pinned.discard(hexes)
+        self._spanning.discard(hexes)
+
+    def rekey(self, old_hexes, new_hexes, value):
+        """
+        Replace a region with a simplified version of itself.
+
+        If the simplified region is already known the two are merged,
+        keeping the older region's age and either region's pin.
+        """
+        pinned = old_hexes in self._pinned
+        spanning = old_hexes in self._spanning
+        age = self._age[old_hexes]
+        self.discard(old_hexes)
+        self._components = None
+        if not new_hexes:
+            assert value == 0, value
+            return
+        existing = self._regions.get(new_hexes)
+        if existing is not None:
+            assert existing == value, (new_hexes, existing, value)
+            self._age[new_hexes] = min(self._age[new_hexes], age)
+        else:
+            self._retired.discard(new_hexes)
+            self._regions[new_hexes] = value
+            self._age[new_hexes] = age
+            if not spanning and new_hexes not in self._spanning:
+                self._index(new_hexes)
+        if pinned:
+            self._pinned.add(new_hexes)
+        if spanning and new_hexes not in self._spanning:
+            self._spanning.add(new_hexes)
+            self._unindex(new_hexes)
+
+    def retire_implied(self, hexes, parts):
+        """
+        Drop a derived region that is the disjoint union of known regions.
+
+        The union of the parts carries exactly the same information, so
+        the region is redundant. Clue regions are kept regardless.
+        """
+        if hexes in self._pinned or hexes not in self._regions:
+            return False
+        if not all(part in self._regions for part in parts):
+            return False
+        assert sum(self._regions[part] for part in parts) == self._regions[hexes], hexes
+        self.discard(hexes)
+        self._retired.add(hexes)
+        return True
+
+    def components(self):
+        """
+        Split the regions into groups that can be solved independently.
+
+        Clue regions that share a hex belong to the same component, and
+        so does every region lying within a single component: regions
+        derived from two overlapping regions never leave their union.
+        Returns a list of dicts of regions, one per component, and a
+        dict of the regions that span more than one component. These are
+        reused until the store changes, so callers mustn't modify them.
+        """
+        if self._components is None:
+            self._components = self._split_components()
+        return self._components
+
+    def _split_components(self):
+        parent = {}
+
+        def find(coord):
+            while parent[coord] != coord:
+                parent[coord] = parent[parent[coord]]
+                coord = parent[coord]
+            return coord
+
+        for hexes in self._pinned - self._spanning:
+            first, *rest = hexes
+            root = find(parent.setdefault(first, first))
+            for coord in rest:
+                parent[find(parent.setdefault(coord, coord))] = root
+
+        groups = collections.defaultdict(dict)
+        spanning = {}
+        for hexes, value in self._regions.items():
+            roots = {find(coord) if coord in parent else None for coord in hexes}
+            if hexes in self._spanning or len(roots) != 1 or None in roots:
+                spanning[hexes] = value
+            else:
+                root, = roots
+                groups[root][hexes] = value
+        return list(groups.values()), spanning
+
+    def record_round(self):
+        self.history.append(len(self._regions))
+
+    def prune_retired(self, is_yellow):
+        """
+        Forget the retired regions holding a hex for which `is_yellow` is False.
+
+        Regions are only derived from yellow hexes, so these can't come
+        back, and remembering them would only grow the retired set.
+        """
+        self._retired = {
+            hexes for hexes in self._retired if all(map(is_yellow, hexes))
+        }
+
+    def _evict(self):
+        if self.max_regions is None:
+            return
+        excess = len(self._regions) - self.max_regions
+        if excess <= 0:
+            return
+        candidates = sorted(
+            (hexes for hexes in self._regions if hexes not in self._pinned),
+            key=lambda hexes: (-len(hexes), -self._age[hexes]),
+        )
+        for hexes in candidates[:excess]:
+            self.discard(hexes)
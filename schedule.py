@@ -0,0 +1,76 @@
+"""
+Choose which deductions to click first, by how much uncovering them could tell the solver.
+
+Uncovering a hex can show a clue: black hexes almost always have one,
+over their neighbors, and blue hexes sometimes do, over the hexes
+within two steps. A clue only helps if it counts hexes that are still
+yellow, so a deduction's expected information is the chance its hex
+shows a clue, times the yellow hexes that clue would count. Clicking
+the most informative hexes first gets new clues in front of the solver
+in fewer screen captures.
+
+A hex whose clue would count no yellow hexes can't tell the solver
+anything, so there's no need to read it back at all.
+"""
+from hex_model import Color
+
+
+def clue_rates(board):
+    """
+    Estimate the chance an uncovered hex of each color shows a clue, from the hexes uncovered so far.
+    """
+    # Start from one hex with a clue and one without, so an estimate
+    # from few hexes isn't 0 or 1.
+    shown = {Color.black: 1, Color.blue: 1}
+    seen = {Color.black: 2, Color.blue: 2}
+    for hex_ in board._board.values():
+        if hex_.color in seen:
+            seen[hex_.color] += 1
+            shown[hex_.color] += hex_.value is not None
+    return {color: shown[color] / seen[color] for color in seen}
+
+
+def information(board, coord, color, rates=None):
+    """
+    The number of yellow hexes we expect a clue on the hex at `coord`, uncovered as `color`, to count.
+    """
+    if rates is None:
+        rates = clue_rates(board)
+    distance = 1 if color == Color.black else 2
+    yellow = sum(
+        board[neighbor].color == Color.yellow
+        for neighbor in board.neighbor_table.neighbors(coord, distance)
+    )
+    return rates[color] * yellow
+
+
+def prioritize(board, deductions, limit=None):
+    """
+    Order deductions most informative first, and return the first `limit` of them (or all).
+
+    The deductions must already be applied to the board, as `solve`
+    does, so they don't count towards each other's information.
+    """
+    rates = clue_rates(board)
+    ranked = sorted(deductions, key=lambda deduction: -information(board, *deduction, rates=rates))
+    return ranked[:limit]
+
+
+def plan_turn(board, deductions, limit=None):
+    """
+    Split deductions into those to click this turn, at most `limit` of the most informative, and the rest.
+    """
+    now = prioritize(board, deductions, limit)
+    chosen = set(now)
+    return now, [deduction for deduction in deductions if deduction not in chosen]
+
+
+def worth_reading(board, deductions):
+    """
+    The coordinates of clicked deductions whose clues, if they have any, could tell the solver something.
+    """
+    rates = clue_rates(board)
+    return [
+        coord for coord, color in deductions
+        if information(board, coord, color, rates=rates)
+    ]
@@ -0,0 +1,294 @@
+"""
+A long-running local solve server, so clients skip `main.py`'s start-up.
+
+The server keeps the imaging and OCR stacks imported, remembers OCR
+results and (given `--cache`) deductions across requests, and solves
+requests concurrently in a pool of worker threads.
+
+Each connection carries one request: a line of JSON, either
+
+    {"format": "debug", "board": "<debug_board.txt contents>", "remaining": 12}
+    {"format": "screenshot", "path": "level.png"}
+    {"format": "screenshot", "png": "<base64>"}
+
+or `{"stats": true}`. The server answers with lines of JSON: a
+`{"coord": [x, y, z], "color": "blue"}` line for each deduction as it's
+made, then a final line with `"done": true`, whether the board is
+solved, and the request's latency, or `{"error": ...}` if it failed.
+
+    python server.py --socket /tmp/hexcells.sock --workers 4
+    python server.py --socket /tmp/hexcells.sock request debug_board.txt
+"""
+import argparse
+import asyncio
+import base64
+import collections
+import concurrent.futures
+import contextlib
+import io
+import json
+import socket
+import time
+
+import hex_model
+import main
+
+DEFAULT_PORT = 8765
+
+# Recent requests' latencies, for the stats request.
+HISTORY = 1000
+
+
+class Latency(collections.namedtuple('Latency', 'queued parse first_deduction total')):
+    """
+    Seconds from a request's arrival to each stage of handling it.
+
+    `first_deduction` is None if nothing could be deduced.
+    """
+
+
+_FINISHED = object()
+
+
+def warm_up():
+    """
+    Import the imaging and OCR stacks up front, so no request waits on them.
+
+    Returns False if they aren't installed, in which case only text
+    boards can be solved.
+    """
+    try:
+        import PIL.Image
+        import image_parse
+    except ImportError as e:
+        print("Screenshots unavailable - {}".format(e))
+        return False
+    # Register the image formats now, rather than on the first open.
+    PIL.Image.init()
+    if image_parse.engine_pool() is None:
+        print("tesserocr not installed - running the tesseract command for each hex")
+    return True
+
+
+def parse_request(request):
+    """
+    Build the board a request asks to solve.
+    """
+    if request.get('format') == 'debug':
+        return main.parse_debug_board(request['board'], remaining=request.get('remaining'))
+    if request.get('format') == 'screenshot':
+        import PIL.Image
+        import image_parse
+
+        if 'png' in request:
+            im = PIL.Image.open(io.BytesIO(base64.b64decode(request['png'])))
+        else:
+            im = PIL.Image.open(request['path'])
+        im = im.convert('RGB')
+        samples, objs = image_parse.label_compact(im, quiet=True)
+        return main.parse_labeled_hexagons(im, samples, objs, interactive=False, quiet=True)
+    raise ValueError("Unknown board format: {!r}".format(request.get('format')))
+
+
+class SolveServer:
+    """
+    Solve boards for any number of clients, `workers` at a time.
+
+    Parsing and solving run in a thread pool. Tesseract reads without
+    the GIL, in its own process or (with tesserocr) an engine per
+    thread, so reading screenshots overlaps well; solving holds the
+    GIL, so concurrent solves share a core, but each client's
+    deductions still stream back as they're made.
+
+    `on_request`, if given, is called with the number of deductions
+    and the Latency of each request answered.
+    """
+    def __init__(self, workers=None, solve=hex_model.HexBoard.solve, on_request=None):
+        self.executor = concurrent.futures.ThreadPoolExecutor(workers)
+        self.solve = solve
+        self.latencies = collections.deque(maxlen=HISTORY)
+        self.requests = 0
+        self.errors = 0
+        self.on_request = on_request
+
+    def _run(self, request, start, emit):
+        """
+        Parse and solve a request in a worker thread, passing each deduction to `emit`.
+        """
+        queued = time.perf_counter() - start
+        board = parse_request(request)
+        parse = time.perf_counter() - start
+        first_deduction = None
+        for coord, color in self.solve(board):
+            if first_deduction is None:
+                first_deduction = time.perf_counter() - start
+            emit({'coord': coord, 'color': color.name})
+        return board.is_solved, Latency(queued, parse, first_deduction, time.perf_counter() - start)
+
+    async def handle(self, reader, writer):
+        start = time.perf_counter()
+        try:
+            line = await reader.readline()
+            request = json.loads(line)
+            if request.get('stats'):
+                self._write(writer, self.stats())
+            else:
+                await self._solve(request, start, writer)
+        except Exception as e:
+            self.errors += 1
+            self._write(writer, {'error': '{}: {}'.format(type(e).__name__, e)})
+        finally:
+            # The client may have gone already.
+            with contextlib.suppress(ConnectionError):
+                await writer.drain()
+            writer.close()
+
+    async def _solve(self, request, start, writer):
+        loop = asyncio.get_running_loop()
+        deductions = asyncio.Queue()
+
+        def emit(message):
+            loop.call_soon_threadsafe(deductions.put_nowait, message)
+
+        future = loop.run_in_executor(self.executor, self._run, request, start, emit)
+        future.add_done_callback(lambda _: emit(_FINISHED))
+        count = 0
+        while True:
+            message = await deductions.get()
+            if message is _FINISHED:
+                break
+            self._write(writer, message)
+            count += 1
+            await writer.drain()
+
+        solved, latency = await future
+        self.requests += 1
+        self.latencies.append(latency)
+        self._write(writer, {
+            'done': True,
+            'deductions': count,
+            'solved': solved,
+            'latency': latency._asdict(),
+        })
+        if self.on_request:
+            self.on_request(count, latency)
+
+    @staticmethod
+    def _write(writer, message):
+        writer.write(json.dumps(message).encode() + b'\n')
+
+    def stats(self):
+        """
+        Summarize recent requests' latencies.
+        """
+        def percentile(values, fraction):
+            if not values:
+                return None
+            values = sorted(values)
+            return values[min(len(values) - 1, int(len(values) * fraction))]
+
+        totals = [latency.total for latency in self.latencies]
+        firsts = [latency.first_deduction for latency in self.latencies
+                  if latency.first_deduction is not None]
+        return {
+            'requests': self.requests,
+            'errors': self.errors,
+            'total_p50': percentile(totals, 0.5),
+            'total_p95': percentile(totals, 0.95),
+            'first_deduction_p50': percentile(firsts, 0.5),
+            'first_deduction_p95': percentile(firsts, 0.95),
+        }
+
+    async def serve(self, path=None, port=DEFAULT_PORT, ready=None):
+        """
+        Serve on a Unix socket at `path`, or on localhost at `port`.
+
+        `ready`, if given, is called with the server once it's listening.
+        """
+        if path:
+            server = await asyncio.start_unix_server(self.handle, path)
+        else:
+            server = await asyncio.start_server(self.handle, '127.0.0.1', port)
+        if ready:
+            ready(server)
+        async with server:
+            await server.serve_forever()
+
+
+def request(payload, path=None, port=DEFAULT_PORT):
+    """
+    Send a request to a running server, and yield each line of its answer as it arrives.
+    """
+    if path:
+        sock = socket.socket(socket.AF_UNIX)
+        sock.connect(path)
+    else:
+        sock = socket.create_connection(('127.0.0.1', port))
+    with sock, sock.makefile('rwb') as f:
+        f.write(json.dumps(payload).encode() + b'\n')
+        f.flush()
+        for line in f:
+            yield json.loads(line)
+
+
+def run_request(args):
+    if args.file is None:
+        payload = {'stats': True}
+    elif args.file.endswith('.png'):
+        with open(args.file, 'rb') as f:
+            payload = {'format': 'screenshot', 'png': base64.b64encode(f.read()).decode()}
+    else:
+        with open(args.file) as f:
+            payload = {'format': 'debug', 'board': f.read(), 'remaining': args.remaining}
+    for message in request(payload, args.socket, args.port):
+        print(json.dumps(message))
+
+
+def _log_request(count, latency):
+    print('{} deductions in {:.3f}s (queued {:.3f}s, parsed {:.3f}s)'.format(
+        count, latency.total, latency.queued, latency.parse,
+    ))
+
+
+def run_server(args):
+    warm_up()
+    solve = main.solver(args)
+    server = SolveServer(args.workers, solve, on_request=_log_request)
+    where = args.socket or '127.0.0.1:{}'.format(args.port)
+    asyncio.run(server.serve(
+        args.socket, args.port, ready=lambda _: print('Listening on {}'.format(where)),
+    ))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Solve boards for local clients.')
+    parser.add_argument('--socket', metavar='PATH', help="serve on a Unix socket instead of localhost")
+    parser.add_argument('--port', type=int, default=DEFAULT_PORT)
+    parser.add_argument('--workers', type=int, default=None, help="concurrent requests")
+    parser.add_argument(
+        '--cache', metavar='DIR',
+        help="remember deductions for board states in this directory, and reuse them",
+    )
+    parser.add_argument('--cache-size', type=int, default=16, help="cache size in MB")
+    parser.add_argument(
+        '--tiers', type=main.tiers, default=None,
+        help="solver rule sets to run, cheapest first (default: {})".format(','.join(hex_model.TIERS)),
+    )
+    parser.add_argument(
+        '--lazy', action='store_true',
+        help="build regions a clue at a time, nearest the last changes first, for a quicker first deduction",
+    )
+    parser.set_defaults(func=run_server)
+    subparsers = parser.add_subparsers(dest='cmd')
+
+    request_parser = subparsers.add_parser('request', help="send a board to a running server")
+    request_parser.add_argument(
+        'file', nargs='?',
+        help="a debug board or .png screenshot; without one, print the server's stats",
+    )
+    request_parser.add_argument('--remaining', type=int, default=None)
+    request_parser.set_defaults(func=run_request)
+
+    args = parser.parse_args()
+    main.check_solver_args(parser, args)
+    args.func(args)
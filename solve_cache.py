@@ -0,0 +1,175 @@
+"""
+Remember the deductions made for board states we've seen before.
+
+Boards are keyed by a canonical form of their state, so the same level
+matches however it was read: `parse_labeled_hexagons` puts the origin
+wherever the first hex happened to be, so the key ignores translation,
+and optionally rotation and reflection too.
+"""
+import collections
+import contextlib
+import hashlib
+import json
+import os
+
+from hex_model import Color
+
+DEFAULT_MAX_BYTES = 16 * 2 ** 20
+
+
+def _rotate(coord):
+    x, y, z = coord
+    return -y, -z, -x
+
+
+def _reflect(coord):
+    x, y, z = coord
+    return x, z, y
+
+
+def _symmetries(symmetric):
+    """
+    Yield functions mapping a coordinate or direction through each symmetry of the grid.
+    """
+    for reflect in ((False, True) if symmetric else (False,)):
+        for turns in range(6 if symmetric else 1):
+            def transform(coord, reflect=reflect, turns=turns):
+                if reflect:
+                    coord = _reflect(coord)
+                for _ in range(turns):
+                    coord = _rotate(coord)
+                return coord
+            yield transform
+
+
+Canonical = collections.namedtuple('Canonical', 'key to_canonical from_canonical')
+
+
+def canonicalize(board, symmetric=False):
+    """
+    Find the canonical form of a board's current state.
+
+    Returns a Canonical of the form's key, a dict mapping the board's
+    coordinates to the canonical ones, and a dict mapping them back.
+    Hexes clicked by an unapplied solve count as uncovered. The key
+    covers the solver's settings too, since they change what it finds.
+    """
+    config = [list(board.tiers), board.elimination, board.sparse, board.max_regions]
+    best = None
+    for transform in _symmetries(symmetric):
+        moved = {coord: transform(coord) for coord in board._board}
+        offset = min(moved.values())
+        mapping = {
+            coord: tuple(a - b for a, b in zip(to, offset))
+            for coord, to in moved.items()
+        }
+        hexes = sorted(
+            (mapping[coord], hex_.color.name, hex_.value, hex_.is_contiguous)
+            for coord, hex_ in zip(board._board, map(board.__getitem__, board._board))
+        )
+        lines = sorted(
+            (
+                tuple(a - b for a, b in zip(transform(coord), offset)),
+                transform(clue.direction), clue.value, clue.is_contiguous,
+            )
+            for coord, clue in board.lines.items()
+        )
+        text = json.dumps([config, board.remaining, hexes, lines])
+        if best is None or text < best[0]:
+            best = text, mapping
+
+    text, mapping = best
+    return Canonical(
+        key=hashlib.sha256(text.encode()).hexdigest(),
+        to_canonical=mapping,
+        from_canonical={to: coord for coord, to in mapping.items()},
+    )
+
+
+class SolveCache:
+    """
+    A directory of the deductions made for each board state, keyed by canonical form.
+
+    Each entry is a small JSON file. Once the directory holds more than
+    `max_bytes`, the least recently used entries are removed.
+    """
+    def __init__(self, path, max_bytes=DEFAULT_MAX_BYTES, symmetric=True):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.symmetric = symmetric
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(path, exist_ok=True)
+
+    def _entry(self, key):
+        return os.path.join(self.path, key + '.json')
+
+    def get(self, key):
+        """
+        Return the cached deductions for a key, or None.
+        """
+        path = self._entry(key)
+        try:
+            with open(path) as f:
+                deductions = json.load(f)
+        except (IOError, ValueError):
+            return None
+        # Mark the entry as recently used.
+        os.utime(path)
+        return [(tuple(coord), Color[color]) for coord, color in deductions]
+
+    def put(self, key, deductions):
+        path = self._entry(key)
+        temp = path + '.tmp'
+        with open(temp, 'w') as f:
+            json.dump([(coord, color.name) for coord, color in deductions], f)
+        os.replace(temp, path)
+        self._evict()
+
+    def _evict(self):
+        entries = []
+        with os.scandir(self.path) as it:
+            for entry in it:
+                if entry.name.endswith('.json'):
+                    # Other threads or processes may be evicting too.
+                    with contextlib.suppress(FileNotFoundError):
+                        stat = entry.stat()
+                        entries.append((stat.st_mtime, stat.st_size, entry.path))
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            with contextlib.suppress(FileNotFoundError):
+                os.remove(path)
+            total -= size
+
+    def solve(self, board, budget=None):
+        """
+        Yield what `board.solve()` would, skipping the solve if we've seen this state before.
+
+        Only a solve that runs to completion is cached: one that runs
+        out of budget is resumed uncached. Don't use the cache for a
+        board that has clues revealed to it mid-solve (as `pipeline.run`
+        does): its deductions belong to no one state.
+        """
+        if board.suspended:
+            yield from board.solve(budget)
+            return
+
+        canonical = canonicalize(board, self.symmetric)
+        cached = self.get(canonical.key)
+        if cached is not None:
+            self.hits += 1
+            for coord, color in cached:
+                coord = canonical.from_canonical[coord]
+                board._click(coord, color)
+                yield coord, color
+            return
+
+        self.misses += 1
+        deductions = []
+        for coord, color in board.solve(budget):
+            deductions.append((canonical.to_canonical[coord], color))
+            yield coord, color
+        if not board.suspended:
+            self.put(canonical.key, deductions)
@@ -1,8 +1,32 @@
+import asyncio
+import collections
+import concurrent.futures
+import contextlib
+import io
+import itertools
+import math
+import os
 import re
+import sys
+import tempfile
+import threading
+import types
 import unittest
+import unittest.mock
 
+import counting
 import display
-from hex_model import Color, Hex, HexBoard
+import fake_game
+import fuzz
+import generate
+import hex_model
+import input_dispatch
+import pipeline
+from hex_model import Color, Hex, HexBoard, LineClue
+import regions
+import schedule
+import server
+import solve_cache
 import util
 
 
@@ -16,10 +40,19 @@ def _get_bump(line):
     # " {3}" = 1
     # "  {3}" = 1
     # "   {3}" = 0
+    # A line clue's direction marker takes up the space before the clue.
+    line = re.sub(r"^( *)[|/\\](?=\S)", r"\1 ", line)
     spaces, char = re.match(r"^( *)\S(\S?)", line).groups()
     return bool((len(spaces) + bool(char)) % 4 // 2)
 
 
+LINE_MARKERS = {
+    '|': hex_model.LINE_DIRECTIONS['down'],
+    '\\': hex_model.LINE_DIRECTIONS['down_right'],
+    '/': hex_model.LINE_DIRECTIONS['down_left'],
+}
+
+
 def _get_hex(text):
     color = Color.black
     if text == '-':
@@ -48,9 +81,16 @@ def _board_from_string(string, **kwargs):
         while line:
             spaces, text = re.match(r'^( *)(\S+)', line).groups()
             line = line[len(spaces) + len(text):]
+            marker = None
+            if len(text) > 1 and text[0] in LINE_MARKERS:
+                marker, text = text[0], text[1:]
+                spaces += ' '
             spaces = (len(spaces) + (len(text) > 1)) // 4
             hex_line += [None] * spaces
-            hex_line.append(_get_hex(text))
+            if marker:
+                hex_line.append(LineClue(text, LINE_MARKERS[marker]))
+            else:
+                hex_line.append(_get_hex(text))
         hex_lines.append(hex_line)
 
     board = HexBoard(**kwargs)
@@ -59,7 +99,10 @@ def _board_from_string(string, **kwargs):
             if elem:
                 hx = x * 2 + ((y - bump) % 2)
                 hy = y // 2 - x + ((bump % 2) * (not (hx % 2)))
-                board[hx, hy] = elem
+                if isinstance(elem, LineClue):
+                    board.add_line((hx, hy), elem)
+                else:
+                    board[hx, hy] = elem
 
     return board
 
@@ -151,6 +194,53 @@ class BoardReaderTest(unittest.TestCase):
         assert board.get((dx, dy + 1), mock).text == '{2}', disp
 
 
+class LineClueTest(unittest.TestCase):
+    def test_column(self):
+        board = _board_from_string("""
+           |2
+              x
+            -
+              x
+            -
+        """)
+        (coord, clue), = board.lines.items()
+        assert clue.value == 2
+        hexes = board.line_hexes(coord)
+        assert len(hexes) == 2
+        assert all(board[hex_].color == Color.yellow for hex_ in hexes)
+
+    def test_diagonal(self):
+        board = _board_from_string(r"""
+           \1
+              -
+            x   -
+                  -
+        """)
+        (coord, clue), = board.lines.items()
+        assert clue.direction == hex_model.LINE_DIRECTIONS['down_right']
+        assert len(board.line_hexes(coord)) == 3
+
+    def test_line_gap(self):
+        board = _board_from_string("""
+           |2
+
+            -
+
+
+
+            -
+        """)
+        (coord, clue), = board.lines.items()
+        assert len(board.line_hexes(coord)) == 2
+        assert len(board.neighbor_table.ray(coord, clue.direction)) == 3
+
+    def test_label_on_board(self):
+        board = HexBoard()
+        board[0, 0] = Hex('-', Color.yellow)
+        with self.assertRaises(ValueError):
+            board.add_line((0, 0), LineClue('1', hex_model.LINE_DIRECTIONS['down']))
+
+
 class SolverUnitTest(unittest.TestCase):
     @classmethod
     def set_display_fn(cls, fn):
@@ -167,7 +257,7 @@ class SolverUnitTest(unittest.TestCase):
             self.display_fn(self.solved_board),
         )
 
-    def assertSolve(self, start_string, expected_string=None, **kwargs):
+    def assertSolve(self, start_string, expected_string=None, budget=None, **kwargs):
         if expected_string is None:
             start_string, expected_string = _split_on_arrow(start_string)
         self.board = _board_from_string(start_string, **kwargs)
@@ -180,7 +270,8 @@ class SolverUnitTest(unittest.TestCase):
             )
         )
 
-        list(self.board.solve())
+        list(self.board.solve(budget))
+        assert not self.board.suspended, 'Out of budget!\n{}'.format(self.display_fn(self.board))
         self.board.apply_clicked()
 
         for coord, hex_ in self.expected._board.items():
@@ -255,16 +346,23 @@ class SolverUnitTest(unittest.TestCase):
            -          x
         """)
 
+    def test_contiguity_narrows_count(self):
+        # A blue hex below the 1 would need the hex above it blue too,
+        # to make the {2}, and the 1 can't have both.
+        self.assertSolve("""
+              -   -           -   -
+            -   -   -       -   -   -
+              1  {2}    =>    1  {2}
+            -   -   -       -   x   -
+              -   x           -   x
+        """)
+
     def test_infinite_loop(self):
-        try:
-            with util.Timeout(seconds=2):
-                self.assertSolve("""
-                    -   -         -   -
-                  1   2     =>  1   2
-                    -   -         -   -
-                """)
-        except TimeoutError:
-            assert False, 'Timeout!\n{}'.format(self.display_fn(self.board))
+        self.assertSolve("""
+            -   -         -   -
+          1   2     =>  1   2
+            -   -         -   -
+        """, budget=util.Budget(seconds=2))
 
     def test_known_remaining(self):
         self.assertSolve("""
@@ -275,6 +373,43 @@ class SolverUnitTest(unittest.TestCase):
           -   -           x   x
         """, remaining=2)
 
+    def test_line(self):
+        self.assertSolve("""
+           |1             |1
+
+            -              o
+          x   -          x   -
+            x      =>      x
+          x   -          x   -
+            x              x
+        """)
+
+    def test_contiguous_line(self):
+        self.assertSolve("""
+          |{2}           |{2}
+
+            o              o
+          x   x          x   x
+            -      =>      o
+          x   x          x   x
+            -              x
+          x   x          x   x
+            -              x
+        """)
+
+    def test_noncontiguous_line(self):
+        self.assertSolve("""
+          |-2-           |-2-
+
+            o              o
+          x   x          x   x
+            -      =>      x
+          x   x          x   x
+            -              -
+          x   x          x   x
+            -              -
+        """)
+
     def test_no_remaining(self):
         self.assertSolve("""
           -   -           x   x
@@ -285,6 +420,1310 @@ class SolverUnitTest(unittest.TestCase):
         """, remaining=0)
 
 
+class RegionStoreTest(unittest.TestCase):
+    def test_merge_equivalent(self):
+        store = regions.RegionStore()
+        assert store.add({(0, 0, 0), (1, -1, 0)}, 1)
+        assert not store.add([(1, -1, 0), (0, 0, 0)], 1)
+        assert len(store) == 1
+
+    def test_empty_region(self):
+        store = regions.RegionStore()
+        assert not store.add(frozenset(), 0)
+        assert len(store) == 0
+
+    def test_retire_implied(self):
+        a, b, c = frozenset({(0, 0, 0)}), frozenset({(1, -1, 0)}), frozenset({(2, -2, 0)})
+        store = regions.RegionStore()
+        store.add(a | b | c, 2)
+        store.add(a, 1)
+        store.add(b | c, 1)
+        assert store.retire_implied(a | b | c, (a, b | c))
+        assert a | b | c not in store
+        # Once retired, a region can not be rediscovered.
+        assert store.is_known(a | b | c)
+        assert not store.update({a | b | c: 2})
+
+    def test_pinned_not_retired(self):
+        a, b = frozenset({(0, 0, 0)}), frozenset({(1, -1, 0)})
+        store = regions.RegionStore()
+        store.add(a | b, 1, pinned=True)
+        store.add(a, 1)
+        store.add(b, 0)
+        assert not store.retire_implied(a | b, (a, b))
+        assert a | b in store
+
+    def test_evict_largest_derived(self):
+        store = regions.RegionStore(max_regions=2)
+        big = frozenset((x, -x, 0) for x in range(5))
+        store.add(big, 2, pinned=True)
+        store.add(frozenset((x, -x, 0) for x in range(4)), 2)
+        store.update({frozenset((x, -x, 0) for x in range(2)): 1})
+        assert len(store) == 2
+        assert big in store
+        assert frozenset((x, -x, 0) for x in range(2)) in store
+
+    def test_evicted_can_return(self):
+        a, b, c = (frozenset({(x, -x, 0)}) for x in range(3))
+        store = regions.RegionStore(max_regions=1)
+        store.add(a | b | c, 2)
+        assert store.update({a | b: 1}) == [a | b]
+        assert a | b | c not in store
+        # Evicted for room, not because it was implied, so it can be
+        # derived again - though it's only kept given room for it.
+        assert not store.is_known(a | b | c)
+        assert store.update({a | b | c: 2}) == []
+        store.discard(a | b)
+        assert store.update({a | b | c: 2}) == [a | b | c]
+
+    def test_evict_newest_of_same_size(self):
+        a, b, c = (frozenset({(x, -x, 0)}) for x in range(3))
+        store = regions.RegionStore(max_regions=1)
+        store.add(a | b, 1)
+        assert store.update({b | c: 1}) == []
+        assert a | b in store
+
+    def test_prune_retired(self):
+        a, b, c = frozenset({(0, 0, 0)}), frozenset({(1, -1, 0)}), frozenset({(2, -2, 0)})
+        store = regions.RegionStore()
+        store.add(a, 1)
+        store.add(b, 0)
+        store.add(c, 0)
+        for hexes, parts in ((a | b, (a, b)), (a | c, (a, c))):
+            store.add(hexes, 1)
+            assert store.retire_implied(hexes, parts)
+        store.prune_retired(lambda coord: coord != (2, -2, 0))
+        assert store.is_known(a | b)
+        assert not store.is_known(a | c)
+
+    def test_components(self):
+        a, b, c, d = (frozenset({(x, -x, 0)}) for x in range(4))
+        store = regions.RegionStore()
+        store.add(a | b | c | d, 2, pinned=True, spanning=True)
+        store.add(a | b, 1, pinned=True)
+        store.add(c | d, 1, pinned=True)
+        store.add(a, 1)
+        store.add(b | c, 1)
+        components, spanning = store.components()
+        assert sorted(components, key=len) == [{c | d: 1}, {a | b: 1, a: 1}]
+        assert spanning == {a | b | c | d: 2, b | c: 1}
+
+        store.discard(b | c)
+        store.add(c, 0)
+        components, spanning = store.components()
+        assert len(components) == 2
+        assert {c | d: 1, c: 0} in components and {a | b: 1, a: 1} in components
+        assert spanning == {a | b | c | d: 2}
+
+    def test_components_in_executor(self):
+        with concurrent.futures.ThreadPoolExecutor(2) as executor:
+            for seed in range(3):
+                board, _ = generate.generate_board(radius=4, seed=seed)
+                expected = list(board.solve())
+                board, _ = generate.generate_board(radius=4, seed=seed)
+                board.executor = executor
+                assert list(board.solve()) == expected
+
+    def test_solver_bounded(self):
+        board, _ = generate.generate_board(radius=4, seed=3)
+        board.max_regions = 50
+        list(board.solve())
+        assert max(board._regions.history) <= 50 + len(board._board)
+
+
+class BudgetTest(unittest.TestCase):
+    def test_resume(self):
+        for seed in (0, 2):
+            board, _ = generate.generate_board(radius=5, seed=seed)
+            expected = list(board.solve())
+
+            board, solution = generate.generate_board(radius=5, seed=seed)
+            deductions = []
+            calls = 0
+            while not calls or board.suspended:
+                calls += 1
+                deductions.extend(board.solve(util.Budget(steps=1000)))
+                for coord, color in deductions:
+                    assert solution[coord].color == color
+            assert calls > 1
+            assert sorted(deductions) == sorted(expected)
+
+    def test_resume_repeats_little(self):
+        # Resuming picks up the interrupted tier where it stopped, rather
+        # than going round the tiers again.
+        for seed in (0, 2):
+            board, _ = generate.generate_board(radius=5, seed=seed)
+            budget = util.Budget(steps=10 ** 9)
+            list(board.solve(budget))
+            whole = 10 ** 9 - budget.steps
+
+            board, _ = generate.generate_board(radius=5, seed=seed)
+            spent = 0
+            while not spent or board.suspended:
+                budget = util.Budget(steps=1000)
+                list(board.solve(budget))
+                spent += 1000 - budget.steps
+            assert spent <= whole * 1.01, (seed, spent, whole)
+
+    def test_change_restarts(self):
+        board, solution = generate.generate_board(radius=5, seed=0)
+        list(board.solve(util.Budget(steps=0)))
+        assert board.suspended
+        coord = next(coord for coord, hex_ in board._board.items() if hex_.color == Color.yellow)
+        board[coord] = solution[coord]
+        assert not board.suspended
+
+    def test_clue_colorings_charged(self):
+        board = HexBoard()
+        cells = [(x, -x, 0) for x in range(24)]
+        for coord in cells:
+            board[coord] = Hex('-', Color.yellow)
+
+        # Short enough to enumerate: each coloring is charged.
+        budget = util.Budget(steps=10000)
+        clue = hex_model.Clue(cells[:8], 3, contiguous=False)
+        assert not list(clue.solve(board, budget=budget))
+        assert budget.steps == 10000 - math.comb(8, 3)
+
+        # Too long to enumerate, so it's left to its region.
+        budget = util.Budget(steps=10000)
+        clue = hex_model.Clue(cells, 12, contiguous=False)
+        assert math.comb(24, 12) > hex_model.MAX_COLORINGS
+        assert not list(clue.solve(board, budget=budget))
+        assert budget.steps == 10000
+
+    def test_exhausted(self):
+        assert not util.Budget().exhausted
+        budget = util.Budget(steps=2)
+        assert budget.spend()
+        assert not budget.spend()
+        assert budget.exhausted
+        assert util.Budget(seconds=0).exhausted
+
+
+class ColorCountTest(unittest.TestCase):
+    def assertCounts(self, board):
+        expected = collections.Counter(board[coord].color for coord in board._board)
+        assert board.color_counts == {color: expected[color] for color in Color}
+        assert board.is_solved == (not expected[Color.yellow])
+
+    @staticmethod
+    def _sections(board, clue):
+        """
+        Split a clue's cells into runs of hexes that aren't black, as its sections were once kept.
+        """
+        def is_open(coord):
+            return coord is not None and board[coord].color != Color.black
+
+        cells = clue.cells
+        if clue.cyclic and not all(map(is_open, cells)):
+            start = next(i for i, coord in enumerate(cells) if not is_open(coord))
+            cells = cells[start:] + cells[:start]
+        sections = [[]]
+        for coord in cells:
+            if is_open(coord):
+                sections[-1].append(coord)
+            elif sections[-1]:
+                sections.append([])
+        return [section for section in sections if section]
+
+    def test_constraints_settle(self):
+        for seed in range(5):
+            board, _ = generate.generate_board(radius=4, lines=0.6, contiguity=0.8, seed=seed)
+            for _ in board.solve():
+                for clue in board._contiguous_constraints:
+                    # The masks kept up as hexes change match the board.
+                    yellow, blue = clue._masks(board)
+                    assert (yellow, blue) == clue._read_masks(board), clue
+                    with_blue = [
+                        section for section in self._sections(board, clue)
+                        if any(board[coord].color == Color.blue for coord in section)
+                    ]
+                    assert clue._is_split(yellow, blue) == (len(with_blue) > 1), clue
+            assert not board._queue
+
+    def test_clue_deductions(self):
+        # Alone, a clue forces just the hexes colored the same in every
+        # coloring of its yellow cells that fits it.
+        checked = 0
+        for seed in range(10):
+            board, _ = generate.generate_board(radius=4, lines=0.6, contiguity=0.8, seed=seed)
+            solver = board.solve()
+            for _ in itertools.islice(solver, 3):
+                pass
+            for clue in board._contiguous_constraints:
+                yellow = [coord for coord in clue.hexes if board[coord].color == Color.yellow]
+                seen = {coord: set() for coord in yellow}
+                for bits in itertools.product((False, True), repeat=len(yellow)):
+                    blue = dict(zip(yellow, bits))
+                    blues = [
+                        coord is not None and blue.get(coord, board[coord].color == Color.blue)
+                        for coord in clue.cells
+                    ]
+                    fits = counting._is_contiguous(blues, clue.cyclic) == clue.contiguous
+                    if sum(blues) == clue.value and fits:
+                        for coord, bit in blue.items():
+                            seen[coord].add(bit)
+                expected = {
+                    (coord, Color.blue if bits == {True} else Color.black)
+                    for coord, bits in seen.items() if len(bits) == 1
+                }
+                if not clue.contiguous and not clue.cyclic and clue._is_split(*clue._masks(board)):
+                    # Only the count is left to satisfy, and that's
+                    # left to the line's region.
+                    assert not list(clue.solve(board)), clue
+                    assert not expected or len(expected) == len(yellow), clue
+                    continue
+                assert set(clue.solve(board)) == expected, clue
+                checked += 1
+        assert checked
+
+    def test_counts_follow_solve(self):
+        for seed in range(5):
+            board, solution = generate.generate_board(radius=4, seed=seed)
+            self.assertCounts(board)
+            constraints = []
+            solver = board.solve()
+            for _ in solver:
+                self.assertCounts(board)
+                constraints = list(board._contiguous_constraints or ())
+                for constraint in constraints:
+                    assert constraint.is_done(board) == all(
+                        board[coord].color != Color.yellow for coord in constraint.hexes
+                    )
+            board.apply_clicked()
+            self.assertCounts(board)
+            for coord, hex_ in solution.items():
+                board[coord] = hex_
+            self.assertCounts(board)
+            assert board.is_solved
+
+
+def _brute_force_count(board, solution):
+    """
+    Count completions of a small board by trying every coloring of its yellow hexes.
+    """
+    yellow = [coord for coord in board._board if board[coord].color == Color.yellow]
+    total = 0
+    blues = collections.Counter()
+    for bits in itertools.product((Color.black, Color.blue), repeat=len(yellow)):
+        colors = {coord: board[coord].color for coord in board._board}
+        colors.update(zip(yellow, bits))
+        if board.remaining is not None and bits.count(Color.blue) != board.remaining:
+            continue
+        ok = True
+        for coord, hex_ in solution.items():
+            if hex_.value is None:
+                continue
+            distance = 1 if colors[coord] == Color.black else 2
+            if solution[coord].color != colors[coord] and board[coord].color == Color.yellow:
+                # A hex colored differently from the solution would show a different clue.
+                continue
+            if board[coord].color == Color.yellow:
+                continue
+            count = sum(colors[n] == Color.blue for n in board._neighbors(coord, distance))
+            if count != hex_.value:
+                ok = False
+                break
+            if hex_.is_contiguous is not None:
+                ring = {n: colors[n] for n in board._neighbors(coord)}
+                if generate._ring_is_contiguous(ring, coord) != hex_.is_contiguous:
+                    ok = False
+                    break
+        if ok:
+            total += 1
+            blues.update(coord for coord, color in zip(yellow, bits) if color == Color.blue)
+    return total, {coord: blues[coord] / total for coord in yellow}
+
+
+class TierTest(unittest.TestCase):
+    def test_stats(self):
+        board, _ = generate.generate_board(radius=4, seed=2)
+        deductions = list(board.solve())
+        stats = board.tier_stats
+        assert list(stats) == list(hex_model.TIERS)
+        assert sum(tier['deductions'] for tier in stats.values()) == len(deductions)
+        # The cheapest tier runs after every other tier's progress.
+        later = sum(tier['progress'] for name, tier in stats.items() if name != 'regions')
+        assert stats['regions']['runs'] > later
+        assert stats['elimination']['runs'] == stats['elimination']['progress'] + 1
+
+    def test_order(self):
+        for seed in range(5):
+            board, _ = generate.generate_board(radius=4, seed=seed)
+            reordered = fuzz.copy_board(board)
+            reordered.tiers = ('regions', 'subdivide', 'constraints', 'spanning')
+            assert set(reordered.solve()) <= set(board.solve()), seed
+            assert list(reordered.tier_stats) == list(reordered.tiers)
+
+    def test_unknown_tier(self):
+        board, _ = generate.generate_board(radius=2, seed=0)
+        board.tiers = ('regions', 'guessing')
+        with self.assertRaises(ValueError):
+            list(board.solve())
+
+
+class SparseRegionTest(unittest.TestCase):
+    def test_same_deductions(self):
+        for seed in range(20):
+            board, _ = fuzz.random_board(seed, max_radius=5)
+            sparse = fuzz.copy_board(board)
+            sparse.sparse = True
+            assert set(sparse.solve()) == set(board.solve()), seed
+
+    def test_reveal_mid_solve(self):
+        board, solution = generate.generate_board(radius=4, seed=3)
+        board.sparse = True
+        for coord, color in board.solve():
+            board.reveal(coord, solution[coord].clone())
+        assert board.is_solved
+
+
+class LazyPopulationTest(unittest.TestCase):
+    def test_same_deductions(self):
+        for seed in range(20):
+            board, _ = fuzz.random_board(seed, max_radius=5)
+            lazy = fuzz.copy_board(board)
+            lazy.lazy = True
+            assert set(lazy.solve()) == set(board.solve()), seed
+            assert lazy.tier_stats['populate']['progress'], seed
+
+    def test_nearest_first(self):
+        board, solution = generate.generate_board(radius=6, seed=4)
+        board.lazy = True
+        coord, _ = next(board.solve())
+        board.apply_clicked()
+        board[coord] = solution[coord].clone()
+        board._populate_regions()
+        assert board.remaining is None or board._pending_clues[0] is None
+
+        def distance(clue):
+            return max(abs(a - b) for a, b in zip(clue, coord))
+        hexes = [clue for clue in board._pending_clues if clue in board._board]
+        assert distance(board._pending_clues[-1]) == min(map(distance, hexes))
+
+    def test_needs_populate_tier(self):
+        board, _ = generate.generate_board(radius=3, seed=0)
+        board.lazy = True
+        board.tiers = ('regions', 'constraints')
+        with self.assertRaises(ValueError):
+            next(board.solve())
+
+
+class EliminationTest(unittest.TestCase):
+    def test_beyond_pairs(self):
+        # Subdividing pairs of these regions gets nowhere, but b + f is
+        # 1 + d by the first two, and at most 1 - d - e by the third.
+        import elimination
+
+        regions = {
+            frozenset('abcf'): 2,
+            frozenset('acd'): 1,
+            frozenset('bdef'): 1,
+        }
+        pairs = itertools.permutations(regions.items(), 2)
+        assert not hex_model._subdivide(pairs)[0]
+        assert elimination.forced(regions) == {'d': Color.black, 'e': Color.black}
+
+    def test_nothing_forced(self):
+        import elimination
+
+        assert elimination.forced({frozenset('ab'): 1, frozenset('cd'): 1}) == {}
+
+    def test_finds_more_than_pairs(self):
+        board, _ = fuzz.random_board(58, max_radius=5)
+        pairwise = fuzz.copy_board(board)
+        pairwise.elimination = False
+        found = set(board.solve())
+        assert set(pairwise.solve()) < found
+
+
+class ModelCountTest(unittest.TestCase):
+    def test_brute_force(self):
+        checked = 0
+        for seed in range(40):
+            board, solution = generate.generate_board(
+                radius=2, holes=0.1, reveal=0.5, contiguity=0.6, seed=seed,
+                remaining=bool(seed % 2),
+            )
+            if sum(hex_.color == Color.yellow for hex_ in board._board.values()) > 12:
+                continue
+            checked += 1
+            count = counting.count_models(board)
+            total, probabilities = _brute_force_count(board, solution)
+            assert count.total == total, (seed, count.total, total)
+            for coord, probability in probabilities.items():
+                assert math.isclose(count.probabilities[coord], probability), (seed, coord)
+        assert checked > 10
+
+    def test_forced_matches_solution(self):
+        for seed in range(10):
+            board, solution = generate.generate_board(radius=4, seed=seed)
+            for coord, color in counting.forced(board):
+                assert solution[coord].color == color, (seed, coord)
+
+    def test_forced_includes_solver(self):
+        for seed in range(10):
+            board, _ = generate.generate_board(radius=4, seed=seed)
+            forced = set(counting.forced(board))
+            assert set(board.solve()) <= forced
+
+    def test_contradiction(self):
+        board = _board_from_string("""
+            -
+          x   x
+           {2}
+          x   x
+            x
+        """)
+        with self.assertRaises(counting.ContradictionError):
+            counting.count_models(board)
+
+    def test_budget(self):
+        board, _ = generate.generate_board(radius=4, seed=0)
+        with self.assertRaises(counting.BudgetExhaustedError):
+            counting.count_models(board, util.Budget(steps=1))
+        assert counting.count_models(board, util.Budget(seconds=60)).total
+
+    def test_line(self):
+        board = _board_from_string("""
+           |1
+
+            -
+              -
+            -
+        """)
+        probabilities = counting.count_models(board).probabilities
+        assert sorted(probabilities.values()) == [0.5, 0.5, 0.5]
+
+
+class NeighborTableTest(unittest.TestCase):
+    def test_matches_offsets(self):
+        board, _ = generate.generate_board(radius=4, holes=0.3, seed=1)
+        table = board.neighbor_table
+        for coord in board._board:
+            for distance in (1, 2):
+                expected = {
+                    tuple(map(sum, zip(coord, delta)))
+                    for delta in hex_model.generate_hex_circle(distance)
+                    if any(delta)
+                }
+                assert set(table.neighbors(coord, distance)) == expected & set(board._board)
+            assert table.ring(coord) == tuple(hex_model._ordered_neighbors(coord))
+
+    def test_rebuilt_on_new_hex(self):
+        board = HexBoard()
+        board[0, 0] = Hex('-', Color.yellow)
+        assert board._neighbors((0, 0, 0)) == set()
+        board[1, 0] = Hex('-', Color.yellow)
+        assert board._neighbors((0, 0, 0)) == {(1, 0, -1)}
+
+
+class _ImageBox:
+    def __init__(self, center):
+        self.center = center
+
+
+class RingTableTest(unittest.TestCase):
+    @staticmethod
+    def _ring_boards():
+        """
+        Yield a board for each ring clue and state of its ring, with the clue's value and contiguity.
+        """
+        # Black hexes and missing ones look the same to a ring clue; try
+        # each, on different sides of the ring.
+        unknown = (Color.blue, Color.yellow)
+        colors = [(None,) + unknown] * 3 + [(Color.black,) + unknown] * 3
+        for state in itertools.product(*colors):
+            blues, yellows = state.count(Color.blue), state.count(Color.yellow)
+            if not yellows:
+                continue
+            # Values just out of reach are contradictions.
+            values = range(max(0, blues - 1), min(6, blues + yellows + 1) + 1)
+            for value, contiguous in itertools.product(values, (True, False)):
+                board = HexBoard()
+                board[0, 0, 0] = Hex(hex_model.format_clue(value, contiguous), Color.black)
+                for offset, color in zip(hex_model.RING_OFFSETS, state):
+                    if color:
+                        board[offset] = Hex('-', color)
+                yield board, value, contiguous
+
+    @staticmethod
+    def _brute_force(board, value, contiguous):
+        """
+        Find the ring's hexes colored the same in every coloring of its yellow hexes that fits the clue.
+
+        Returns None if no coloring fits.
+        """
+        ring = [board.get(offset) for offset in hex_model.RING_OFFSETS]
+        yellow = [i for i, hex_ in enumerate(ring) if hex_ and hex_.color == Color.yellow]
+        seen = {i: set() for i in yellow}
+        for bits in itertools.product((False, True), repeat=len(yellow)):
+            blue = [bool(hex_) and hex_.color == Color.blue for hex_ in ring]
+            for i, bit in zip(yellow, bits):
+                blue[i] = bit
+            # Count the runs of blue hexes around the ring, starting
+            # just after a hex that isn't blue.
+            text = ''.join('o' if bit else '.' for bit in blue)
+            if '.' in text:
+                start = text.index('.')
+                text = text[start:] + text[:start]
+            groups = len([run for run in text.split('.') if run])
+            if sum(blue) == value and (groups <= 1) == contiguous:
+                for i, bit in zip(yellow, bits):
+                    seen[i].add(bit)
+        if not any(seen.values()):
+            return None
+        return {
+            (hex_model.RING_OFFSETS[i], Color.blue if bits == {True} else Color.black)
+            for i, bits in seen.items() if len(bits) == 1
+        }
+
+    def test_matches_brute_force(self):
+        """
+        The table, and ring clues solved with it, find exactly what trying every coloring does.
+        """
+        for board, value, contiguous in self._ring_boards():
+            expected = self._brute_force(board, value, contiguous)
+            ring = hex_model.Clue.around(board, (0, 0, 0))
+            yellow, blue = ring._masks(board)
+            forced = hex_model.RING_TABLE[hex_model.ring_index(yellow, blue, value, contiguous)]
+            if expected is None:
+                assert forced == hex_model.RING_CONTRADICTION, board._board
+                with self.assertRaises(AssertionError):
+                    list(ring.solve(board))
+                continue
+            assert {
+                (coord, Color.blue if forced >> i & 1 else Color.black)
+                for i, coord in enumerate(ring.cells) if (forced | forced >> 6) >> i & 1
+            } == expected, board._board
+            assert set(ring.solve(board)) == expected, board._board
+
+    def test_matches_model_counting(self):
+        for board, value, contiguous in self._ring_boards():
+            expected = self._brute_force(board, value, contiguous)
+            if expected is None:
+                with self.assertRaises(counting.ContradictionError):
+                    list(counting.forced(board))
+                continue
+            assert set(counting.forced(board)) == expected, board._board
+
+
+class InputDispatchTest(unittest.TestCase):
+    def test_order_visits_all(self):
+        points = [(0, 0), (10, 0), (5, 0), (20, 0), (15, 0)]
+        order = input_dispatch.order_path(points, start=(0, 0))
+        assert sorted(order) == list(range(len(points)))
+        assert [points[i] for i in order] == sorted(points)
+
+    def test_order_shorter(self):
+        import random
+        rng = random.Random(0)
+        points = [(rng.randrange(1000), rng.randrange(1000)) for _ in range(40)]
+        order = input_dispatch.order_path(points, start=(0, 0))
+        ordered = [points[i] for i in order]
+        assert (
+            input_dispatch.path_length(ordered, start=(0, 0)) <
+            input_dispatch.path_length(points, start=(0, 0))
+        )
+
+    def test_order_empty(self):
+        assert input_dispatch.order_path([]) == []
+
+    def test_dispatch(self):
+        board = HexBoard()
+        board[0, 0] = Hex('-', Color.yellow, image_box=_ImageBox((100, 100)))
+        board[1, 0] = Hex('-', Color.yellow, image_box=_ImageBox((200, 100)))
+        backend = input_dispatch.RecordingBackend(start=(0, 0))
+        stats = input_dispatch.dispatch(
+            board, [((1, 0, -1), Color.black), ((0, 0, 0), Color.blue)], (10, 20), backend,
+        )
+        assert backend.clicks == [
+            input_dispatch.Click(60, 70, 'left'),
+            input_dispatch.Click(110, 70, 'right'),
+        ]
+        assert stats.clicks == 2
+
+
+class PipelineTest(unittest.TestCase):
+    def test_matches_sequential(self):
+        for seed, info_first in itertools.product(range(5), (False, True)):
+            board, solution = generate.generate_board(radius=3, seed=seed)
+            game = fake_game.FakeGame(board, solution)
+            stats = asyncio.run(pipeline.run(
+                board, game, game, settle=0, batch_size=3, info_first=info_first,
+            ))
+            assert stats.clicks == game.clicks
+
+            expected, solution = generate.generate_board(radius=3, seed=seed)
+            game = fake_game.FakeGame(expected, solution)
+            while True:
+                commands = list(expected.solve())
+                if not commands:
+                    break
+                input_dispatch.dispatch(expected, commands, (0, 0), game)
+                for coord, hex_ in game.capture([coord for coord, _ in commands]).items():
+                    expected[coord] = hex_
+
+            for coord in expected._board:
+                assert board[coord].color == expected[coord].color, coord
+
+    def test_solver_settings(self):
+        import argparse
+
+        import main
+
+        args = argparse.Namespace(cache=None, tiers=('regions', 'constraints', 'populate'), lazy=True)
+        board, solution = generate.generate_board(radius=3, seed=0)
+        game = fake_game.FakeGame(board, solution)
+        asyncio.run(pipeline.run(board, game, game, settle=0, solve=main.solver(args)))
+        assert board.lazy and board.tiers == args.tiers
+        assert board.tier_stats['populate']['runs']
+
+    def test_unread_hexes_rendered(self):
+        board, solution = generate.generate_board(radius=4, seed=2)
+        game = fake_game.FakeGame(board, solution)
+        captured = set()
+
+        class Screen:
+            def capture(self, coords):
+                captured.update(coords)
+                return game.capture(coords)
+
+        covered = {coord for coord, hex_ in board._board.items() if hex_.color == Color.yellow}
+        asyncio.run(pipeline.run(board, game, Screen(), settle=0))
+        clicked = covered & game._uncovered
+        assert clicked - captured, "no recapture was skipped"
+        assert not board._clicked
+
+        # Drawn as the game shows them, bar the clues we never read.
+        seen = fuzz.copy_board(board)
+        for coord in game._uncovered:
+            seen[coord] = Hex(board._board[coord].text, solution[coord].color)
+        assert display.display_board(board) == display.display_board(seen)
+        renderer = display.BoardRenderer('small')
+        assert renderer.render(board) == display.BoardRenderer('small').render(seen)
+
+    def test_live_view_current(self):
+        for seed in range(2, 7):
+            board, solution = generate.generate_board(radius=4, seed=seed)
+            game = fake_game.FakeGame(board, solution)
+            renderer = display.BoardRenderer()
+            terminal = _Terminal()
+            terminal.write(renderer.render(board))
+            asyncio.run(pipeline.run(
+                board, game, game, settle=0, batch_size=3,
+                on_batch=lambda board: terminal.write(renderer.render(board)),
+            ))
+            expected = _Terminal()
+            expected.write(display.display_board(board))
+            assert terminal.screen() == expected.screen(), seed
+
+    def test_mistake_surfaces(self):
+        board, _ = generate.generate_board(radius=3, seed=0)
+        coord, color = next(board.solve())
+        board, solution = generate.generate_board(radius=3, seed=0)
+        wrong = Color.black if color == Color.blue else Color.blue
+        solution[coord] = Hex('-', wrong)
+        game = fake_game.FakeGame(board, solution)
+        with self.assertRaises(fake_game.MistakeError):
+            asyncio.run(pipeline.run(board, game, game, settle=0))
+
+
+class ScheduleTest(unittest.TestCase):
+    def setUp(self):
+        self.board = HexBoard()
+        for coord in ((0, 0, 0), (1, 0, -1), (3, 0, -3)):
+            self.board[coord] = Hex('-', Color.yellow)
+        self.board[4, 0, -4] = Hex('0', Color.black)
+
+    def test_information(self):
+        # A black hex's clue counts its neighbors; a blue hex's, the
+        # hexes within two steps.
+        board = self.board
+        assert schedule.information(board, (0, 0, 0), Color.black) > 0
+        assert schedule.information(board, (3, 0, -3), Color.black) == 0
+        assert schedule.information(board, (3, 0, -3), Color.blue) > 0
+
+    def test_plan_turn(self):
+        board, _ = generate.generate_board(radius=5, seed=1)
+        deductions = list(board.solve())
+        now, later = schedule.plan_turn(board, deductions, limit=3)
+        assert len(now) == 3
+        assert sorted(now + later) == sorted(deductions)
+        information = [schedule.information(board, *deduction) for deduction in now + later]
+        assert min(information[:3]) >= max(information[3:])
+
+    def test_worth_reading(self):
+        deductions = [((0, 0, 0), Color.black), ((3, 0, -3), Color.black)]
+        assert schedule.worth_reading(self.board, deductions) == [(0, 0, 0)]
+
+    def test_replay_recorded_level(self):
+        import bench
+
+        board, solution = generate.generate_board(radius=3, lines=0.5, seed=4)
+        assert board.lines
+        with tempfile.TemporaryDirectory() as path:
+            path = os.path.join(path, 'level.txt')
+            with open(path, 'w') as f:
+                f.write('{!r}\n{!r}\n\n{!r}\n'.format(board._board, board.lines, solution))
+            board, solution = bench.load_level(path)
+        assert board.remaining == sum(
+            solution[coord].color == Color.blue
+            for coord, hex_ in board._board.items() if hex_.color == Color.yellow
+        ) > 0
+        game = fake_game.FakeGame(board, solution)
+        bench._replay_turns(board, game, 4, True, False)
+        assert board.is_solved
+
+
+class _Terminal:
+    """
+    Just enough of a terminal to replay the renderer's output.
+    """
+    def __init__(self):
+        self.cells = {}
+        self.line = 0
+        self.column = 0
+        self.style = ''
+
+    def write(self, text):
+        for escape, char in re.findall(r'(\x1b\[[0-9;]*[A-Za-z])|(.)', text, re.DOTALL):
+            if char == '\n':
+                self.line += 1
+                self.column = 0
+            elif char == '\r':
+                self.column = 0
+            elif char:
+                self.cells[self.line, self.column] = char, self.style
+                self.column += 1
+            else:
+                *args, command = escape[2:]
+                arg = ''.join(args)
+                if command == 'm':
+                    self.style = '' if arg == '0' else self.style + arg
+                elif command == 'A':
+                    self.line -= int(arg)
+                elif command == 'B':
+                    self.line += int(arg)
+                elif command == 'G':
+                    self.column = int(arg) - 1
+                elif command == 'K':
+                    for key in [key for key in self.cells if key[0] == self.line]:
+                        del self.cells[key]
+
+    def screen(self):
+        return {key: value for key, value in self.cells.items() if value[0] != ' ' or value[1]}
+
+
+class BoardRendererTest(unittest.TestCase):
+    def assertRedraw(self, layout, full_fn):
+        board, _ = generate.generate_board(radius=4, holes=0.2, seed=2)
+        renderer = display.BoardRenderer(layout)
+        terminal = _Terminal()
+        terminal.write(renderer.render(board))
+        for i, (coord, color) in enumerate(board.solve()):
+            # Clicked hexes are drawn as clicked, applied or not.
+            if i % 2:
+                board.apply_clicked()
+            update = renderer.render(board)
+            assert '\n' not in update
+            terminal.write(update)
+        expected = _Terminal()
+        board.apply_clicked()
+        expected.write(full_fn(board))
+        assert terminal.screen() == expected.screen()
+        assert (terminal.line, terminal.column) == (expected.line, expected.column)
+
+    def test_small(self):
+        self.assertRedraw('small', display.display_board)
+
+    def test_large(self):
+        self.assertRedraw('large', display.display_full_board)
+
+    def test_no_changes(self):
+        board, _ = generate.generate_board(radius=3, seed=0)
+        renderer = display.BoardRenderer()
+        renderer.render(board)
+        assert renderer.render(board) == ''
+
+    def test_new_hex_redraws(self):
+        board, _ = generate.generate_board(radius=3, seed=0)
+        renderer = display.BoardRenderer()
+        renderer.render(board)
+        board[10, 0] = Hex('-', Color.yellow)
+        assert renderer.render(board) == display.display_board(board)
+
+
+def _moved_board(board, transform):
+    """
+    Copy a board with every coordinate and line direction passed through `transform`.
+    """
+    moved = HexBoard(remaining=board.remaining)
+    for coord, hex_ in board._board.items():
+        moved[transform(coord)] = hex_.clone()
+    for coord, clue in board.lines.items():
+        moved.add_line(transform(coord), LineClue(clue.text, transform(clue.direction)))
+    return moved
+
+
+class SolveCacheTest(unittest.TestCase):
+    @staticmethod
+    def _shift(coord):
+        x, y, z = coord
+        return x + 3, y - 5, z + 2
+
+    @staticmethod
+    def _turn(coord):
+        x, y, z = coord
+        return -y, -z, -x
+
+    def test_translation_invariant(self):
+        board, _ = generate.generate_board(radius=3, seed=1)
+        moved = _moved_board(board, self._shift)
+        assert solve_cache.canonicalize(board).key == solve_cache.canonicalize(moved).key
+
+    def test_rotation_optional(self):
+        board, _ = generate.generate_board(radius=3, seed=1)
+        board.add_line((0, -4, 4), LineClue('2', hex_model.LINE_DIRECTIONS['down']))
+        turned = _moved_board(board, self._turn)
+        assert solve_cache.canonicalize(board).key != solve_cache.canonicalize(turned).key
+        assert (
+            solve_cache.canonicalize(board, symmetric=True).key ==
+            solve_cache.canonicalize(turned, symmetric=True).key
+        )
+
+    def test_state_changes_key(self):
+        board, _ = generate.generate_board(radius=3, seed=1)
+        key = solve_cache.canonicalize(board).key
+        coord = next(coord for coord, hex_ in board._board.items() if hex_.color == Color.yellow)
+        board._click(coord, Color.black)
+        assert solve_cache.canonicalize(board).key != key
+
+    def test_settings_change_key(self):
+        board, _ = generate.generate_board(radius=3, seed=1)
+        key = solve_cache.canonicalize(board).key
+        for setting, value in (('tiers', ('regions',)), ('elimination', False), ('max_regions', 10)):
+            other = fuzz.copy_board(board)
+            setattr(other, setting, value)
+            assert solve_cache.canonicalize(other).key != key, setting
+
+    def test_hit_skips_solve(self):
+        with tempfile.TemporaryDirectory() as path:
+            cache = solve_cache.SolveCache(path)
+            board, solution = generate.generate_board(radius=4, seed=2)
+            turned = _moved_board(board, self._turn)
+            expected = list(cache.solve(board))
+            assert expected and cache.misses == 1
+
+            turned.solve = None
+            deductions = list(cache.solve(turned))
+            assert cache.hits == 1
+            assert sorted(deductions) == sorted(
+                (self._turn(coord), color) for coord, color in expected
+            )
+            for coord, color in deductions:
+                assert turned[coord].color == color
+
+    def test_evicts_least_recently_used(self):
+        with tempfile.TemporaryDirectory() as path:
+            cache = solve_cache.SolveCache(path)
+            deductions = [((x, -x, 0), Color.blue) for x in range(10)]
+            for i, key in enumerate('abc'):
+                cache.put(key, deductions)
+                os.utime(os.path.join(path, key + '.json'), (i, i))
+            cache.get('a')
+            cache.max_bytes = 2 * os.path.getsize(os.path.join(path, 'a.json'))
+            cache.put('d', deductions)
+            assert sorted(os.listdir(path)) == ['a.json', 'd.json']
+
+
+class FuzzTest(unittest.TestCase):
+    def test_backends_agree(self):
+        for seed in range(20):
+            board, solution = fuzz.random_board(seed, max_radius=3)
+            problems, _ = fuzz.check_board(board, solution)
+            assert not problems, (seed, problems)
+
+    def test_board_to_string(self):
+        for seed in range(20):
+            board, _ = fuzz.random_board(seed)
+            text = fuzz.board_to_string(board)
+            read = _board_from_string(text, remaining=board.remaining)
+            assert solve_cache.canonicalize(read).key == solve_cache.canonicalize(board).key, text
+
+    def test_shrink(self):
+        def overeager(board):
+            # Wrongly assume every yellow hex next to a blue clue is blue.
+            return [
+                (neighbor, Color.blue)
+                for coord, hex_ in board._board.items()
+                if hex_.color == Color.blue and hex_.value is not None
+                for neighbor in board._neighbors(coord)
+                if board[neighbor].color == Color.yellow
+            ]
+        backends = [
+            backend for backend in fuzz.BACKENDS if backend.name == 'counting'
+        ] + [fuzz.Backend('overeager', overeager, complete=False)]
+        board, solution = fuzz.random_board(0)
+        assert fuzz.check_board(board, solution, backends)[0]
+        shrunk = fuzz.shrink(board, solution, backends)
+        assert fuzz.check_board(shrunk, solution, backends)[0]
+        assert len(shrunk._board) < len(board._board) // 4
+
+
+class ServerTest(unittest.TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = os.path.join(directory.name, 'server.sock')
+        self.server = server.SolveServer(workers=2)
+        loop = asyncio.new_event_loop()
+        listening = threading.Event()
+
+        def serve():
+            try:
+                loop.run_until_complete(self.server.serve(self.path, ready=lambda _: listening.set()))
+            except asyncio.CancelledError:
+                pass
+            loop.close()
+
+        def stop():
+            loop.call_soon_threadsafe(lambda: [task.cancel() for task in asyncio.all_tasks(loop)])
+            thread.join()
+
+        thread = threading.Thread(target=serve)
+        thread.start()
+        self.addCleanup(stop)
+        assert listening.wait(10)
+
+    @staticmethod
+    def _debug_request(seed):
+        board, _ = generate.generate_board(radius=3, seed=seed)
+        text = repr(board._board)
+        return {'format': 'debug', 'board': text, 'remaining': board.remaining}, board
+
+    def test_streams_deductions(self):
+        payload, board = self._debug_request(seed=2)
+        *deductions, done = server.request(payload, self.path)
+        expected = [{'coord': list(coord), 'color': color.name} for coord, color in board.solve()]
+        assert expected and deductions == expected
+        assert done['done'] and done['deductions'] == len(expected)
+        assert done['solved'] == board.is_solved
+        latency = done['latency']
+        assert latency['queued'] <= latency['parse'] <= latency['first_deduction'] <= latency['total']
+
+    def test_concurrent_requests(self):
+        payloads = [self._debug_request(seed)[0] for seed in range(4)]
+        with concurrent.futures.ThreadPoolExecutor(4) as executor:
+            answers = list(executor.map(lambda payload: list(server.request(payload, self.path)), payloads))
+        assert all(answer[-1]['done'] for answer in answers)
+        stats, = server.request({'stats': True}, self.path)
+        assert stats['requests'] == 4 and stats['errors'] == 0
+        assert stats['total_p50'] <= stats['total_p95']
+
+    def test_debug_board_round_trip(self):
+        import main
+
+        board, _ = generate.generate_board(radius=3, lines=0.5, seed=4)
+        assert board.lines
+        text = '{!r}\n{!r}'.format(board._board, board.lines)
+        parsed = main.parse_debug_board(text, remaining=board.remaining)
+        key = solve_cache.canonicalize(board).key
+        assert solve_cache.canonicalize(parsed).key == key
+
+    def test_bad_request(self):
+        answer, = server.request({'format': 'debug', 'board': '__import__("os")'}, self.path)
+        assert 'error' in answer
+        answer, = server.request({'format': 'nonsense'}, self.path)
+        assert 'error' in answer
+
+    def test_client_gone(self):
+        class Writer:
+            closed = False
+
+            def write(self, data):
+                pass
+
+            async def drain(self):
+                raise ConnectionResetError()
+
+            def close(self):
+                self.closed = True
+
+        async def handle(writer):
+            reader = asyncio.StreamReader()
+            reader.feed_data(b'{"stats": true}\n')
+            reader.feed_eof()
+            await server.SolveServer().handle(reader, writer)
+
+        writer = Writer()
+        asyncio.run(handle(writer))
+        assert writer.closed
+
+
+class LabelTest(unittest.TestCase):
+    def test_compact_matches_full(self):
+        import bench
+        import image_parse
+
+        im = bench.synthetic_screenshot(width=600, height=400)
+        full, objects = image_parse.label(im, quiet=True)
+        objects = list(objects)
+        compact, compact_objects = image_parse.label_compact(im, quiet=True)
+        assert compact_objects == objects
+        assert any(full.has_text(box) for box in objects)
+        for box in objects:
+            assert compact.mean_color(box) == full.mean_color(box)
+            assert compact.has_text(box) == full.has_text(box)
+
+    def test_compact_given_boxes(self):
+        import numpy
+
+        import bench
+        import image_parse
+
+        im = bench.synthetic_screenshot(width=600, height=400)
+        box = image_parse.Box(left=10, top=10, right=50, bottom=40)
+        compact, _ = image_parse.label_compact(im, boxes=[box], quiet=True)
+        assert compact.mean_color(box) == tuple(
+            numpy.asarray(im.crop(box)).mean(axis=(0, 1))
+        )
+
+
+    def test_compact_any_label_count(self):
+        import scipy.ndimage
+
+        import bench
+        import image_parse
+
+        im = bench.synthetic_screenshot(width=200, height=200)
+        expected, objects = image_parse.label_compact(im, quiet=True)
+        label = scipy.ndimage.label
+
+        def no_small_types(mask, output=None):
+            if output is not None:
+                raise RuntimeError("insufficient bit-depth")
+            return label(mask)
+
+        with unittest.mock.patch.object(scipy.ndimage, 'label', no_small_types):
+            compact, compact_objects = image_parse.label_compact(im, quiet=True)
+        assert compact_objects == objects
+        assert all(compact.mean_color(box) == expected.mean_color(box) for box in objects)
+
+    def test_quiet(self):
+        import bench
+        import image_parse
+
+        im = bench.synthetic_screenshot(width=200, height=200)
+        for quiet in (False, True):
+            out = io.StringIO()
+            with contextlib.redirect_stdout(out):
+                image_parse.label_compact(im, quiet=quiet)
+            assert bool(out.getvalue()) != quiet
+
+    def test_not_interactive(self):
+        import PIL.Image
+
+        import image_parse
+        import main
+
+        im = PIL.Image.new('RGB', (40, 40))
+        box = image_parse.Box(left=0, top=0, right=20, bottom=20)
+        with contextlib.ExitStack() as stack:
+            stack.enter_context(unittest.mock.patch.object(
+                image_parse, 'get_text_from_image', return_value='%',
+            ))
+            stack.enter_context(unittest.mock.patch.object(
+                image_parse, 'get_texts_from_images', side_effect=lambda images: ['%'] * len(images),
+            ))
+            ask = stack.enter_context(unittest.mock.patch('builtins.input'))
+            with self.assertRaises(ValueError):
+                main.get_image_text(im, box, interactive=False)
+            with self.assertRaises(ValueError):
+                main.get_image_texts(im, [box, box], interactive=False)
+            assert not ask.called
+
+
+class ContactSheetTest(unittest.TestCase):
+    def _glyph(self, color, text):
+        import PIL.Image
+        import PIL.ImageDraw
+
+        im = PIL.Image.new('RGB', (20, 16), color.value)
+        PIL.ImageDraw.Draw(im).text((4, 2), text, fill=(255, 255, 255))
+        return im
+
+    def test_layout(self):
+        import numpy
+
+        import image_parse
+
+        images = [self._glyph(color, str(i)) for i, color in enumerate([Color.blue, Color.black] * 10)]
+        sheet, cells = image_parse.contact_sheet(images)
+        assert len(cells) == len(images)
+        assert len(set(cells)) == len(cells)
+        array = numpy.asarray(sheet)
+        for cell in cells:
+            assert cell.right <= sheet.width and cell.bottom <= sheet.height
+            # Each glyph is dark text on white, whatever the hex's
+            # color, and stays clear of its cell's edges.
+            inside = array[cell.slice]
+            assert (inside == 0).any() and (inside == 255).any()
+            margin = image_parse.SHEET_MARGIN
+            assert (inside[:margin] == 255).all() and (inside[:, :margin] == 255).all()
+
+    def test_assign_tokens(self):
+        import image_parse
+
+        width, height = image_parse.SHEET_CELL
+        cells = [
+            image_parse.Box(left=i * width, top=0, right=(i + 1) * width, bottom=height)
+            for i in range(3)
+        ]
+        words = [
+            # Read out of order, and split in two.
+            ('}', width + 40, 10, 8, 20),
+            ('{3', width + 20, 10, 16, 20),
+            ('2', 20, 10, 8, 20),
+            # Straddling the second and third cells.
+            ('11', 2 * width - 4, 10, 16, 20),
+            ('', 2 * width + 20, 10, 8, 20),
+        ]
+        data = dict(zip(('text', 'left', 'top', 'width', 'height'), map(list, zip(*words))))
+        assert image_parse._assign_tokens(data, cells) == ['2', '{3}', '']
+
+
+class GrayscaleTest(unittest.TestCase):
+    def test_array_matches_image(self):
+        import numpy
+        import PIL.Image
+
+        import image_parse
+
+        rng = numpy.random.default_rng(0)
+        rgb = rng.integers(0, 256, size=(7, 11, 3), dtype=numpy.uint8)
+        im = PIL.Image.fromarray(rgb)
+        assert image_parse._grayscale(rgb) == image_parse._grayscale(im)
+        assert image_parse._grayscale(rgb) == image_parse._grayscale(numpy.asarray(im.convert('L')))
+        # Views, like slices of a whole screenshot, read the same too.
+        assert image_parse._grayscale(rgb[1:5, 2:9]) == image_parse._grayscale(im.crop((2, 1, 9, 5)))
+
+
+class EnginePoolTest(unittest.TestCase):
+    """
+    Drive the engine pool with a stand-in for tesserocr, which needn't be installed.
+    """
+    def setUp(self):
+        import image_parse
+
+        engines = []
+        words = []
+
+        class Word:
+            def __init__(self, text, box):
+                self.text, self.box = text, box
+
+            def GetUTF8Text(self, level):
+                return self.text
+
+            def BoundingBox(self, level):
+                return self.box
+
+        class API:
+            def __init__(self, psm):
+                self.psm = psm
+                self.variables = {}
+                self.ended = False
+                engines.append(self)
+
+            def SetVariable(self, name, value):
+                self.variables[name] = value
+
+            def SetImageBytes(self, data, width, height, bytes_per_pixel, bytes_per_line):
+                self.image = data, width, height, bytes_per_pixel, bytes_per_line
+
+            def GetUTF8Text(self):
+                return '3\n'
+
+            def Recognize(self):
+                pass
+
+            def GetIterator(self):
+                return [Word(*word) for word in words]
+
+            def End(self):
+                self.ended = True
+
+        tesserocr = types.ModuleType('tesserocr')
+        tesserocr.PyTessBaseAPI = API
+        tesserocr.RIL = types.SimpleNamespace(WORD=3)
+        tesserocr.iterate_level = lambda iterator, level: iter(iterator)
+        patch = unittest.mock.patch.dict(sys.modules, {'tesserocr': tesserocr})
+        patch.start()
+        self.addCleanup(patch.stop)
+        for cached in (image_parse.engine_pool, image_parse._read_text):
+            cached.cache_clear()
+            self.addCleanup(cached.cache_clear)
+        self.engines = engines
+        self.words = words
+
+    def test_read(self):
+        import numpy
+
+        import image_parse
+
+        array = numpy.arange(12, dtype=numpy.uint8).reshape(3, 4)
+        assert image_parse.get_text_from_image(array) == '3\n'
+        engine, = self.engines
+        assert engine.psm == image_parse.OCR_PSM
+        assert engine.variables == {'tessedit_char_whitelist': image_parse.OCR_WHITELIST}
+        assert engine.image == (array.tobytes(), 4, 3, 1, 4)
+
+        # The engine is kept, and lent out again.
+        pool = image_parse.engine_pool()
+        assert pool.read((4, 3), bytes(12)) == '3\n'
+        assert pool.engines == 1 and len(self.engines) == 1
+        pool.close()
+        assert engine.ended
+
+    def test_engine_per_reader(self):
+        import image_parse
+
+        pool = image_parse.EnginePool()
+        with pool._checkout((1, 1), b'\0') as first:
+            with pool._checkout((1, 1), b'\0') as second:
+                assert first is not second
+        assert pool.engines == 2
+
+    def test_contact_sheet(self):
+        import PIL.Image
+
+        import image_parse
+
+        images = [PIL.Image.new('L', (10, 16), 255) for _ in range(3)]
+        width, height = image_parse.SHEET_CELL
+        self.words.extend([
+            ('1', (20, 10, 30, 40)),
+            ('}', (2 * width + 40, 10, 48 + 2 * width, 40)),
+            ('{2', (2 * width + 20, 10, 38 + 2 * width, 40)),
+            ('', None),
+        ])
+        assert image_parse.get_texts_from_images(images) == ['1', '', '{2}']
+        engine, = self.engines
+        assert engine.psm == image_parse.SHEET_PSM
+        assert engine.image[1:3] == (3 * width, height)
+
+
+class ImportTimeTest(unittest.TestCase):
+    def test_no_heavy_imports(self):
+        import bench
+        for module in ('hex_model', 'display', 'main'):
+            imported = {name.split('.')[0] for name in bench.import_times(module)}
+            heavy = imported & set(bench.HEAVY_MODULES)
+            assert not heavy, (module, heavy)
+
+
 def run_tests(display_fn):
     loader = unittest.TestLoader()
     SolverUnitTest.set_display_fn(display_fn)
@@ -1,13 +1,17 @@
 import functools
-import signal
 import sys
 import time
 
 
 def timeit(msg):
+    """
+    Print `msg` and how long the decorated function took, unless it's called with `quiet=True`.
+    """
     def decorator(fn):
         @functools.wraps(fn)
-        def anon(*args, **kwargs):
+        def anon(*args, quiet=False, **kwargs):
+            if quiet:
+                return fn(*args, **kwargs)
             print(msg, end='')
             sys.stdout.flush()
             t = time.time()
@@ -78,20 +82,29 @@ class cached_property(object):
         return value
 
 
-class Timeout(object):
-    """
-    http://stackoverflow.com/questions/2281850/timeout-function-if-it-takes-too-long-to-finish/22348885#22348885
+class Budget(object):
     """
-    def __init__(self, seconds=1, error_message='Timeout'):
-        self.seconds = seconds
-        self.error_message = error_message
+    A cooperative limit on work: a number of seconds, a number of steps, or both.
 
-    def handle_timeout(self, signum, frame):
-        raise TimeoutError(self.error_message)
-
-    def __enter__(self):
-        signal.signal(signal.SIGALRM, self.handle_timeout)
-        signal.alarm(self.seconds)
-
-    def __exit__(self, type_, value, traceback):
-        signal.alarm(0)
+    Unlike a signal-based timeout, this works in any thread and to any
+    precision, but the work has to check in: long-running code calls
+    `spend` as it goes, and stops cleanly once the budget is exhausted.
+    With no limits, a budget is never exhausted.
+    """
+    def __init__(self, seconds=None, steps=None):
+        self.deadline = None if seconds is None else time.perf_counter() + seconds
+        self.steps = steps
+
+    @property
+    def exhausted(self):
+        if self.steps is not None and self.steps <= 0:
+            return True
+        return self.deadline is not None and time.perf_counter() >= self.deadline
+
+    def spend(self, steps=1):
+        """
+        Count off some steps of work. Returns False if the budget is now exhausted.
+        """
+        if self.steps is not None:
+            self.steps -= steps
+        return not self.exhausted